@@ -0,0 +1,236 @@
+"""GitML benchmarks.\n
+  Measures save, commit, reuse, ls and load on synthetic projects for
+  every combination of the scenario options, stores the results as JSON
+  and compares them with a baseline. Run with python -m benchmarks.run.
+
+  Usage:
+	benchmarks.run [options]
+
+  Options:
+  --files=<LIST>        Files per project [default: 100,1000].
+  --sizes=<LIST>        File size distributions, small, mixed or large [default: mixed].
+  --iterations=<LIST>   Iterations in the store [default: 10,50].
+  --model-size=<LIST>   Model sizes, i.e 1MB [default: 1MB].
+  --operations=<LIST>   Operations to measure [default: save,ls,load,reuse,commit].
+  --repeat=<N>          Runs per operation, the median is kept [default: 3].
+  --output=<FILE>       Results file [default: benchmark-results.json].
+  --baseline=<FILE>     Results to compare with. Exits with 1 on regressions.
+  --threshold=<RATIO>   Allowed slowdown or growth over the baseline [default: 0.25].
+  --dir=<DIR>           Directory of the synthetic projects, removed afterwards unless given.
+"""
+
+import os
+import sys
+import platform
+from os.path import join as _path_join
+from json import dumps, loads, dump as _json_dump, load as _json_load
+from itertools import product
+from resource import getrusage, RUSAGE_SELF
+from shutil import rmtree as _rmdir
+from tempfile import mkdtemp
+from time import time
+
+from docopt import docopt
+
+import gitml
+from gitml.util import tabulate, log_message, human_size, timestamp
+from gitml.iteration import Iteration, load as load_model
+
+from .synthetic import SyntheticProject, quiet
+
+
+# Differences below these are noise, never regressions.
+NOISE = {"wall_seconds": 0.01, "bytes_written": 64 * 1024,
+	"peak_rss": 4 * 1024 * 1024}
+
+
+def _written_bytes():
+	# Bytes the process passed to write calls, Linux only.
+	try:
+		with open("/proc/self/io") as io_file:
+			for line in io_file:
+				if line.startswith("wchar:"): return int(line.split()[1])
+	except IOError:
+		pass
+	return 0
+
+
+def measure(operation, *args):
+	"""Runs the operation in a forked process, so runs neither share
+	caches nor memory peaks. Returns its wall time, bytes written and
+	peak RSS.
+	"""
+	read_fd, write_fd = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read_fd)
+		try:
+			written, started = _written_bytes(), time()
+			with quiet():
+				try: operation(*args)
+				except SystemExit: pass
+			result = {"wall_seconds": time() - started,
+				"bytes_written": _written_bytes() - written,
+				"peak_rss": getrusage(RUSAGE_SELF).ru_maxrss * 1024}
+		except Exception as e:
+			result = {"error": repr(e)}
+		os.write(write_fd, dumps(result).encode("utf-8"))
+		os._exit(0)
+
+	os.close(write_fd)
+	chunks = []
+	for chunk in iter(lambda: os.read(read_fd, 65536), b""): chunks.append(chunk)
+	os.close(read_fd)
+	os.waitpid(pid, 0)
+	result = loads(b"".join(chunks).decode("utf-8"))
+	if "error" in result:
+		raise RuntimeError("%s failed: %s" % (operation.__name__,
+			result["error"]))
+	return result
+
+
+def _save(project, model):
+	Iteration(project.path).save(params={"run": "benchmark"},
+		metrics={"auc": 0.5}, remarks="benchmark", model=model)
+
+
+def _ls(project):
+	Iteration(project.path).list()
+
+
+def _load(unique_id):
+	load_model(unique_id)
+
+
+def _reuse(project, unique_id):
+	Iteration(project.path).reuse(unique_id, sync=True)
+
+
+def _commit(project, unique_id):
+	Iteration(project.path).commit_many([unique_id])
+
+
+def run_operation(project, name, repeat):
+	runs = []
+	for number in range(repeat):
+		ids = [r["id"] for r in sorted(Iteration(project.path).db.all(),
+			key=lambda r: r["timestamp"])]
+		if name == "save":
+			project.change()
+			runs.append(measure(_save, project, project.model()))
+		elif name == "ls":
+			runs.append(measure(_ls, project))
+		elif name == "load":
+			runs.append(measure(_load, ids[-1]))
+		elif name == "reuse":
+			# Back and forth between the oldest and the latest iteration.
+			runs.append(measure(_reuse, project,
+				ids[0] if number % 2 == 0 else ids[-1]))
+		elif name == "commit":
+			# Committed iterations leave the list, the oldest is next.
+			runs.append(measure(_commit, project, ids[0]))
+		else:
+			raise ValueError("Unknown operation %s." % name)
+
+	median = lambda values: sorted(values)[len(values) // 2]
+	return {"operation": name, "runs": runs,
+		"wall_seconds": median([r["wall_seconds"] for r in runs]),
+		"bytes_written": median([r["bytes_written"] for r in runs]),
+		"peak_rss": max(r["peak_rss"] for r in runs)}
+
+
+def scenario_key(scenario):
+	return ",".join("%s=%s" % (k, scenario[k]) for k in sorted(scenario))
+
+
+def run(scenarios, operations, repeat, base_dir):
+	results = []
+	for number, scenario in enumerate(scenarios):
+		log_message("Scenario %s" % scenario_key(scenario), tag=True)
+		project = SyntheticProject(_path_join(base_dir, "project-%d" % number),
+			seed=number, **scenario).create()
+		os.chdir(project.path)
+		for name in operations:
+			result = run_operation(project, name, repeat)
+			result["scenario"] = scenario
+			results.append(result)
+	return results
+
+
+def compare(results, baseline, threshold):
+	"""Returns rows of the metrics beyond the threshold over the
+	baseline.
+	"""
+	previous = dict(((scenario_key(r["scenario"]), r["operation"]), r)
+		for r in baseline["results"])
+	regressions = []
+	for result in results:
+		base = previous.get((scenario_key(result["scenario"]),
+			result["operation"]))
+		if not base: continue
+		for metric, noise in NOISE.items():
+			old, new = base[metric], result[metric]
+			if new - old > max(noise, old * threshold):
+				regressions.append({"scenario": scenario_key(
+					result["scenario"]), "operation": result["operation"],
+					"metric": metric, "baseline": old, "current": new,
+					"change": "+%.0f%%" % (100.0 * (new - old) / max(old, 1e-9))})
+	return regressions
+
+
+def _display(results):
+	headers = ["scenario", "operation", "wall_seconds", "bytes_written",
+		"peak_rss"]
+	tabulate([{"scenario": scenario_key(r["scenario"]),
+		"operation": r["operation"],
+		"wall_seconds": "%.4f" % r["wall_seconds"],
+		"bytes_written": human_size(r["bytes_written"]),
+		"peak_rss": human_size(r["peak_rss"])} for r in results], headers)
+
+
+def main():
+	req = docopt(__doc__)
+	split = lambda option: [v.strip() for v in req[option].split(",")
+		if v.strip()]
+	scenarios = [{"files": int(files), "sizes": sizes,
+		"iterations": int(iterations), "model_size": model_size}
+		for files, sizes, iterations, model_size in product(
+		split("--files"), split("--sizes"), split("--iterations"),
+		split("--model-size"))]
+	repeat = int(req["--repeat"])
+	operations = split("--operations")
+	if "commit" in operations:
+		# Every commit run takes one more iteration of the store.
+		for scenario in scenarios:
+			scenario["iterations"] = max(scenario["iterations"], repeat + 1)
+
+	output = os.path.abspath(req["--output"])
+	baseline_path = req["--baseline"] and os.path.abspath(req["--baseline"])
+	base_dir = req["--dir"] or mkdtemp(prefix="gitml-benchmark-")
+	cwd = os.getcwd()
+	try:
+		results = run(scenarios, operations, repeat, base_dir)
+	finally:
+		os.chdir(cwd)
+		if not req["--dir"]: _rmdir(base_dir)
+
+	with open(output, "w") as output_file:
+		_json_dump({"version": gitml.__version__, "timestamp": timestamp(),
+			"python": platform.python_version(), "platform": platform.platform(),
+			"results": results}, output_file, indent=1, sort_keys=True)
+	_display(results)
+	log_message("Results written to %s" % output, tag=True)
+
+	if not baseline_path: return
+	with open(baseline_path) as baseline_file:
+		regressions = compare(results, _json_load(baseline_file),
+			float(req["--threshold"]))
+	if not regressions:
+		return log_message("No regressions over %s" % baseline_path, tag=True)
+	tabulate(regressions, ["scenario", "operation", "metric", "baseline",
+		"current", "change"])
+	sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
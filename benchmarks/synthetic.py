@@ -0,0 +1,98 @@
+"""Synthetic gitml projects for the benchmarks."""
+
+import os
+import sys
+from os.path import join as _path_join, dirname as _path_dirname
+from random import Random
+from contextlib import contextmanager
+
+from gitml.project import Project
+from gitml.db import DataModel
+from gitml.scm import Git
+from gitml.util import create_dir_if_not_exist, parse_size
+
+
+@contextmanager
+def quiet():
+	# gitml prints its messages, they are not part of a benchmark.
+	stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+	try: yield
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
+
+class SyntheticProject(object):
+	"""Project of a number of files of a size distribution, with a store
+	of a number of iterations saving models of model_size bytes. Each
+	iteration changes CHANGED_SHARE of the files, as training runs do.
+
+	Size distributions are "small" (1-8 KB), "mixed" (log normal around
+	16 KB, up to 4 MB) and "large" (256 KB-4 MB).
+	"""
+
+	CHANGED_SHARE = 0.02
+
+	DIRS = 8
+
+	def __init__(self, path, files=100, sizes="mixed", iterations=10,
+		model_size="1MB", seed=0):
+		self.path = path
+		self.files = int(files)
+		self.sizes = sizes
+		self.iterations = int(iterations)
+		self.model_size = parse_size(model_size)
+		self.random = Random(seed)
+		self.paths = []
+
+
+	def _file_size(self):
+		if self.sizes == "small": return self.random.randint(1024, 8 * 1024)
+		if self.sizes == "large":
+			return self.random.randint(256 * 1024, 4 * 1024 * 1024)
+		return int(min(4 * 1024 * 1024, self.random.lognormvariate(9.7, 1.2)))
+
+
+	def _write(self, rel_path, size):
+		abs_path = _path_join(self.path, rel_path)
+		create_dir_if_not_exist(_path_dirname(abs_path))
+		with open(abs_path, "wb") as _file: _file.write(os.urandom(size))
+
+
+	def model(self):
+		return os.urandom(self.model_size)
+
+
+	def change(self, share=None):
+		# Rewrites a share of the files, at least one.
+		count = max(1, int(len(self.paths) * (share or self.CHANGED_SHARE)))
+		for rel_path in self.random.sample(self.paths, count):
+			self._write(rel_path, self._file_size())
+		return count
+
+
+	def create(self):
+		create_dir_if_not_exist(self.path)
+		project = Project(self.path)
+		with quiet():
+			project._create_file_with_config({"name": "benchmark",
+				"author": "benchmark"})
+			project._create_dir()
+			DataModel.setup(self.path)
+			Git.init(self.path, Project.GIT_IGNORES)
+
+		for number in range(self.files):
+			rel_path = _path_join("src", "d%d" % (number % self.DIRS),
+				"f%d.py" % number)
+			self._write(rel_path, self._file_size())
+			self.paths.append(rel_path)
+
+		from gitml.iteration import Iteration
+		iteration = Iteration(self.path)
+		with quiet():
+			for number in range(self.iterations):
+				if number: self.change()
+				iteration.save(params={"run": number},
+					metrics={"auc": self.random.random()},
+					remarks="run %d" % number, model=self.model())
+		return self
@@ -1,4 +1,7 @@
-from .iteration import load, State
+from .iteration import (load, load_many, prefetch, select, commit, delete,
+	State)
+from .catalog import select_all
+from .cache import model_cache
 import sys
 
 __version__ = "1.0.0"
@@ -15,5 +18,6 @@ def state(): return State.action(RUN_ACTION)
 
 
 # Methods exposed for using directly on code.
-__all__ = [load, state]
+__all__ = [load, load_many, prefetch, select, commit, delete, state,
+	model_cache, select_all]
 
@@ -0,0 +1,297 @@
+import mmap
+from os import remove, fsync, rename as _rename
+from os.path import dirname as _path_dirname
+from json import dumps as _json_dumps, loads as _json_loads
+from struct import pack as _pack, unpack as _unpack, calcsize
+from pickle import load as model_load
+from zlib import compressobj, decompressobj
+from hashlib import sha1
+from shutil import copyfileobj
+
+from .remote import Remote, RemoteException
+from .delta import ArtifactStream
+from .manifest import Manifest
+from .util import *
+
+
+class BundleException(RemoteException):
+	pass
+
+
+class Bundle(Remote):
+	"""Iterations in a single file, written by gitml export and read by
+	gitml import. The file holds a magic line, the members one after the
+	other and a trailing JSON index:
+
+	{"objects": {<sha1>: [offset, stored size, size, compression]},
+	"records": {<id>: {"kind": .., "record": .., "files": ..}}}
+
+	ended by a fixed size footer with the offset and size of the index.
+	Members are the objects of a remote, stored once by their digest, so
+	a member is read, or memory mapped when stored whole, with one seek.
+	"""
+
+	MAGIC = b"GITML-BUNDLE 1\n"
+
+	# Footer: magic, index offset, index size.
+	FOOTER = ">8sQQ"
+
+	FOOTER_MAGIC = b"GMLINDEX"
+
+	ZLIB = "zlib"
+
+	# Members this big stored whole start on a page, to be memory mapped.
+	ALIGN_SIZE = 64 * 1024
+
+	CHUNK_SIZE = 1024 * 1024
+
+	def _object_key(self, digest):
+		return digest
+
+
+	def has_objects(self, digests):
+		return set(d for d in digests if d in self.objects)
+
+
+	def record_ids(self):
+		return list(self.records)
+
+
+	def get_record(self, unique_id):
+		return self.records[unique_id]
+
+
+class BundleWriter(Bundle):
+	"""Streams objects and records into a new bundle, compressed with
+	zlib if compress. Written to a ".part" file renamed on close, so a
+	bundle is never read half written. Objects are put one at a time.
+	"""
+
+	def __init__(self, path, compress=False):
+		self.path = path
+		self.compress = compress
+		self.objects = {}
+		self.records = {}
+		self.size = 0
+		create_dir_if_not_exist(_path_dirname(path) or ".")
+		self._file = open("%s.part" % path, "wb")
+		self._write(self.MAGIC)
+
+
+	def _write(self, data):
+		self._file.write(data)
+		self.size += len(data)
+
+
+	def _align(self):
+		padding = -self.size % mmap.ALLOCATIONGRANULARITY
+		if padding: self._write(b"\0" * padding)
+
+
+	def put_object(self, digest, source):
+		if digest in self.objects: return
+		source.seek(0, 2)
+		size = source.tell()
+		source.seek(0)
+		compress = self.compress and size > 0
+		if not compress and size >= self.ALIGN_SIZE: self._align()
+
+		offset, hashed = self.size, sha1()
+		compressor = compressobj() if compress else None
+		for chunk in iter(lambda: source.read(self.CHUNK_SIZE), b""):
+			hashed.update(chunk)
+			self._write(compressor.compress(chunk) if compress else chunk)
+		if compress: self._write(compressor.flush())
+		if hashed.hexdigest() != digest:
+			raise BundleException("[GitML] Object %s changed while " % \
+				digest + "exported.")
+		self.objects[digest] = [offset, self.size - offset, size,
+			self.ZLIB if compress else None]
+
+
+	def put_record(self, unique_id, record):
+		self.records[unique_id] = record
+
+
+	def close(self):
+		index = _json_dumps({"objects": self.objects,
+			"records": self.records}).encode("utf-8")
+		offset = self.size
+		self._write(index)
+		self._write(_pack(self.FOOTER, self.FOOTER_MAGIC, offset, len(index)))
+		self._file.flush()
+		fsync(self._file.fileno())
+		self._file.close()
+		_rename("%s.part" % self.path, self.path)
+
+
+	def abort(self):
+		self._file.close()
+		remove("%s.part" % self.path)
+
+
+class _MemberSource(object):
+	# Source of an ArtifactStream over a member. A read of the whole
+	# member is checked against its digest.
+
+	def __init__(self, bundle_file, digest, entry):
+		self.bundle_file = bundle_file
+		self.digest = digest
+		self.offset, self.stored_size, self.size, self.compression = entry
+
+
+	def _stored(self, offset, size):
+		self.bundle_file.seek(self.offset + offset)
+		while size > 0:
+			data = self.bundle_file.read(min(size, Bundle.CHUNK_SIZE))
+			if not data:
+				raise BundleException("[GitML] Truncated bundle.")
+			size -= len(data)
+			yield data
+
+
+	def _decompressed(self):
+		decompressor = decompressobj()
+		for data in self._stored(0, self.stored_size):
+			yield decompressor.decompress(data)
+		yield decompressor.flush()
+
+
+	def read_range(self, offset, size):
+		hashed = sha1() if (offset, size) == (0, self.size) else None
+		if self.compression:
+			# Compressed members are read from their start.
+			pieces, skip = self._decompressed(), offset
+		else:
+			pieces, skip = self._stored(offset, size), 0
+
+		for piece in pieces:
+			if skip:
+				piece, skip = piece[skip:], max(0, skip - len(piece))
+			piece = piece[:size]
+			if not piece: continue
+			if hashed: hashed.update(piece)
+			size -= len(piece)
+			yield piece
+			if not size: break
+		if size > 0: raise BundleException("[GitML] Truncated bundle.")
+		if hashed and hashed.hexdigest() != self.digest:
+			raise BundleException("[GitML] Corrupt object %s in bundle." % \
+				self.digest)
+
+
+	def close(self):
+		self.bundle_file.close()
+
+
+class BundleReader(Bundle):
+	"""Reads the index of a bundle, members are opened in place. Also a
+	readable remote, gitml import pulls from it without copying the
+	objects out first.
+	"""
+
+	readable = True
+
+	def __init__(self, path):
+		self.path = path
+		self._file = open(path, "rb")
+		try:
+			if self._file.read(len(self.MAGIC)) != self.MAGIC:
+				raise BundleException("[GitML] %s is not a gitml bundle." % \
+					path)
+			footer_size = calcsize(self.FOOTER)
+			self._file.seek(-footer_size, 2)
+			magic, offset, size = _unpack(self.FOOTER,
+				self._file.read(footer_size))
+			if magic != self.FOOTER_MAGIC:
+				raise BundleException("[GitML] %s has no index, the " % path + \
+					"export was interrupted.")
+			self._file.seek(offset)
+			index = _json_loads(self._file.read(size).decode("utf-8"))
+		except (IOError, ValueError) as e:
+			self._file.close()
+			raise BundleException("[GitML] Invalid bundle %s, %s." % (path, e))
+		except BundleException:
+			self._file.close()
+			raise
+		self.objects = index["objects"]
+		self.records = index["records"]
+
+
+	def close(self):
+		self._file.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+
+	def open_object(self, digest):
+		if digest not in self.objects:
+			raise BundleException("[GitML] No object %s in bundle." % digest)
+		# Every stream reads through its own file, streams can be
+		# read on threads.
+		return ArtifactStream(_MemberSource(open(self.path, "rb"), digest,
+			self.objects[digest]))
+
+
+	def get_object(self, digest, target):
+		create_dir_if_not_exist(_path_dirname(target))
+		with self.open_object(digest) as source:
+			with open("%s.part" % target, "wb") as part:
+				copyfileobj(source, part, self.CHUNK_SIZE)
+		_rename("%s.part" % target, target)
+
+
+	def resolve(self, unique_id):
+		found = [r for r in self.records if r.startswith(unique_id)]
+		if len(found) != 1:
+			raise BundleException("[GitML] %s iteration %s in bundle." % (
+				"Ambiguous" if found else "No", unique_id))
+		return found[0]
+
+
+	def member(self, unique_id, name):
+		"""Returns the digest of a member of an iteration, "model.pkl",
+		"manifest.json" or "code/<path>".
+		"""
+		files = self.records[self.resolve(unique_id)]["files"]
+		if name in files: return files[name]
+		code_prefix = "code/"
+		if name.startswith(code_prefix):
+			with self.open_object(files[Manifest.FILE_NAME]) as manifest_file:
+				manifest = Manifest(_json_loads(manifest_file.read().decode(
+					"utf-8")))
+			if name[len(code_prefix):] in manifest.entries:
+				return manifest.digest(name[len(code_prefix):])
+		raise BundleException("[GitML] No %s of %s in bundle." % (name,
+			unique_id))
+
+
+	def open(self, unique_id, name):
+		# File object reading a member, without unpacking the bundle.
+		return self.open_object(self.member(unique_id, name))
+
+
+	def map(self, unique_id, name):
+		"""Memory maps a member stored whole and aligned, others are read.
+		Either way the result slices like bytes.
+		"""
+		digest = self.member(unique_id, name)
+		offset, stored_size, size, compression = self.objects[digest]
+		if compression or offset % mmap.ALLOCATIONGRANULARITY or not size:
+			with self.open_object(digest) as member_file:
+				return member_file.read()
+		return mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ,
+			offset=offset)
+
+
+	def load_model(self, unique_id):
+		# Imported here, iterations export and import bundles.
+		from .iteration import Iteration
+		with self.open(unique_id, Iteration.MODEL_FILE_NAME) as model_file:
+			return model_load(model_file)
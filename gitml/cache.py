@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from threading import RLock
+from os import stat as _stat, environ
+from pickle import load as model_load
+
+from .util import file_digest
+from .delta import open_artifact, is_delta, size as artifact_size
+
+
+class ModelCache(object):
+	"""Process wide LRU cache of unpickled models.
+
+	Entries are keyed by the artifact path and invalidated as soon as the
+	file's signature (mtime, size, inode) changes. Memory is accounted using
+	the pickle size on disk, which is a cheap proxy for the in-memory size.
+	"""
+
+	DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+	# Overrides the memory budget, in bytes.
+	ENV_MAX_BYTES = "GITML_CACHE_BYTES"
+
+	def __init__(self, max_bytes=None, verify_hash=False):
+		if max_bytes is None:
+			max_bytes = int(environ.get(self.ENV_MAX_BYTES,
+				self.DEFAULT_MAX_BYTES))
+		self.max_bytes = max_bytes
+		self.verify_hash = verify_hash
+		self._entries = OrderedDict()
+		self._lock = RLock()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+
+	def _signature(self, path):
+		st = _stat(path)
+		return (st.st_mtime, st.st_size, st.st_ino)
+
+
+	def _evict(self, needed=0):
+		# Drops least recently used entries until the budget fits.
+		while self._entries and self.size + needed > self.max_bytes:
+			_, entry = self._entries.popitem(last=False)
+			self.size -= entry["cost"]
+			self.evictions += 1
+
+
+	def _drop(self, path):
+		entry = self._entries.pop(path, None)
+		if entry: self.size -= entry["cost"]
+		return entry
+
+
+	def get(self, path, loader=None):
+		"""Returns the model stored at path, unpickling it on a miss.
+		"""
+		if not loader: loader = _load
+
+		signature = self._signature(path)
+		digest = file_digest(path) if self.verify_hash else None
+
+		with self._lock:
+			entry = self._entries.get(path)
+			if entry and (entry["signature"] != signature
+				or entry["digest"] != digest):
+				self._drop(path)
+				self.invalidations += 1
+				entry = None
+			if entry:
+				# Marks the entry as most recently used.
+				self._entries[path] = self._entries.pop(path)
+				self.hits += 1
+				return entry["model"]
+			self.misses += 1
+
+		model = loader(path)
+		# A delta costs the size of the artifact it rebuilds.
+		cost = artifact_size(path) if is_delta(path) else signature[1]
+
+		# Models bigger than the whole budget are never cached.
+		if cost > self.max_bytes: return model
+
+		with self._lock:
+			self._drop(path)
+			self._evict(cost)
+			self._entries[path] = {
+				"model": model,
+				"signature": signature,
+				"digest": digest,
+				"cost": cost
+			}
+			self.size += cost
+		return model
+
+
+	def invalidate(self, path):
+		with self._lock:
+			return self._drop(path) is not None
+
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.size = 0
+
+
+	def stats(self):
+		with self._lock:
+			return {
+				"entries": len(self._entries),
+				"bytes": self.size,
+				"max_bytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"invalidations": self.invalidations
+			}
+
+
+def _load(path):
+	with open_artifact(path) as model_file:
+		return model_load(model_file)
+
+
+# Shared by every gitml.load call in the process.
+model_cache = ModelCache()
@@ -0,0 +1,311 @@
+import sqlite3
+from os import environ
+from os.path import (
+	join as _path_join,
+	exists as _path_exists,
+	expanduser,
+	abspath,
+	dirname as _path_dirname
+)
+from json import dumps as _json_dumps, loads as _json_loads
+from contextlib import closing
+from numbers import Number
+
+from .exceptions import GitMLException
+from .util import *
+
+
+class CatalogException(GitMLException):
+	pass
+
+
+class Catalog(object):
+	"""Machine wide index of the iterations and commits of all gitml
+	projects, a sqlite database under the home directory. It is opt-in,
+	created by `gitml catalog enable`; projects register with it on init
+	and saves, commits and deletes update it while it exists.
+
+	Params and metrics are rows of a fields table indexed by field and
+	value, so a selector over every project is one indexed lookup
+	instead of a scan of every project's db.
+	"""
+
+	ENV = "GITML_CATALOG"
+
+	DIR_NAME = ".gitml"
+
+	FILE_NAME = "catalog.db"
+
+	SCHEMA = [
+		"CREATE TABLE IF NOT EXISTS projects (path TEXT PRIMARY KEY, "
+			"name TEXT, registered TEXT)",
+		"CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, "
+			"project TEXT, kind TEXT, remarks TEXT, timestamp TEXT, "
+			"record TEXT)",
+		"CREATE TABLE IF NOT EXISTS fields (id TEXT, field TEXT, "
+			"text TEXT, number REAL)",
+		"CREATE INDEX IF NOT EXISTS records_project ON records (project)",
+		"CREATE INDEX IF NOT EXISTS fields_id ON fields (id)",
+		"CREATE INDEX IF NOT EXISTS fields_number ON fields (field, number)",
+		"CREATE INDEX IF NOT EXISTS fields_text ON fields (field, text)"
+	]
+
+	# Selector fields of the records table, others are params and metrics.
+	COLUMNS = ["id", "remarks", "timestamp"]
+
+	OPERATORS = {"=": "=", "!=": "!=", ">": ">", ">=": ">=", "<": "<",
+		"<=": "<="}
+
+	def __init__(self, path=None):
+		self.path = path or self.default_path()
+		if not _path_exists(self.path):
+			raise CatalogException("[GitML] No catalog, enable it with "
+				"gitml catalog enable.")
+		# Concurrent saves of several projects wait for each other.
+		self.connection = sqlite3.connect(self.path, timeout=30)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+
+
+	@classmethod
+	def default_path(cls):
+		return environ.get(cls.ENV) or _path_join(expanduser("~"),
+			cls.DIR_NAME, cls.FILE_NAME)
+
+
+	@classmethod
+	def enabled(cls):
+		return _path_exists(cls.default_path())
+
+
+	@classmethod
+	def create(cls, path=None):
+		path = path or cls.default_path()
+		create_dir_if_not_exist(_path_dirname(path))
+		connection = sqlite3.connect(path)
+		with connection:
+			for statement in cls.SCHEMA: connection.execute(statement)
+		connection.close()
+		return cls(path)
+
+
+	@classmethod
+	def update(cls, method, *args):
+		# No-op unless enabled. Saves and commits never fail on the catalog.
+		if not cls.enabled(): return
+		try:
+			with closing(cls()) as catalog: getattr(catalog, method)(*args)
+		except sqlite3.Error as e:
+			log_message("Catalog not updated, %s." % e, tag=True)
+
+
+	def close(self):
+		self.connection.close()
+
+
+	def register(self, project_path, name=None, iteration_records=[],
+		commit_records=[]):
+		"""Registers a project with all of its records, replacing any
+		previous entries of it.
+		"""
+		project_path = abspath(project_path)
+		with self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO projects "
+				"VALUES (?, ?, ?)", (project_path, name, timestamp()))
+			self._remove_project_records(project_path)
+			self._add(project_path, iteration_records, "iteration")
+			self._add(project_path, commit_records, "commit")
+
+
+	def unregister(self, project_path):
+		project_path = abspath(project_path)
+		with self.connection:
+			self._remove_project_records(project_path)
+			self.connection.execute("DELETE FROM projects WHERE path = ?",
+				(project_path,))
+
+
+	def _remove_project_records(self, project_path):
+		self.connection.execute("DELETE FROM fields WHERE id IN "
+			"(SELECT id FROM records WHERE project = ?)", (project_path,))
+		self.connection.execute("DELETE FROM records WHERE project = ?",
+			(project_path,))
+
+
+	def _fields(self, record):
+		for section in ("params", "metrics"):
+			for key, value in (record.get(section) or {}).items():
+				field = "%s.%s" % (section, key)
+				if isinstance(value, Number):
+					yield (record["id"], field, None, float(value))
+				else:
+					yield (record["id"], field, "%s" % value, None)
+
+
+	def _add(self, project_path, records, kind):
+		records = list(records)
+		if not records: return
+		self._remove([record["id"] for record in records])
+		self.connection.executemany("INSERT INTO records VALUES "
+			"(?, ?, ?, ?, ?, ?)", [(record["id"], project_path, kind,
+			record.get("remarks") or "", record.get("timestamp"),
+			_json_dumps(record)) for record in records])
+		self.connection.executemany("INSERT INTO fields VALUES (?, ?, ?, ?)",
+			[field for record in records for field in self._fields(record)])
+
+
+	def add(self, project_path, records, kind="iteration"):
+		project_path = abspath(project_path)
+		with self.connection:
+			if not self.connection.execute("SELECT 1 FROM projects WHERE "
+				"path = ?", (project_path,)).fetchone(): return
+			self._add(project_path, records, kind)
+
+
+	def _remove(self, unique_ids):
+		for unique_id in unique_ids:
+			self.connection.execute("DELETE FROM fields WHERE id = ?",
+				(unique_id,))
+			self.connection.execute("DELETE FROM records WHERE id = ?",
+				(unique_id,))
+
+
+	def remove(self, unique_ids):
+		with self.connection: self._remove(unique_ids)
+
+
+	def set_kind(self, unique_ids, kind):
+		with self.connection:
+			self.connection.executemany("UPDATE records SET kind = ? "
+				"WHERE id = ?", [(kind, unique_id) for unique_id in unique_ids])
+
+
+	def projects(self):
+		# [(path, name, registered, iterations, commits)]
+		return self.connection.execute("SELECT p.path, p.name, "
+			"p.registered, SUM(r.kind = 'iteration'), SUM(r.kind = 'commit') "
+			"FROM projects p LEFT JOIN records r ON r.project = p.path "
+			"GROUP BY p.path ORDER BY p.path").fetchall()
+
+
+	def _condition(self, field, operator, value):
+		# SQL of a selector condition, with the semantics of Selector:
+		# numbers compare with numbers and strings with strings.
+		name = ".".join(field)
+		if field[0] in self.COLUMNS and len(field) == 1:
+			if operator == "~":
+				return "r.%s LIKE ?" % name, ["%%%s%%" % value]
+			return "r.%s %s ?" % (name, self.OPERATORS[operator]), \
+				["%s" % value]
+		if field[0] not in ("params", "metrics") or len(field) != 2:
+			raise CatalogException("[GitML] Catalog can not select by %s." \
+				% name)
+
+		if operator == "~":
+			return "r.id IN (SELECT id FROM fields WHERE field = ? AND " \
+				"COALESCE(text, number) LIKE ?)", [name, "%%%s%%" % value]
+		column = "number" if isinstance(value, Number) else "text"
+		if column == "number": value = float(value)
+		else: value = "%s" % value
+		return "r.id IN (SELECT id FROM fields WHERE field = ? AND " \
+			"%s %s ?)" % (column, self.OPERATORS[operator]), [name, value]
+
+
+	def query(self, selector=None, sort=None, ascending=False, limit=None,
+		project_path=None):
+		"""Returns [(project path, project name, kind, record)] matching
+		a Selector, across all projects or of project_path. Sorted by
+		sort, a params or metrics field, else newest first.
+		"""
+		sql = ["SELECT r.project, p.name, r.kind, r.record FROM records r "
+			"JOIN projects p ON p.path = r.project"]
+		where, args = [], []
+		for field, operator, value in (selector.conditions if selector else []):
+			condition, condition_args = self._condition(field, operator, value)
+			where.append(condition)
+			args += condition_args
+		if project_path:
+			where.append("r.project = ?")
+			args.append(abspath(project_path))
+
+		order = "DESC" if not ascending else "ASC"
+		if sort:
+			# Records without the field go last.
+			sql.append("LEFT JOIN fields s ON s.id = r.id AND s.field = ?")
+			args.insert(0, sort)
+			order = "s.id IS NULL, s.number IS NULL, s.number %s, " \
+				"s.text %s" % (order, order)
+		else:
+			order = "r.timestamp %s" % order
+		if where: sql.append("WHERE %s" % " AND ".join(where))
+		sql.append("ORDER BY %s" % order)
+		if limit:
+			sql.append("LIMIT ?")
+			args.append(int(limit))
+
+		return [(path, name, kind, _json_loads(record)) for path, name, kind,
+			record in self.connection.execute(" ".join(sql), args)]
+
+
+def _register(catalog, project_path):
+	# Imported here, iterations update the catalog.
+	from .iteration import Iteration
+	from .project import Project
+	iteration = Iteration(project_path)
+	catalog.register(project_path, Project.read_config(project_path).get(
+		"name"), iteration.db.all(), iteration.commit_db.all())
+
+
+def enable(project_path=None):
+	with closing(Catalog.create()) as catalog:
+		if project_path: _register(catalog, project_path)
+	exit_with_message("Catalog enabled at %s." % Catalog.default_path() + \
+		(" Project registered." if project_path else ""))
+
+
+def register(project_path):
+	try:
+		with closing(Catalog()) as catalog: _register(catalog, project_path)
+	except CatalogException as e: exit_with_message(str(e))
+	exit_with_message("Project registered : %s" % project_path)
+
+
+def unregister(project_path):
+	try:
+		with closing(Catalog()) as catalog: catalog.unregister(project_path)
+	except CatalogException as e: exit_with_message(str(e))
+	exit_with_message("Project unregistered : %s" % project_path)
+
+
+def select_all(where=None, sort=None, ascending=False, limit=None):
+	"""Records of all registered projects matching a selector, i.e
+	"params.task=churn", best first by sort, i.e "metrics.auc". Returns
+	[(project path, project name, kind, record)].
+	"""
+	from .selector import Selector
+	with closing(Catalog()) as catalog:
+		return catalog.query(Selector(where) if where else None, sort,
+			ascending, limit)
+
+
+def list_projects():
+	try:
+		with closing(Catalog()) as catalog: projects = catalog.projects()
+	except CatalogException as e: exit_with_message(str(e))
+	if not projects: exit_with_message("No projects registered.")
+	headers = ["path", "name", "registered", "iterations", "commits"]
+	tabulate([dict(zip(headers, [value if value is not None else 0
+		for value in project])) for project in projects], headers)
+
+
+def list_records(where=None, sort=None, ascending=False, limit=None):
+	from .selector import SelectorException
+	try: records = select_all(where, sort, ascending, limit)
+	except (CatalogException, SelectorException) as e:
+		exit_with_message(str(e))
+	if not records: exit_with_message("No iterations found.")
+	headers = ["project", "id", "kind", "params", "metrics", "remarks"]
+	tabulate([dict(zip(headers, (name or path, record["id"], kind,
+		printable_dict(record.get("params") or {}),
+		printable_dict(record.get("metrics") or {}),
+		record.get("remarks") or ""))) for path, name, kind, record in records],
+		headers)
@@ -0,0 +1,182 @@
+from os import remove, fsync, getpid, kill, utime, rename as _rename
+from errno import EPERM
+from os.path import join as _path_join, exists as _path_exists
+from pickle import dumps as model_dumps, HIGHEST_PROTOCOL
+from json import dump as _json_dump, load as _json_load
+from threading import Thread
+from numbers import Number
+
+try:
+	from Queue import Queue
+except ImportError:
+	from queue import Queue
+
+from .exceptions import GitMLException
+from .util import *
+
+
+class CheckpointException(GitMLException):
+	pass
+
+
+class CheckpointPolicy(object):
+	"""Checkpoints kept by the "checkpoints" section in gitml.json. i.e
+
+	"checkpoints": {
+		"keep_last": 3,
+		"keep_best": {"metric": "loss", "count": 1, "order": "asc"}
+	}
+
+	The last keep_last checkpoints and the best ones by metric are kept,
+	every other checkpoint is removed as soon as a new one is written.
+	"""
+
+	SECTION = "checkpoints"
+
+	KEEP_LAST = 3
+
+	def __init__(self, config=None):
+		config = config or {}
+		self.keep_last = int(config.get("keep_last", self.KEEP_LAST))
+		keep_best = config.get("keep_best") or []
+		if isinstance(keep_best, dict): keep_best = [keep_best]
+		self.keep_best = keep_best
+
+
+	@classmethod
+	def from_project_config(cls, config):
+		return cls(config.get(cls.SECTION))
+
+
+	def retained(self, entries):
+		"""Returns the steps to keep of {step: {"metrics": ...}}.
+		"""
+		steps = sorted(entries)
+		kept = set(steps[-self.keep_last:]) if self.keep_last > 0 else set()
+		for rule in self.keep_best:
+			metric = rule["metric"]
+			scored = [s for s in steps if isinstance(
+				(entries[s].get("metrics") or {}).get(metric), Number)]
+			scored.sort(key=lambda s: entries[s]["metrics"][metric],
+				reverse=rule.get("order", "desc") != "asc")
+			kept.update(scored[:int(rule.get("count", 1))])
+		return kept
+
+
+class CheckpointWriter(object):
+	"""Writes the checkpoints of an iteration being trained into its
+	staging directory, so they are saved along with the iteration. The
+	model is pickled on the calling thread, as a consistent snapshot, and
+	written, synced and pruned on a writer thread. One pickle waits while
+	another is written, training only blocks when both are pending.
+
+	A pid file marks the staging directory as in use until close, gc
+	leaves it alone however long the training runs.
+	"""
+
+	DIR_NAME = "checkpoints"
+
+	INDEX_FILE_NAME = "checkpoints.json"
+
+	PID_FILE_NAME = "writer.pid"
+
+	def __init__(self, staging_dir, policy=None):
+		self.staging_dir = staging_dir
+		self.dir = create_dir_if_not_exist(_path_join(staging_dir,
+			self.DIR_NAME))
+		with open(_path_join(staging_dir, self.PID_FILE_NAME), "w") as pid_file:
+			pid_file.write("%d" % getpid())
+		self.policy = policy or CheckpointPolicy()
+		self.entries = {}
+		self.error = None
+		self.queue = Queue(maxsize=1)
+		self.thread = Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+
+	@classmethod
+	def path(cls, artifact_dir, step):
+		return _path_join(artifact_dir, cls.DIR_NAME, "step-%d.pkl" % step)
+
+
+	@classmethod
+	def index(cls, artifact_dir):
+		# {step: {"metrics", "sha1", "size"}} of the retained checkpoints.
+		index_path = _path_join(artifact_dir, cls.DIR_NAME,
+			cls.INDEX_FILE_NAME)
+		if not _path_exists(index_path): return {}
+		with open(index_path) as index_file:
+			return dict((int(step), entry) for step, entry in
+				_json_load(index_file).items())
+
+
+	@classmethod
+	def writing(cls, staging_dir):
+		# True while a live process writes checkpoints into staging_dir.
+		try:
+			with open(_path_join(staging_dir, cls.PID_FILE_NAME)) as pid_file:
+				kill(int(pid_file.read()), 0)
+		except (IOError, ValueError):
+			return False
+		except OSError as e:
+			return e.errno == EPERM
+		return True
+
+
+	def checkpoint(self, model, step, metrics=None):
+		if self.error: raise self.error
+		data = model_dumps(model, HIGHEST_PROTOCOL)
+		self.queue.put((int(step), metrics or {}, data))
+
+
+	def _run(self):
+		while True:
+			item = self.queue.get()
+			if item is None: return
+			if self.error: continue
+			try: self._write(*item)
+			except Exception as e:
+				self.error = CheckpointException(
+					"[GitML] Checkpoint failed: %s" % e)
+
+
+	def _write(self, step, metrics, data):
+		path = self.path(self.staging_dir, step)
+		with HashedWriter(open("%s.tmp" % path, "wb")) as checkpoint_file:
+			checkpoint_file.write(data)
+		_rename("%s.tmp" % path, path)
+		self.entries[step] = {"metrics": metrics,
+			"sha1": checkpoint_file.hexdigest(), "size": checkpoint_file.size}
+
+		retained = self.policy.retained(self.entries)
+		for old_step in [s for s in self.entries if s not in retained]:
+			del self.entries[old_step]
+			old_path = self.path(self.staging_dir, old_step)
+			if _path_exists(old_path): remove(old_path)
+		self._save_index()
+
+
+	def _save_index(self):
+		# The index is replaced atomically after each checkpoint.
+		index_path = _path_join(self.dir, self.INDEX_FILE_NAME)
+		with open("%s.tmp" % index_path, "w") as index_file:
+			_json_dump(dict((str(s), e) for s, e in self.entries.items()),
+				index_file)
+			index_file.flush()
+			fsync(index_file.fileno())
+		_rename("%s.tmp" % index_path, index_path)
+		# The age of a staging directory is its mtime, i.e for gc on
+		# another host.
+		utime(self.staging_dir, None)
+
+
+	def close(self):
+		"""Waits for pending checkpoints. Returns the retained steps.
+		"""
+		self.queue.put(None)
+		self.thread.join()
+		pid_path = _path_join(self.staging_dir, self.PID_FILE_NAME)
+		if _path_exists(pid_path): remove(pid_path)
+		if self.error: raise self.error
+		return sorted(self.entries)
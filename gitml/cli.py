@@ -5,14 +5,30 @@
 	gitml -v | --version
 	gitml init
 	gitml ls | list
-	gitml show <ITERATION-ID>
-	gitml commit <ITERATION-ID>
+	gitml log [<ITERATION-ID>]
+	gitml show (<ID>... | --where=<EXPR>)
+	gitml diff <ITERATION-ID> <OTHER-ITERATION-ID>
+	gitml commit show (<ID>... | --where=<EXPR>)
 	gitml commit ls | commit list
-	gitml commit show <ITERATION-ID>
+	gitml commit (<ID>... | --where=<EXPR>)
+	gitml rm (<ID>... | --where=<EXPR>)
+	gitml search <TERM>... [--limit=<N>] [--rebuild]
+	gitml serve <ID>... [--workers=<N>] [--host=<HOST>] [--port=<PORT>] [--socket=<FILE>] [--batch-size=<N>] [--batch-wait=<MS>]
+	gitml catalog (enable | add | rm | projects)
+	gitml catalog ls [--where=<EXPR>] [--sort=<FIELD>] [--asc] [--limit=<N>]
+	gitml fsck [--workers=<N>]
+	gitml gc [--pack] [--cold-days=<DAYS>] [--prune-stash] [--dry-run]
+	gitml prune [--dry-run]
+	gitml push [--remote=<NAME>] [--workers=<N>] [<ID>...]
+	gitml pull [--remote=<NAME>] [--workers=<N>] [<ID>...]
+	gitml export <ID>... --output=<FILE> [--compress]
+	gitml import <BUNDLE> [--workers=<N>] [<ID>...]
+	gitml daemon (start|stop|status) [--foreground] [--watch]
 	gitml delete
-	gitml stash
-	gitml restore
-	gitml reuse <ITERATION-ID>
+	gitml stash [<NAME>]
+	gitml stash ls | stash list
+	gitml restore [<NAME>] [--force]
+	gitml reuse <ITERATION-ID> [--sync] [--workers=<N>]
 
 
   Options:
@@ -20,10 +36,36 @@
 	-v | --version		Shows the version of your gitml installation.
 	init			Initializes a gitml project on your current directory.
 	ls | list		Lists all iterations.
-	show			Shows the details of the iteration for the ITERATION_ID passed.
-	commit			Commits the iteration available by ITERATION_ID
+	log			Shows the lineage graph of iterations and commits, of ITERATION-ID only if given.
+	show			Shows the details of the iterations for the ids passed or matching --where.
+	diff			Shows changes in params, metrics and code between two iterations.
+	commit			Commits the iterations by ids or --where in a single git commit.
 	commit ls | list	Lists all commited iterations.
-	commit show 	Shows the selected commit by ITERATION_ID.
+	commit show 	Shows the selected commits by ids or --where.
+	rm			Deletes the iterations by ids or --where.
+	search			Finds iterations and commits by words of remarks and params, best first.
+	serve			Serves the models over HTTP and .gitml/serve.sock from forked workers, batching predict requests.
+	--batch-size=<N>	Instances per batch of predict requests, 32 by default.
+	--batch-wait=<MS>	Wait for more requests of a batch, 5 ms by default.
+	catalog			Machine wide catalog of projects. enable creates it, add and rm register the project.
+	catalog ls		Lists iterations and commits of all projects, by --where and best first by --sort.
+	--profile[=<FILE>]	Writes timed spans of the command as JSON lines, to gitml-profile.jsonl by default.
+	--chrome-trace=<FILE>	Writes timed spans of the command as a Chrome trace.
+	--where=<EXPR>		Selects records by conditions, i.e "metrics.auc>=0.9,params.loss=focal".
+	fsck			Verifies iterations and commits against their checksums.
+	gc			Removes unreferenced artifacts. --pack packs small files of cold iterations.
+	prune			Evicts iterations by the retention rules of gitml.json.
+	push			Sends iterations and commits to a remote of gitml.json.
+	pull			Fetches iterations and commits from a remote of gitml.json.
+	export			Writes iterations and commits into a single file bundle.
+	-o <FILE>, --output=<FILE>	Bundle file to write.
+	--compress		Compresses the members of the bundle with zlib.
+	import			Adds the iterations of a bundle, or the ids given, reading only objects missing locally.
+	daemon			Runs a background process serving gitml commands of the project.
+	stash			Moves the workspace into a stash, named by NAME or the time.
+	stash ls | list		Lists the stashes.
+	reuse			Restores the code of an iteration. --sync rewrites only the differing files.
+	restore			Restores the latest stash or NAME. --force overwrites differing files.
 	delete			Deletes the gitml project.
 """
 
@@ -32,19 +74,38 @@ from docopt import docopt
 from . import __version__ as VERSION
 
 from .project import Project
+from . import catalog
 from .iteration import Iteration
+from .daemon import Daemon, DaemonClient
+from .serve import serve
+from .trace import tracer
 from .util import exit_with_message, show_banner
 from os.path import exists as _path_exists
 from json import loads as _json_loads
+import sys
 
 
 PRIMARY_COMMANDS = [
 	"save",
 	"commit",
+	"rm",
+	"search",
+	"catalog",
+	"serve",
 	"reuse",
 	"show",
+	"diff",
 	"ls",
+	"log",
 	"stash",
+	"fsck",
+	"gc",
+	"prune",
+	"push",
+	"pull",
+	"export",
+	"import",
+	"daemon",
 	"list",
 	"-h",
 	"--help",
@@ -97,50 +158,132 @@ def _parse_if_json(jstring):
 	except ValueError: return jstring
 
 
-def dispatch(req):
+def _catalog(req):
+	project_path = Project.closest(quiet=True)
+	if req["enable"]: catalog.enable(project_path)
+	elif req["projects"]: catalog.list_projects()
+	elif req["ls"]:
+		_limit = req["--limit"]
+		catalog.list_records(req["--where"], req["--sort"], req["--asc"],
+			int(_limit) if _limit else None)
+	elif not project_path:
+		exit_with_message("No gitml project found.")
+	elif req["add"]: catalog.register(project_path)
+	else: catalog.unregister(project_path)
+
+
+def dispatch(req, iteration=None):
 	user_selected = _get_user_selected(req)
 
 	if not len(user_selected): help()
 
 	if user_selected[0] == "init": Project().initialize()
 
+	# Catalog commands, inside or outside of projects.
+	if "catalog" in user_selected: return _catalog(req)
+
 	# Scanning for a project.
 	project_path = Project.closest(quiet=True)
 	
 	# if not found ask for an init.
 	if not project_path: Project.confirm_initialize()
-	_iteration = Iteration(project_path=project_path)
+
+	if "daemon" in user_selected:
+		_daemon = Daemon(project_path)
+		if req["start"]: 
+			_daemon.start(foreground=req["--foreground"], watch=req["--watch"])
+		elif req["stop"]: _daemon.stop()
+		else: _daemon.status()
+		return
+
+	_iteration = iteration or Iteration(project_path=project_path)
 
 	# Actions on existing project.
 	if user_selected[0] == "delete": Project(project_path).delete()
 
 	elif "commit" in user_selected:
-		if "show" in user_selected and "<ITERATION-ID>" in req:
-			_iteration.show(req["<ITERATION-ID>"], selected="commits")
-		elif "<ITERATION-ID>" in req:
-			# Fix for ls or list as iteration is.
-			if req["<ITERATION-ID>"] == "ls" or  req["<ITERATION-ID>"] == "list":
-				_iteration.list(selected="commits")
-			else:
-				_iteration.commit(req["<ITERATION-ID>"])
-
-	elif user_selected[0] == "show":
-		if "<ITERATION-ID>" in req and req["<ITERATION-ID>"]:
-			_iteration.show(req["<ITERATION-ID>"])
+		if "show" in user_selected:
+			_iteration.show(req["<ID>"], selected="commits",
+				selector=req["--where"])
+		# Fix for ls or list as iteration id.
+		elif "ls" in user_selected or "list" in user_selected \
+			or req["<ID>"] in (["ls"], ["list"]):
+			_iteration.list(selected="commits")
+		else:
+			_iteration.commit(req["<ID>"], selector=req["--where"])
+
+	elif "show" in user_selected:
+		_iteration.show(req["<ID>"], selector=req["--where"])
+
+	elif "search" in user_selected:
+		_limit = req["--limit"]
+		_iteration.search(" ".join(req["<TERM>"]), 
+			limit=int(_limit) if _limit else 10, rebuild=req["--rebuild"])
+
+	elif "serve" in user_selected:
+		_workers, _port = req["--workers"], req["--port"]
+		_size, _wait = req["--batch-size"], req["--batch-wait"]
+		serve(project_path, req["<ID>"], workers=int(_workers) if _workers \
+			else 2, host=req["--host"] or "127.0.0.1",
+			port=int(_port) if _port else 8000, socket_path=req["--socket"],
+			batch_size=int(_size) if _size else 32,
+			batch_wait=float(_wait) / 1000 if _wait else 0.005)
+
+	elif "rm" in user_selected:
+		_iteration.remove(req["<ID>"], selector=req["--where"])
+
+	elif user_selected[0] == "diff":
+		_iteration.diff(req["<ITERATION-ID>"], req["<OTHER-ITERATION-ID>"])
+
+	elif "log" in user_selected:
+		_iteration.log(req["<ITERATION-ID>"])
 
 	elif user_selected[0] == "ls" or user_selected[0] == "list":
 		_iteration.list()
 
-	elif user_selected[0] == "stash":
-		_iteration.workspace.stash()
+	elif user_selected[0] == "fsck":
+		_workers = req["--workers"]
+		_iteration.fsck(int(_workers) if _workers else None)
+
+	elif "gc" in user_selected:
+		_cold_days = req["--cold-days"]
+		_iteration.gc(pack=req["--pack"], 
+			cold_days=int(_cold_days) if _cold_days else None,
+			dry_run=req["--dry-run"], prune_stash=req["--prune-stash"])
+
+	elif "prune" in user_selected:
+		_iteration.prune(dry_run=req["--dry-run"])
+
+	elif "push" in user_selected or "pull" in user_selected:
+		_workers = req["--workers"]
+		_action = _iteration.push if "push" in user_selected \
+			else _iteration.pull
+		_action(req["--remote"], req["<ID>"], 
+			int(_workers) if _workers else 4)
+
+	elif "export" in user_selected:
+		_iteration.export(req["<ID>"], req["--output"],
+			compress=req["--compress"])
 
-	elif user_selected[0] == "restore":
-		_iteration.workspace.restore()
+	elif "import" in user_selected:
+		_workers = req["--workers"]
+		_iteration.import_bundle(req["<BUNDLE>"], req["<ID>"],
+			int(_workers) if _workers else 4)
 
-	elif user_selected[0] == "reuse":
+	elif "stash" in user_selected:
+		# Fix for ls or list as stash name.
+		if req["<NAME>"] in ("ls", "list"): _iteration.workspace.list_stashes()
+		else: _iteration.stash(req["<NAME>"])
+
+	elif "restore" in user_selected:
+		_iteration.workspace.restore(req["<NAME>"], force=req["--force"])
+
+	elif "reuse" in user_selected:
 		if not req["<ITERATION-ID>"]:
 			exit_with_message("Please provide an iteration id. For help 'gitml -h'. ")
-		_iteration.reuse(req["<ITERATION-ID>"])
+		_workers = req["--workers"]
+		_iteration.reuse(req["<ITERATION-ID>"], sync=req["--sync"],
+			workers=int(_workers) if _workers else 1)
 
 	elif (user_selected[0] == "-v" 
 		or user_selected[0] == "--version"): 
@@ -153,5 +296,53 @@ def dispatch(req):
 	else: help()
 
 
-def main(): dispatch(docopt(__doc__, version=VERSION))
+def _forward(req):
+	# Runs the command on the daemon of the project, if one is running.
+	user_selected = _get_user_selected(req)
+	if not user_selected or set(user_selected) & set(Daemon.LOCAL_COMMANDS):
+		return False
+
+	client = DaemonClient(Project.closest(quiet=True))
+	if not client.available(): return False
+	sys.stdout.write(client.request("cli", argv=sys.argv[1:])["output"])
+	return True
+
+
+def _enable_profile(argv):
+	# --profile[=<FILE>] and --chrome-trace=<FILE> go with any command,
+	# they are taken out before parsing.
+	profile, chrome_trace, rest = None, None, []
+	for arg in argv:
+		if arg == "--profile": profile = tracer.DEFAULT_FILE_NAME
+		elif arg.startswith("--profile="): profile = arg.split("=", 1)[1]
+		elif arg.startswith("--chrome-trace="):
+			chrome_trace = arg.split("=", 1)[1]
+		else: rest.append(arg)
+	if profile or chrome_trace: tracer.enable(profile, chrome_trace)
+	return rest
+
+
+def _expand_short_options(argv):
+	# Option lines are not parsed by docopt, -o <FILE> of gitml export is
+	# spelled as --output=<FILE> of the usage pattern.
+	if not argv or argv[0] != "export": return argv
+	rest, i = [], 0
+	while i < len(argv):
+		arg = argv[i]
+		if arg == "-o" and i + 1 < len(argv):
+			arg, i = "--output=%s" % argv[i + 1], i + 1
+		elif arg.startswith("-o") and len(arg) > 2:
+			arg = "--output=%s" % arg[2:]
+		rest.append(arg)
+		i += 1
+	return rest
+
+
+def main():
+	argv = _expand_short_options(_enable_profile(sys.argv[1:]))
+	req = docopt(__doc__, argv=argv, version=VERSION)
+	# Profiled commands run here, the daemon would not trace them.
+	if tracer.enabled:
+		with tracer.span("cli", command=" ".join(argv)): dispatch(req)
+	elif not _forward(req): dispatch(req)
 
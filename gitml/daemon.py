@@ -0,0 +1,236 @@
+import os
+import sys
+import socket
+from os.path import join as _path_join, exists as _path_exists
+from json import loads, dumps
+from threading import Lock, Thread
+from time import sleep
+
+try:
+	from SocketServer import ThreadingMixIn, UnixStreamServer, \
+		StreamRequestHandler
+	from StringIO import StringIO
+except ImportError:
+	from socketserver import ThreadingMixIn, UnixStreamServer, \
+		StreamRequestHandler
+	from io import StringIO
+
+from .exceptions import GitMLException
+from .project import Project
+from .watch import Watcher, WatchException
+from .util import *
+
+
+class DaemonException(GitMLException):
+	pass
+
+
+class DaemonClient(object):
+	"""Talks to the daemon of a project over its Unix socket. Each
+	request is one JSON line answered by one JSON line.
+	"""
+
+	TIMEOUT = 600
+
+	def __init__(self, project_path):
+		self.project_path = project_path
+		self.socket_path = Daemon.socket_path(project_path)
+
+
+	def available(self):
+		if not self.project_path or not _path_exists(self.socket_path):
+			return False
+		try: self.request("ping")
+		except (socket.error, DaemonException): return False
+		return True
+
+
+	def request(self, op, **kwargs):
+		kwargs["op"] = op
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		client.settimeout(self.TIMEOUT)
+		try:
+			client.connect(self.socket_path)
+			client.sendall((dumps(kwargs) + "\n").encode("utf-8"))
+			reader = client.makefile("rb")
+			line = reader.readline()
+			reader.close()
+		finally:
+			client.close()
+		if not line: raise DaemonException("[GitML] No reply from daemon.")
+		response = loads(line.decode("utf-8"))
+		if "error" in response: raise DaemonException(response["error"])
+		return response
+
+
+class _Handler(StreamRequestHandler):
+
+	def handle(self):
+		line = self.rfile.readline()
+		if not line: return
+		try:
+			response = self.server.daemon.handle(loads(line.decode("utf-8")))
+		except Exception as e:
+			response = {"error": "[GitML] %s" % e}
+		self.wfile.write((dumps(response) + "\n").encode("utf-8"))
+
+
+class _Server(ThreadingMixIn, UnixStreamServer):
+	daemon_threads = True
+
+
+class Daemon(object):
+	"""Long running process of a project. It keeps the records, the id
+	index, the ignore patterns and the stat cache of the workspace in
+	memory and serves CLI and library requests over a Unix socket.
+	Requests changing the project are serialized with a lock.
+	"""
+
+	SOCKET_FILE_NAME = "daemon.sock"
+
+	PID_FILE_NAME = "daemon.pid"
+
+	LOG_FILE_NAME = "daemon.log"
+
+	# Commands run by the CLI itself, they prompt, manage the daemon or
+	# take paths relative to the working directory.
+	LOCAL_COMMANDS = ["init", "delete", "daemon", "catalog", "serve",
+		"export", "import", "-h", "--help", "-v", "--version"]
+
+	def __init__(self, project_path):
+		self.project_path = project_path
+		self.lock = Lock()
+		self.iteration = None
+		self.server = None
+
+
+	@classmethod
+	def socket_path(cls, project_path):
+		return _path_join(project_path or "", Project.VML_DIR_NAME,
+			cls.SOCKET_FILE_NAME)
+
+
+	def _path(self, file_name):
+		return _path_join(self.project_path, Project.VML_DIR_NAME, file_name)
+
+
+	def pid(self):
+		try:
+			with open(self._path(self.PID_FILE_NAME)) as pid_file:
+				return int(pid_file.read().strip())
+		except (IOError, ValueError):
+			return None
+
+
+	def handle(self, request):
+		op = request.get("op")
+		if op == "ping": return {"pid": os.getpid()}
+		if op == "stop":
+			Thread(target=self.server.shutdown).start()
+			return {"stopped": True}
+
+		with self.lock:
+			if op == "save": return self._save(request)
+			if op == "cli": return self._cli(request)
+		return {"error": "[GitML] Unknown daemon request %s." % op}
+
+
+	def _save(self, request):
+		# The client pickled the model into the staging directory.
+		unique_id = self.iteration.save(params=request.get("params") or {},
+			metrics=request.get("metrics") or {},
+			remarks=request.get("remarks") or "",
+			unique_id=request["id"], staged_model=request["model"])
+		return {"id": unique_id}
+
+
+	def _cli(self, request):
+		# Runs a gitml command on the resident iteration, capturing the
+		# output it prints.
+		from .cli import __doc__ as usage, dispatch
+		from docopt import docopt
+
+		stdout, sys.stdout = sys.stdout, StringIO()
+		try:
+			try: dispatch(docopt(usage, argv=request["argv"]), self.iteration)
+			except SystemExit: pass
+			output = sys.stdout.getvalue()
+		finally:
+			sys.stdout = stdout
+		return {"output": output}
+
+
+	def _daemonize(self):
+		if os.fork(): os._exit(0)
+		os.setsid()
+		if os.fork(): os._exit(0)
+		log = open(self._path(self.LOG_FILE_NAME), "a")
+		devnull = open(os.devnull, "r")
+		os.dup2(devnull.fileno(), 0)
+		os.dup2(log.fileno(), 1)
+		os.dup2(log.fileno(), 2)
+
+
+	def start(self, foreground=False, watch=False):
+		if DaemonClient(self.project_path).available():
+			exit_with_message("Daemon is running already (pid %s)." % \
+				self.pid())
+
+		socket_path = self.socket_path(self.project_path)
+		# Left by a daemon that did not stop cleanly.
+		if _path_exists(socket_path): os.remove(socket_path)
+
+		if not foreground:
+			log_message("Daemon started on %s" % socket_path, tag=True)
+			self._daemonize()
+		os.chdir(self.project_path)
+
+		from .iteration import Iteration
+		self.iteration = Iteration(self.project_path, cached=True)
+		self.iteration.persist_stat_cache = False
+		if watch: self._watch()
+
+		self.server = _Server(socket_path, _Handler)
+		self.server.daemon = self
+		os.chmod(socket_path, 0o600)
+		with open(self._path(self.PID_FILE_NAME), "w") as pid_file:
+			pid_file.write(str(os.getpid()))
+
+		try: self.server.serve_forever()
+		finally: self._cleanup()
+
+
+	def _watch(self):
+		# Saves then look at the edited paths only.
+		try:
+			self.iteration.watcher = Watcher(self.project_path,
+				self.iteration._code_ignores).start()
+		except WatchException as e:
+			log_message("%s Saves will scan the workspace." % e)
+
+
+	def _cleanup(self):
+		self.server.server_close()
+		if self.iteration.watcher: self.iteration.watcher.stop()
+		if self.iteration.stat_cache: self.iteration.stat_cache.save()
+		for file_name in (self.SOCKET_FILE_NAME, self.PID_FILE_NAME):
+			if _path_exists(self._path(file_name)):
+				os.remove(self._path(file_name))
+
+
+	def stop(self):
+		client = DaemonClient(self.project_path)
+		if not client.available(): exit_with_message("No daemon running.")
+		client.request("stop")
+		# Waits for the socket to go away, at most a few seconds.
+		for _ in range(50):
+			if not _path_exists(client.socket_path): break
+			sleep(0.1)
+		exit_with_message("Daemon stopped.")
+
+
+	def status(self):
+		if not DaemonClient(self.project_path).available():
+			exit_with_message("No daemon running.")
+		exit_with_message("Daemon running (pid %s) on %s" % (self.pid(),
+			self.socket_path(self.project_path)))
@@ -0,0 +1,118 @@
+from os import walk as _walk, stat as _stat
+from os.path import (
+	join as _path_join,
+	relpath as _relpath,
+	isdir,
+	isfile,
+	sep
+)
+from hashlib import sha1
+
+from .db import DataModel
+from .manifest import StatCache
+from .util import *
+
+
+class DataFingerprint(object):
+	"""Fingerprints of the paths of the "data" section in gitml.json. i.e
+
+	"data": ["data/train.csv", "data/images"]
+
+	Files up to FULL_HASH_SIZE are hashed whole. Larger files are
+	fingerprinted by their size, mtime and the hashes of SAMPLES blocks
+	at fixed offsets. Fingerprints are cached by stat, so an unchanged
+	file is never read again.
+	"""
+
+	SECTION = "data"
+
+	CACHE_FILE_NAME = "data.json"
+
+	FULL_HASH_SIZE = 64 * 1024 * 1024
+
+	BLOCK_SIZE = 64 * 1024
+
+	SAMPLES = 16
+
+	def __init__(self, project_path, paths=None, stat_cache=None):
+		self.project_path = project_path
+		if paths and not isinstance(paths, list): paths = [paths]
+		self.paths = paths or []
+		self.stat_cache = stat_cache
+
+
+	@classmethod
+	def from_project_config(cls, project_path, config, stat_cache=None):
+		return cls(project_path, config.get(cls.SECTION), stat_cache)
+
+
+	def enabled(self):
+		return bool(self.paths)
+
+
+	def _sampled_digest(self, path, size, mtime):
+		# Size, mtime, then blocks at evenly spaced offsets including the
+		# first and the last one.
+		_hash = sha1(("%d %r\n" % (size, mtime)).encode("utf-8"))
+		step = (size - self.BLOCK_SIZE) // (self.SAMPLES - 1)
+		with open(path, "rb") as data_file:
+			for sample in range(self.SAMPLES):
+				data_file.seek(sample * step)
+				_hash.update(data_file.read(self.BLOCK_SIZE))
+		return "s:%s" % _hash.hexdigest()
+
+
+	def _file_digest(self, path):
+		st = _stat(path)
+		digest = self.stat_cache.lookup(path, st.st_size, st.st_mtime)
+		if digest: return digest
+
+		if st.st_size <= self.FULL_HASH_SIZE: digest = file_digest(path)
+		else: digest = self._sampled_digest(path, st.st_size, st.st_mtime)
+		self.stat_cache.update(path, st.st_size, st.st_mtime, digest)
+		return digest
+
+
+	def _path_digest(self, path, seen):
+		abs_path = _path_join(self.project_path, path)
+		if isfile(abs_path):
+			seen.append(abs_path)
+			return self._file_digest(abs_path)
+		if not isdir(abs_path): return None
+
+		# Directories hash the relative paths and digests of their files.
+		_hash = sha1()
+		for dir_path, dir_names, file_names in _walk(abs_path,
+			followlinks=True):
+			dir_names.sort()
+			for file_name in sorted(file_names):
+				file_path = _path_join(dir_path, file_name)
+				if not isfile(file_path): continue
+				seen.append(file_path)
+				rel_path = _relpath(file_path, abs_path).replace(sep, "/")
+				_hash.update(("%s %s\n" % (rel_path,
+					self._file_digest(file_path))).encode("utf-8"))
+		return _hash.hexdigest()
+
+
+	def fingerprints(self):
+		"""Returns {data path: fingerprint}, None for missing paths.
+		"""
+		if not self.enabled(): return {}
+		if not self.stat_cache:
+			self.stat_cache = StatCache(_path_join(self.project_path,
+				DataModel.DATA_DIR, self.CACHE_FILE_NAME))
+
+		seen, fingerprints = [], {}
+		for path in self.paths:
+			fingerprints[path] = self._path_digest(path, seen)
+		self.stat_cache.retain(seen)
+		self.stat_cache.save()
+		return fingerprints
+
+
+def short_fingerprint(fingerprint):
+	# Display form, i.e "s:3fa2c1d04b5e".
+	if not fingerprint: return "missing"
+	if fingerprint.startswith("s:"): return fingerprint[:14]
+	return fingerprint[:12]
@@ -1,9 +1,66 @@
 from os.path import join as _path_join, exists as _path_exists
+from os import rename as _rename, stat as _stat
 from codecs import open
+from bisect import insort
 from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+from tinydb.middlewares import CachingMiddleware
 
+from .exceptions import GitMLException
 from .util import *
 
+
+class ReloadingCache(CachingMiddleware):
+	"""Serves reads from memory and writes to disk at once. The file is
+	opened and read again when its mtime or size changes, i.e written by
+	gitml.delete or an import while the daemon runs, so the daemon never
+	writes back stale records. on_reload runs after the file was read
+	again.
+	"""
+
+	WRITE_CACHE_SIZE = 1
+
+	def __init__(self, storage_cls=JSONStorage):
+		super(ReloadingCache, self).__init__(storage_cls)
+		self.path = None
+		self.storage_args = None
+		self.signature = None
+		self.on_reload = None
+
+
+	def __call__(self, path, *args, **kwargs):
+		self.path = path
+		self.storage_args = (args, kwargs)
+		return super(ReloadingCache, self).__call__(path, *args, **kwargs)
+
+
+	def _signature(self):
+		st = _stat(self.path)
+		return (st.st_mtime, st.st_size)
+
+
+	def read(self):
+		signature = self._signature()
+		if signature == self.signature and self.cache is not None:
+			return self.cache
+		reloaded = self.signature is not None
+		if reloaded:
+			# The open handle may still read what this process wrote.
+			args, kwargs = self.storage_args
+			self.storage.close()
+			self.storage = self._storage_cls(self.path, *args, **kwargs)
+		self.cache = None
+		data = super(ReloadingCache, self).read()
+		self.signature = signature
+		if reloaded and self.on_reload: self.on_reload()
+		return data
+
+
+	def flush(self):
+		super(ReloadingCache, self).flush()
+		self.signature = self._signature()
+
+
 class DataModel(object):
 
 	MODELS = [
@@ -34,14 +91,155 @@ class DataModel(object):
 			self.DATA_DIR, "%s.json" % model_name)
 
 
-	def __init__(self, project_path, model_name):
+	def __init__(self, project_path, model_name, cached=False):
 		self.model = model_name.strip().lower()
 		self.project = project_path
 		# TinyDB instance using db file.
 		self.path = self.db_path(self.project, self.model)
-		self.db = TinyDB(self.path)
+		if not cached:
+			self.db = TinyDB(self.path)
+			return
+		# Reads are served from memory, writes still go to disk at once.
+		storage = ReloadingCache(JSONStorage)
+		self.db = TinyDB(self.path, storage=storage)
+		storage.on_reload = self._reset_tables
+
+
+	def _reset_tables(self):
+		# Tables cache query results and the last document id, both
+		# stale once another process wrote the file.
+		for table in self.db._table_cache.values():
+			table.clear_cache()
+			table._init_last_id(table._read())
 
 
 	def __call__(self):
 		return self.db
 
+
+
+class AmbiguousIdException(GitMLException):
+	pass
+
+
+class IdIndex(object):
+	"""Sorted index of iteration and commit ids kept in the data 
+	directory. Every entry is a fixed width line "<id> <kind>", so a
+	prefix is resolved by binary search on the file in O(log n) seeks,
+	without loading the index or the dbs.
+	"""
+
+	FILE_NAME = "ids.idx"
+
+	ID_LENGTH = 32
+
+	# Same as git, shorter prefixes are not resolved.
+	MIN_PREFIX = 4
+
+	KINDS = {
+		"i": "iteration",
+		"c": "commit"
+	}
+
+	def __init__(self, project_path):
+		self.project = project_path
+		self.path = _path_join(project_path, DataModel.DATA_DIR,
+			self.FILE_NAME)
+		self.width = self.ID_LENGTH + 3
+		if not _path_exists(self.path): self.rebuild()
+
+
+	def _line(self, unique_id, kind):
+		return "%s %s\n" % (unique_id, kind[0])
+
+
+	def _read_all(self):
+		with open(self.path, "r", "utf-8") as index_file:
+			return index_file.read().splitlines(True)
+
+
+	def _write_all(self, lines):
+		# Replaces the index atomically.
+		temp_path = "%s.tmp" % self.path
+		with open(temp_path, "w", "utf-8") as index_file:
+			index_file.write("".join(lines))
+		_rename(temp_path, self.path)
+
+
+	def rebuild(self):
+		lines = []
+		for kind in ("iteration", "commit"):
+			db_path = _path_join(self.project, DataModel.DATA_DIR,
+				"%s.json" % kind)
+			if not _path_exists(db_path): continue
+			for record in DataModel(self.project, kind)().all():
+				if len(record["id"]) != self.ID_LENGTH: continue
+				lines.append(self._line(record["id"], kind))
+		self._write_all(sorted(set(lines)))
+		return len(lines)
+
+
+	def add(self, unique_id, kind="iteration"):
+		return self.add_many([unique_id], kind) == 1
+
+
+	def add_many(self, unique_ids, kind="iteration"):
+		# One rewrite of the index for all ids.
+		unique_ids = set(i for i in unique_ids if len(i) == self.ID_LENGTH)
+		if not unique_ids: return 0
+		lines = [l for l in self._read_all()
+			if l[:self.ID_LENGTH] not in unique_ids]
+		for unique_id in unique_ids: insort(lines, self._line(unique_id, kind))
+		self._write_all(lines)
+		return len(unique_ids)
+
+
+	def remove(self, unique_id):
+		return self.remove_many([unique_id])
+
+
+	def remove_many(self, unique_ids):
+		unique_ids = set(unique_ids)
+		lines = self._read_all()
+		remaining = [l for l in lines 
+			if l[:self.ID_LENGTH] not in unique_ids]
+		if len(remaining) != len(lines): self._write_all(remaining)
+		return len(lines) - len(remaining)
+
+
+	def matches(self, prefix, limit=5):
+		"""Returns up to limit (id, kind) entries starting with prefix.
+		"""
+		prefix = prefix.strip().lower()
+		if len(prefix) < self.MIN_PREFIX: return []
+
+		with open(self.path, "rb") as index_file:
+			index_file.seek(0, 2)
+			lo, hi = 0, index_file.tell() // self.width
+			# Lower bound of the prefix.
+			while lo < hi:
+				mid = (lo + hi) // 2
+				index_file.seek(mid * self.width)
+				entry = index_file.read(self.ID_LENGTH).decode("ascii")
+				if entry < prefix: lo = mid + 1
+				else: hi = mid
+
+			found = []
+			index_file.seek(lo * self.width)
+			while len(found) < limit:
+				line = index_file.read(self.width).decode("ascii")
+				if not line.startswith(prefix): break
+				found.append((line[:self.ID_LENGTH],
+					self.KINDS[line[self.ID_LENGTH + 1]]))
+		return found
+
+
+	def resolve(self, prefix):
+		"""Returns the (id, kind) of a unique prefix, None if nothing
+		matches.
+		"""
+		found = self.matches(prefix)
+		if len(found) > 1:
+			raise AmbiguousIdException("[GitML] Ambiguous id %s. " % prefix + \
+				"Candidates: %s" % ", ".join(f[0] for f in found))
+		return found[0] if found else None
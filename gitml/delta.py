@@ -0,0 +1,449 @@
+from os import remove, sep, rename as _rename
+from os.path import (
+	join as _path_join,
+	exists as _path_exists,
+	abspath,
+	getsize
+)
+from json import dumps as _json_dumps, loads as _json_loads
+from re import compile as _re_compile
+from zlib import crc32
+from bisect import bisect_right
+from hashlib import sha1
+
+from .exceptions import GitMLException
+from .project import Project
+from .db import IdIndex
+from .manifest import Manifest
+from .store import PackStore
+
+
+class DeltaException(GitMLException):
+	pass
+
+
+class DeltaPolicy(object):
+	"""Delta encoding by the "deltas" section in gitml.json. i.e
+
+	"deltas": {"max_chain": 8, "min_size": 65536}
+
+	Models and code files bigger than min_size are stored as deltas
+	against the same artifact of the parent iteration, every max_chain
+	generations a full copy. A max_chain of 0 stores every artifact
+	whole.
+	"""
+
+	SECTION = "deltas"
+
+	MAX_CHAIN = 8
+
+	# Smaller code files are stored whole, gc packs them.
+	MIN_SIZE = 64 * 1024
+
+	# Bigger artifacts are stored whole, encoding reads both in memory.
+	MAX_SIZE = 512 * 1024 * 1024
+
+	# Deltas bigger than this share of the artifact are not worth a chain.
+	MAX_RATIO = 0.5
+
+	def __init__(self, config=None):
+		config = config or {}
+		self.max_chain = int(config.get("max_chain", self.MAX_CHAIN))
+		self.min_size = int(config.get("min_size", self.MIN_SIZE))
+		self.max_size = int(config.get("max_size", self.MAX_SIZE))
+		self.max_ratio = float(config.get("max_ratio", self.MAX_RATIO))
+
+
+	@classmethod
+	def from_project_config(cls, config):
+		return cls(config.get(cls.SECTION))
+
+
+	def enabled(self):
+		return self.max_chain > 0
+
+
+class FileSource(object):
+	# Artifact stored whole.
+
+	BLOCK_SIZE = 1024 * 1024
+
+	depth = 0
+
+	def __init__(self, path):
+		self.path = path
+		self.size = getsize(path)
+		self._file = None
+
+
+	def read_range(self, offset, size):
+		if not self._file: self._file = open(self.path, "rb")
+		self._file.seek(offset)
+		while size > 0:
+			data = self._file.read(min(size, self.BLOCK_SIZE))
+			if not data:
+				raise DeltaException("[GitML] Truncated artifact %s." % \
+					self.path)
+			size -= len(data)
+			yield data
+
+
+	def close(self):
+		if self._file: self._file.close()
+		self._file = None
+
+
+class BytesSource(object):
+	# Artifact read whole, i.e from a pack.
+
+	depth = 0
+
+	def __init__(self, data):
+		self.data = data
+		self.size = len(data)
+
+
+	def read_range(self, offset, size):
+		yield self.data[offset:offset + size]
+
+
+	def close(self):
+		pass
+
+
+class DeltaSource(object):
+	"""Artifact stored as a delta against the same artifact of the parent
+	iteration. The file holds a magic line, a JSON header line and the
+	inserted bytes:
+
+	{"parent": <ID>, "path": <path in the iteration>, "depth": <N>,
+	"size": <bytes>, "ops": [[kind, offset, length], ...]}
+
+	Ops are copies of a range of the parent or inserts of a range of the
+	inserted bytes, in the order of the artifact. Any range of the
+	artifact is read through the ops down the chain, without writing any
+	intermediate artifact.
+	"""
+
+	SUFFIX = ".delta"
+
+	MAGIC = b"GITML-DELTA 1\n"
+
+	COPY, INSERT = 0, 1
+
+	def __init__(self, path, resolver):
+		self.path = path
+		self.resolver = resolver
+		self._file = open(path, "rb")
+		if self._file.readline() != self.MAGIC:
+			self._file.close()
+			raise DeltaException("[GitML] Invalid delta %s." % path)
+		self.header = _json_loads(self._file.readline().decode("utf-8"))
+		self.data_offset = self._file.tell()
+		self.ops = self.header["ops"]
+		self.size = self.header["size"]
+		self.starts, start = [], 0
+		for kind, offset, length in self.ops:
+			self.starts.append(start)
+			start += length
+		self._parent = None
+
+
+	def parent(self):
+		if not self._parent:
+			self._parent = self.resolver.parent_source(self.path,
+				self.header["parent"], self.header["path"])
+		return self._parent
+
+
+	@property
+	def depth(self):
+		# Deltas down to a whole artifact. The depth of the header is the
+		# one on write, a parent may have been stored whole since.
+		return self.parent().depth + 1
+
+
+	def _inserted(self, offset, size):
+		self._file.seek(self.data_offset + offset)
+		while size > 0:
+			data = self._file.read(min(size, FileSource.BLOCK_SIZE))
+			if not data:
+				raise DeltaException("[GitML] Truncated delta %s." % self.path)
+			size -= len(data)
+			yield data
+
+
+	def read_range(self, offset, size):
+		position = bisect_right(self.starts, offset) - 1
+		while size > 0 and 0 <= position < len(self.ops):
+			kind, source_offset, length = self.ops[position]
+			skip = offset - self.starts[position]
+			count = min(length - skip, size)
+			pieces = self.parent().read_range(source_offset + skip, count) \
+				if kind == self.COPY else self._inserted(source_offset + skip,
+				count)
+			for piece in pieces: yield piece
+			offset += count
+			size -= count
+			position += 1
+		if size > 0:
+			raise DeltaException("[GitML] Truncated delta %s." % self.path)
+
+
+	def close(self):
+		self._file.close()
+		if self._parent: self._parent.close()
+
+
+class ArtifactStream(object):
+	"""Read only file object over a source, i.e for pickle.load. Pieces
+	are pulled from the source as they are read, a seek starts reading
+	at the offset.
+	"""
+
+	def __init__(self, source):
+		self.source = source
+		self.seek(0)
+
+
+	def seek(self, offset, whence=0):
+		if whence == 1: offset += self.tell()
+		elif whence == 2: offset += self.source.size
+		offset = min(max(0, offset), self.source.size)
+		self._pieces = self.source.read_range(offset,
+			self.source.size - offset)
+		# Offset of the current piece in the artifact.
+		self._start = offset
+		self._buffer = b""
+		self._position = 0
+
+
+	def tell(self):
+		return self._start + self._position
+
+
+	def _more(self):
+		# Moves on to the next piece, the current one was read.
+		piece = next(self._pieces, None)
+		if piece is None: return False
+		self._start += len(self._buffer)
+		self._buffer, self._position = piece, 0
+		return True
+
+
+	def read(self, size=-1):
+		if size is None or size < 0: size = self.source.size - self.tell()
+		# Joined once, big reads stay linear in the number of pieces.
+		chunks = []
+		while size > 0:
+			if self._position == len(self._buffer) and not self._more(): break
+			data = self._buffer[self._position:self._position + size]
+			self._position += len(data)
+			size -= len(data)
+			chunks.append(data)
+		return b"".join(chunks)
+
+
+	def readline(self):
+		chunks = []
+		while True:
+			end = self._buffer.find(b"\n", self._position)
+			end = len(self._buffer) if end < 0 else end + 1
+			chunks.append(self._buffer[self._position:end])
+			self._position = end
+			if chunks[-1].endswith(b"\n") or not self._more(): break
+		return b"".join(chunks)
+
+
+	def close(self):
+		self.source.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+
+class ArtifactResolver(object):
+	"""Opens artifacts of a project stored whole, as deltas or in packs.
+	Parents are found through the id index, so deltas stay valid when
+	their parent is committed.
+	"""
+
+	def __init__(self, project_path):
+		self.project_path = project_path
+		self.index = IdIndex(project_path)
+		self.packs = PackStore(project_path)
+
+
+	@classmethod
+	def for_path(cls, path):
+		# Artifacts are stored at <project>/.gitml/<dir>/<id>/...
+		separator = "%s%s%s" % (sep, Project.VML_DIR_NAME, sep)
+		parts = abspath(path).split(separator)
+		if len(parts) < 2:
+			raise DeltaException("[GitML] Not an artifact %s." % path)
+		return cls(separator.join(parts[:-1]))
+
+
+	def artifact_dir(self, unique_id):
+		# Imported here, iterations read and write deltas.
+		from .iteration import Iteration
+		found = self.index.resolve(unique_id)
+		if not found:
+			raise DeltaException("[GitML] Missing parent iteration %s." % \
+				unique_id)
+		return Iteration._artifact_dir(self.project_path, *found)
+
+
+	def source(self, path, digest=None):
+		# Source of the artifact at path, whole, as a delta or packed.
+		if _path_exists(path): return FileSource(path)
+		if _path_exists(path + DeltaSource.SUFFIX):
+			return DeltaSource(path + DeltaSource.SUFFIX, self)
+		if digest and self.packs.has(digest):
+			return BytesSource(self.packs.read(digest))
+		raise DeltaException("[GitML] Missing artifact %s." % path)
+
+
+	def parent_source(self, path, parent_id, rel_path):
+		artifact_dir = self.artifact_dir(parent_id)
+		digest = None
+		# Packed code files are found by their digest in the manifest.
+		code_prefix = "code/"
+		if rel_path.startswith(code_prefix):
+			manifest_path = _path_join(artifact_dir, Manifest.FILE_NAME)
+			if _path_exists(manifest_path):
+				digest = Manifest.load(manifest_path).digest(
+					rel_path[len(code_prefix):])
+		return self.source(_path_join(artifact_dir, rel_path), digest)
+
+
+# Content defined chunks: lines, cut at 4KB. Boundaries follow the
+# content, so an insertion only changes the chunks around it.
+_CHUNK = _re_compile(b"[^\n]{0,4095}\n?")
+
+
+def _chunks(data):
+	for match in _CHUNK.finditer(data):
+		if match.end() > match.start(): yield match.start(), match.end()
+
+
+def encode(parent, target):
+	"""Returns (ops, inserted bytes) turning parent into target, both
+	bytes. Chunks of target found in parent are copied.
+	"""
+	index = {}
+	for start, end in _chunks(parent):
+		index.setdefault((crc32(parent[start:end]), end - start), start)
+
+	ops, inserted, inserted_size = [], [], 0
+	for start, end in _chunks(target):
+		chunk, length = target[start:end], end - start
+		offset = index.get((crc32(chunk), length))
+		if offset is not None and parent[offset:offset + length] == chunk:
+			last = ops[-1] if ops else None
+			if last and last[0] == DeltaSource.COPY and \
+				last[1] + last[2] == offset:
+				last[2] += length
+			else:
+				ops.append([DeltaSource.COPY, offset, length])
+			continue
+		if ops and ops[-1][0] == DeltaSource.INSERT: ops[-1][2] += length
+		else: ops.append([DeltaSource.INSERT, inserted_size, length])
+		inserted.append(chunk)
+		inserted_size += length
+	return ops, b"".join(inserted)
+
+
+def write_delta(target_path, delta_path, rel_path, parent_id, parent,
+	policy):
+	"""Writes the file at target_path as a delta against the parent
+	source. Returns the size written, None when the artifact is better
+	stored whole: too small or big, too different or at the end of a
+	chain.
+	"""
+	size = getsize(target_path)
+	if (not policy.enabled() or parent.depth + 1 > policy.max_chain
+		or size > policy.max_size or parent.size > policy.max_size):
+		return None
+
+	with open(target_path, "rb") as target_file: target = target_file.read()
+	ops, inserted = encode(b"".join(parent.read_range(0, parent.size)),
+		target)
+	header = _json_dumps({"parent": parent_id, "path": rel_path,
+		"depth": parent.depth + 1, "size": size, "ops": ops})
+	if len(header) + len(inserted) > size * policy.max_ratio: return None
+
+	temp_path = "%s.tmp" % delta_path
+	with open(temp_path, "wb") as delta_file:
+		delta_file.write(DeltaSource.MAGIC)
+		delta_file.write(header.encode("utf-8") + b"\n")
+		delta_file.write(inserted)
+	_rename(temp_path, delta_path)
+	return len(DeltaSource.MAGIC) + len(header) + 1 + len(inserted)
+
+
+def is_delta(path):
+	return path.endswith(DeltaSource.SUFFIX)
+
+
+def stored_path(path):
+	# Path the artifact is stored at, whole or as a delta.
+	if not _path_exists(path) and _path_exists(path + DeltaSource.SUFFIX):
+		return path + DeltaSource.SUFFIX
+	return path
+
+
+def open_artifact(path):
+	"""File object reading the artifact at path, given as stored or
+	whole.
+	"""
+	if not is_delta(path): path = stored_path(path)
+	if not is_delta(path): return open(path, "rb")
+	return ArtifactStream(DeltaSource(path, ArtifactResolver.for_path(path)))
+
+
+def depth(path):
+	# Deltas down to a whole artifact, 0 for one stored whole.
+	path = stored_path(path)
+	if not is_delta(path): return 0
+	source = DeltaSource(path, ArtifactResolver.for_path(path))
+	try: return source.depth
+	finally: source.close()
+
+
+def size(path):
+	# Size of the whole artifact, from the header of a delta.
+	if not is_delta(path): return getsize(path)
+	with open(path, "rb") as delta_file:
+		delta_file.readline()
+		return _json_loads(delta_file.readline().decode("utf-8"))["size"]
+
+
+def digest(path):
+	# sha1 of the whole artifact.
+	hashed = sha1()
+	with open_artifact(path) as artifact:
+		for piece in iter(lambda: artifact.read(FileSource.BLOCK_SIZE), b""):
+			hashed.update(piece)
+	return hashed.hexdigest()
+
+
+def materialize(delta_path):
+	"""Stores the artifact of a delta whole, in place of the delta, so it
+	no longer depends on its parent.
+	"""
+	path = delta_path[:-len(DeltaSource.SUFFIX)]
+	temp_path = "%s.tmp" % path
+	with open_artifact(delta_path) as artifact:
+		with open(temp_path, "wb") as whole:
+			for piece in iter(lambda: artifact.read(FileSource.BLOCK_SIZE),
+				b""):
+				whole.write(piece)
+	_rename(temp_path, path)
+	remove(delta_path)
+	return path
@@ -0,0 +1,165 @@
+from multiprocessing import Pool, cpu_count
+from os import listdir, stat as _stat
+from os.path import join as _path_join, exists as _path_exists, isdir
+from hashlib import sha1
+
+from .db import DataModel
+from .manifest import Manifest, StatCache
+from .store import PackStore
+from .delta import DeltaSource, DeltaException, is_delta, stored_path, \
+	digest as artifact_digest
+from .util import *
+
+
+def _stat_and_digest(key):
+	# Runs on the pool workers. Key is a file path or the location
+	# (pack path, offset, size) of a packed object.
+	path = key[0] if isinstance(key, tuple) else key
+	try: st = _stat(path)
+	except OSError: return (key, None, None, None)
+
+	if is_delta(path):
+		# Digest of the artifact, read through its chain.
+		try: digest = artifact_digest(path)
+		except (DeltaException, IOError, OSError, ValueError, KeyError):
+			digest = ""
+		return (key, st.st_size, st.st_mtime, digest)
+	if not isinstance(key, tuple):
+		return (key, st.st_size, st.st_mtime, file_digest(path))
+
+	with open(path, "rb") as pack:
+		pack.seek(key[1])
+		digest = sha1(pack.read(key[2])).hexdigest()
+	return (key, st.st_size, st.st_mtime, digest)
+
+
+def _cache_key(key):
+	if isinstance(key, tuple): return "%s@%d" % key[:2]
+	return key
+
+
+class Fsck(object):
+	"""Verifies the artifacts of every iteration and commit against the
+	checksums recorded on save. Files are hashed in parallel on a process
+	pool and files unchanged since their last verification are skipped.
+	"""
+
+	CACHE_FILE_NAME = "fsck.json"
+
+	def __init__(self, iteration, workers=None):
+		self.iteration = iteration
+		self.project_path = iteration.project_path
+		self.workers = workers or cpu_count()
+		self.packs = PackStore(self.project_path)
+		self.cache = StatCache(_path_join(self.project_path,
+			DataModel.DATA_DIR, self.CACHE_FILE_NAME))
+		self.missing = []
+		self.corrupt = []
+		self.orphan_dirs = []
+		self.orphan_records = []
+		self.verified = 0
+
+
+	def _records(self):
+		for kind, _db in (("iteration", self.iteration.db),
+			("commit", self.iteration.commit_db)):
+			for record in _db.all():
+				yield kind, record
+
+
+	def _expected_digests(self, artifact_dir, record):
+		# {path: digest}. A None digest only checks the file exists.
+		# Code files moved to a pack are checked in the pack.
+		checksums = record.get("checksums") or {}
+		model_name = self.iteration.MODEL_FILE_NAME
+		expected = {
+			stored_path(_path_join(artifact_dir, model_name)):
+				checksums.get(model_name)
+		}
+
+		manifest_path = _path_join(artifact_dir, Manifest.FILE_NAME)
+		if not _path_exists(manifest_path): return expected
+		expected[manifest_path] = checksums.get(Manifest.FILE_NAME)
+
+		try: manifest = Manifest.load(manifest_path)
+		except ValueError:
+			self.corrupt.append(manifest_path)
+			return expected
+
+		code_path = _path_join(artifact_dir, self.iteration.CODE_DIR_NAME)
+		for rel_path in manifest.entries:
+			digest = manifest.digest(rel_path)
+			path = _path_join(code_path, rel_path)
+			if _path_exists(path + DeltaSource.SUFFIX):
+				path += DeltaSource.SUFFIX
+			elif not _path_exists(path) and self.packs.has(digest):
+				path = self.packs.objects[digest]
+			expected[path] = digest
+		return expected
+
+
+	def _scan_records(self):
+		expected, live = {}, set()
+		for kind, record in self._records():
+			artifact_dir = self.iteration._artifact_dir(self.project_path,
+				record["id"], kind)
+			live.add(artifact_dir)
+			if not isdir(artifact_dir):
+				self.orphan_records.append("%s %s" % (kind, record["id"]))
+				continue
+			expected.update(self._expected_digests(artifact_dir, record))
+
+		# Directories without a record, i.e failed or deleted saves.
+		for parent in (self.iteration.dir, self.iteration.commit_dir):
+			if not isdir(parent): continue
+			for name in sorted(listdir(parent)):
+				if _path_join(parent, name) not in live:
+					self.orphan_dirs.append(_path_join(parent, name))
+		return expected
+
+
+	def _check(self, key, expected, digest):
+		self.verified += 1
+		if digest != expected: self.corrupt.append(_cache_key(key))
+
+
+	def run(self):
+		expected = self._scan_records()
+
+		pending = []
+		for key, digest in expected.items():
+			path = key[0] if isinstance(key, tuple) else key
+			try: st = _stat(path)
+			except OSError:
+				self.missing.append(_cache_key(key))
+				continue
+			if digest is None: continue
+			cached = self.cache.lookup(_cache_key(key), st.st_size,
+				st.st_mtime)
+			if cached: self._check(key, digest, cached)
+			else: pending.append(key)
+
+		if pending:
+			pool = Pool(max(1, min(self.workers, len(pending))))
+			try:
+				for key, size, mtime, digest in pool.imap_unordered(
+					_stat_and_digest, pending, chunksize=16):
+					if digest is None:
+						self.missing.append(_cache_key(key))
+						continue
+					self.cache.update(_cache_key(key), size, mtime, digest)
+					self._check(key, expected[key], digest)
+			finally:
+				pool.close()
+				pool.join()
+
+		self.cache.retain([_cache_key(k) for k in expected])
+		self.cache.save()
+		return self
+
+
+	def problems(self):
+		return (["missing        %s" % p for p in sorted(self.missing)]
+			+ ["corrupt        %s" % p for p in sorted(self.corrupt)]
+			+ ["orphan dir     %s" % p for p in self.orphan_dirs]
+			+ ["orphan record  %s" % r for r in self.orphan_records])
@@ -0,0 +1,143 @@
+from os import listdir, remove
+from os.path import (
+	join as _path_join,
+	exists as _path_exists,
+	isdir,
+	getmtime,
+	getsize
+)
+from shutil import rmtree as _rmdir
+from datetime import datetime, timedelta
+from time import time
+
+from .db import DataModel
+from .checkpoint import CheckpointWriter
+from .util import *
+
+
+class GarbageCollector(object):
+	"""Mark and sweep of the .gitml store. Live records mark their
+	artifact directories and the packed objects their manifests refer
+	to, everything else is swept. Small code files of cold iterations
+	are moved into pack files, those of commits stay tracked by git.
+	"""
+
+	# Partial saves younger than this might still be running.
+	GRACE_SECONDS = 3600
+
+	# Only files up to this size are packed.
+	SMALL_FILE_SIZE = 64 * 1024
+
+	COLD_DAYS = 14
+
+	# Packs are rewritten once this share of their bytes is dead.
+	REPACK_RATIO = 0.5
+
+	def __init__(self, iteration, dry_run=False):
+		self.iteration = iteration
+		self.packs = iteration.packs
+		self.dry_run = dry_run
+		self.live = {}
+		self.live_objects = set()
+		self.swept = []
+		self.repacked = []
+		self.packed_files = 0
+		self.packed_bytes = 0
+
+
+	def mark(self):
+		it = self.iteration
+		for kind, _db in (("iteration", it.db), ("commit", it.commit_db)):
+			for record in _db.all():
+				artifact_dir = it._artifact_dir(it.project_path,
+					record["id"], kind)
+				if not isdir(artifact_dir): continue
+				self.live[artifact_dir] = (kind, record)
+				manifest = it._manifest(record["id"], kind)
+				self.live_objects.update(
+					entry[1] for entry in manifest.entries.values())
+		return self
+
+
+	def _sweep_path(self, path):
+		size = dir_size(path) if isdir(path) else getsize(path)
+		self.swept.append((path, size))
+		if self.dry_run: return
+		if isdir(path): _rmdir(path)
+		else: remove(path)
+
+
+	def sweep(self):
+		it, now = self.iteration, time()
+
+		# Iteration directories without a record.
+		for parent in (it.dir, it.commit_dir):
+			if not isdir(parent): continue
+			for name in sorted(listdir(parent)):
+				path = _path_join(parent, name)
+				if path in self.live: continue
+				if name.endswith(it.PARTIAL_SUFFIX) and (now - getmtime(path)
+					< self.GRACE_SECONDS or CheckpointWriter.writing(path)):
+					continue
+				self._sweep_path(path)
+
+		# Interrupted writes of packs and data files.
+		data_dir = _path_join(it.project_path, DataModel.DATA_DIR)
+		for path in self.packs.garbage() + [_path_join(data_dir, n)
+			for n in listdir(data_dir) if n.endswith(".tmp")]:
+			self._sweep_path(path)
+
+		# Packs mostly made of objects no manifest refers to.
+		for pack_path, (count, dead_bytes, size) in sorted(
+			self.packs.dead(self.live_objects).items()):
+			if dead_bytes < size * self.REPACK_RATIO: continue
+			self.repacked.append((pack_path, count, dead_bytes))
+			if not self.dry_run:
+				self.packs.repack(pack_path, self.live_objects)
+
+		if not self.dry_run: it.index.rebuild()
+		return self
+
+
+	def pack(self, cold_days=None):
+		it = self.iteration
+		if cold_days is None: cold_days = self.COLD_DAYS
+		cutoff = (datetime.now() - timedelta(days=cold_days)).strftime(
+			"%Y%m%d%H%M%S")
+
+		objects = []
+		for artifact_dir, (kind, record) in sorted(self.live.items()):
+			# Commits are tracked by git, their files stay in place.
+			if kind == "commit" or record["timestamp"] > cutoff: continue
+			code_path = _path_join(artifact_dir, it.CODE_DIR_NAME)
+			manifest = it._manifest(record["id"], kind)
+			for rel_path, (size, digest) in manifest.entries.items():
+				path = _path_join(code_path, rel_path)
+				if size > self.SMALL_FILE_SIZE: continue
+				if not _path_exists(path): continue
+				objects.append((digest, path))
+				self.packed_files += 1
+				self.packed_bytes += size
+
+		if self.dry_run or not objects: return self
+
+		self.packs.write_pack(objects)
+		# Loose files go once their content is safely packed.
+		for digest, path in objects:
+			if self.packs.has(digest): remove(path)
+		for artifact_dir in self.live:
+			code_path = _path_join(artifact_dir, it.CODE_DIR_NAME)
+			if isdir(code_path): remove_empty_dirs(code_path)
+		return self
+
+
+	def report(self):
+		prefix = "Would" if self.dry_run else "Did"
+		lines = ["remove  %s (%s)" % (p, human_size(s))
+			for p, s in self.swept]
+		lines += ["repack  %s (%d dead objects, %s)" % (p, c, human_size(s))
+			for p, c, s in self.repacked]
+		lines.append("%s free %s. %s pack %d files (%s)." % (prefix,
+			human_size(sum(s for _, s in self.swept)), prefix,
+			self.packed_files, human_size(self.packed_bytes)))
+		return "\n".join(lines)
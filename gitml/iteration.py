@@ -18,19 +18,44 @@ Command: `python model.py serve`
 
 
 from shutil import (copy2 as _file_copy, 
-	copytree as _dir_copy, ignore_patterns,
-	rmtree as _rmdir, move)
-from tinydb import TinyDB, Query, where
-from os.path import join as _path_join, exists as _path_exists
+	rmtree as _rmdir, move, copyfileobj)
+from tinydb import Query, where
+from os.path import (join as _path_join, exists as _path_exists,
+	dirname as _path_dirname, basename, isdir, isfile, islink, getmtime,
+	getsize)
 from pickle import dump as model_dump, load as model_load
-from os import remove, listdir
-from distutils.dir_util import copy_tree as _dir_copy_contents
+from os import (remove, removedirs, listdir, stat, walk,
+	rename as _rename, link as _link)
+from multiprocessing.pool import ThreadPool
+from threading import Thread
+from difflib import unified_diff
+from collections import OrderedDict
+from json import dumps as json_dumps, loads as json_loads
+from datetime import datetime
 
 
 from .exceptions import GitMLException
 from .project import Project
-from .db import DataModel
+from .db import DataModel, IdIndex, AmbiguousIdException
 from .scm import Git
+from .cache import model_cache
+from .manifest import Manifest, StatCache
+from .dataset import DataFingerprint, short_fingerprint
+from .fsck import Fsck
+from .store import PackStore
+from .garbage import GarbageCollector
+from .retention import RetentionPolicy
+from .remote import Remote, Sync, RemoteException
+from .bundle import BundleWriter, BundleReader
+from .daemon import DaemonClient
+from .selector import Selector, SelectorException
+from .checkpoint import CheckpointWriter, CheckpointPolicy
+from .trace import tracer
+from .search import SearchIndex
+from .catalog import Catalog
+from .delta import (DeltaPolicy, DeltaException, DeltaSource,
+	ArtifactResolver, write_delta, open_artifact, stored_path, materialize,
+	depth as delta_depth)
 from .util import *
 
 
@@ -49,7 +74,20 @@ class Iteration(object):
 
 	MODEL_FILE_NAME = "model.pkl"
 
-	DISPLAY_COLS = ["id", "params", "metrics", "remarks"]
+	# Suffix of iteration directories still being written.
+	PARTIAL_SUFFIX = ".partial"
+
+	CODE_DIR_NAME = "code"
+
+	STAT_CACHE_FILE_NAME = "stat.json"
+
+	# Iteration the workspace was last saved as or restored from.
+	HEAD_FILE_NAME = "head.json"
+
+	# Ids shown by gitml log.
+	SHORT_ID_LENGTH = 8
+
+	DISPLAY_COLS = ["id", "params", "metrics", "remarks", "data"]
 
 	CODE_ARCHIVE_IGNORE = [
 		".git", ".gitml", 
@@ -57,7 +95,7 @@ class Iteration(object):
 	]
 
 
-	def __init__(self, project_path=None):
+	def __init__(self, project_path=None, cached=False):
 
 		# If not project path given, find the closest.
 		if not project_path:
@@ -74,10 +112,21 @@ class Iteration(object):
 		self.workspace = Workspace(self.project_path, 
 			self.CODE_ARCHIVE_IGNORE)
 
-		self.db = DataModel(self.project_path, "iteration")()
-		self.commit_db = DataModel(self.project_path, "commit")()
+		with tracer.span("db.open"):
+			self.db = DataModel(self.project_path, "iteration", cached)()
+			self.commit_db = DataModel(self.project_path, "commit", cached)()
+		self.index = IdIndex(self.project_path)
+		self.packs = PackStore(self.project_path)
 		self.query = Query()
 
+		# Kept across saves by long running processes, i.e the daemon.
+		self.stat_cache = None
+		self.persist_stat_cache = True
+		self.watcher = None
+		self._ignores = (None, None)
+		self._workspace = None
+		self._last_saved = None
+
 		self.dir = _path_join(self.project_path, 
 			Project.VML_DIR_NAME, self.DIR_NAME)
 
@@ -85,18 +134,27 @@ class Iteration(object):
 			Project.VML_DIR_NAME, self.COMMIT_DIR)
 
 
-	def _create_record(self, unique_id, params, metrics, remarks):
+	def _create_record(self, unique_id, params, metrics, remarks,
+		checksums={}, size=0, data={}, checkpoints=[], parent=None):
 
 		record = {
 			"id": unique_id, 
 			"params": params, 
 			"metrics": metrics, 
 			"remarks": remarks, 
+			"checksums": checksums,
+			"size": size,
+			"data": data,
+			"checkpoints": checkpoints,
+			"parent": parent,
 			"timestamp": timestamp() 
 		}
 
 		if not self.db.insert(record):
 			return None
+		self.index.add(unique_id, "iteration")
+		self._search_index().add(record).flush()
+		Catalog.update("add", self.project_path, [record])
 		return record
 
 
@@ -104,6 +162,35 @@ class Iteration(object):
 		return self.db.remove(where("id") == unique_id)
 
 
+	def _delete_iterations(self, unique_ids):
+		# Removes iterations with their records and index entries.
+		# Children stored as deltas against them are stored whole first.
+		deleted = set(unique_ids)
+		for kind, _db in (("iteration", self.db), ("commit", self.commit_db)):
+			for record in _db.all():
+				if record.get("parent") in deleted and \
+					record["id"] not in deleted:
+					self._materialize(record["id"], kind)
+
+		for unique_id in unique_ids:
+			unique_dir = self._unique_dir(unique_id)
+			if _path_exists(unique_dir): _rmdir(unique_dir)
+		self.db.remove(where("id").one_of(list(unique_ids)))
+		self.index.remove_many(unique_ids)
+		search_index = self._search_index()
+		for unique_id in unique_ids: search_index.remove(unique_id)
+		search_index.flush()
+		Catalog.update("remove", unique_ids)
+
+
+	def _search_index(self):
+		# Built from the records on first use, i.e by older versions.
+		search_index = SearchIndex(self.project_path)
+		if not search_index.exists():
+			search_index.rebuild(self.db.all(), self.commit_db.all())
+		return search_index
+
+
 	def _create_commit_record(self, attributes):
 		return self.commit_db.insert(attributes)
 
@@ -131,6 +218,53 @@ class Iteration(object):
 		return _path_join(self.dir, unique_id, self.MODEL_FILE_NAME)		
 
 
+	@classmethod
+	def _artifact_dir(cls, project_path, unique_id, kind="iteration"):
+		dir_name = cls.COMMIT_DIR if kind == "commit" else cls.DIR_NAME
+		return _path_join(project_path, Project.VML_DIR_NAME,
+			dir_name, unique_id)
+
+
+	@classmethod
+	def locate_models(cls, unique_ids, project_path=None):
+		"""Resolves the model paths of ids or unique id prefixes of 
+		iterations and commits through the id index, without opening the
+		dbs or the git repository. Returns a dict of given id to path.
+		"""
+		if not project_path:
+			project_path = Project.closest()
+
+		if not project_path:
+			raise ProjectNotFoundException("[GitML] No gitml project found.")
+
+		index = IdIndex(project_path)
+		paths, missing = {}, []
+		for unique_id in set(unique_ids):
+			if not unique_id.strip():
+				raise ValueError("[GitML] Invalid id.")
+			try: found = index.resolve(unique_id)
+			except AmbiguousIdException as e: raise ValueError(str(e))
+			if not found:
+				missing.append(unique_id)
+				continue
+			model_path = stored_path(_path_join(cls._artifact_dir(
+				project_path, *found), cls.MODEL_FILE_NAME))
+			if not _path_exists(model_path):
+				missing.append(unique_id)
+				continue
+			paths[unique_id] = model_path
+
+		if missing:
+			raise ValueError("[GitML] Failed loading model." + \
+				" Invalid iteration id %s." % ", ".join(sorted(missing)))
+		return paths
+
+
+	@classmethod
+	def locate_model(cls, unique_id, project_path=None):
+		return cls.locate_models([unique_id], project_path)[unique_id]
+
+
 	def _sort_by_timestamp(self, records):
 		return sorted(records, 
 			key=lambda record: record["timestamp"], reverse=True)
@@ -139,108 +273,495 @@ class Iteration(object):
 	def _code_archival_path(self, unique_id, selected="iteration"):
 		# Returns code_path based on selected.
 		if selected == "commit":
-			return _path_join(self._unique_commit_dir(unique_id), "code")
-		return _path_join(self._unique_dir(unique_id), "code")
+			return _path_join(self._unique_commit_dir(unique_id),
+				self.CODE_DIR_NAME)
+		return _path_join(self._unique_dir(unique_id), self.CODE_DIR_NAME)
 
 
 	def _code_ignores(self):
-		return set(self.git.get_ignores() + self.CODE_ARCHIVE_IGNORE)
+		# Parsed again only when .gitignore changes.
+		ignore_file = self.git.ignore_file
+		mtime = getmtime(ignore_file) if _path_exists(ignore_file) else None
+		if self._ignores[0] != mtime or self._ignores[1] is None:
+			self._ignores = (mtime, set(list(self.git.get_ignores()) 
+				+ self.CODE_ARCHIVE_IGNORE))
+		return self._ignores[1]
+
+
+	def _workspace_manifest(self):
+		# Files of the workspace that get archived. Digests of unchanged
+		# files come from the stat cache.
+		if not self.stat_cache:
+			self.stat_cache = StatCache(_path_join(self.project_path,
+				DataModel.DATA_DIR, self.STAT_CACHE_FILE_NAME))
+
+		# With a watcher, only the paths changed since the last save are
+		# looked at.
+		if self.watcher:
+			paths, full_scan = self.watcher.drain()
+			if self._workspace is not None and not full_scan:
+				self._workspace = self._workspace.updated(self.project_path,
+					paths, self._code_ignores(), self.stat_cache)
+				return self._workspace
+
+		with tracer.span("workspace.scan") as span:
+			manifest = Manifest.scan(self.project_path,
+				self._code_ignores(), self.stat_cache)
+			span.add(files=len(manifest))
+		self.stat_cache.retain(manifest.entries)
+		if self.persist_stat_cache: self.stat_cache.save()
+		if self.watcher: self._workspace = manifest
+		return manifest
+
+
+	def _manifest(self, unique_id, selected="iteration"):
+		# Manifest of an archived code tree. Built and stored on first
+		# use for iterations saved without one.
+		artifact_dir = self._artifact_dir(self.project_path, 
+			unique_id, selected)
+		manifest_path = _path_join(artifact_dir, Manifest.FILE_NAME)
+		if _path_exists(manifest_path):
+			return Manifest.load(manifest_path)
+
+		manifest = Manifest.scan(_path_join(artifact_dir, 
+			self.CODE_DIR_NAME))
+		if _path_exists(artifact_dir): manifest.save(manifest_path)
+		return manifest
+
+
+	def _head_path(self):
+		return _path_join(self.project_path, DataModel.DATA_DIR,
+			self.HEAD_FILE_NAME)
+
+
+	def _set_head(self, unique_id, selected="iteration"):
+		with open(self._head_path(), "w") as head_file:
+			head_file.write(json_dumps({"id": unique_id, "kind": selected}))
+
+
+	def _head(self):
+		"""Returns (id, kind) of the iteration the workspace was last
+		saved as or restored from, the latest iteration if unknown.
+		"""
+		try:
+			with open(self._head_path()) as head_file:
+				head = json_loads(head_file.read())
+			# The kind by the index, the head may have been committed.
+			found = self.index.resolve(head["id"]) or (head["id"],
+				head["kind"])
+			if isdir(self._artifact_dir(self.project_path, *found)):
+				return found
+		except (IOError, ValueError, KeyError, AmbiguousIdException):
+			pass
+		base = self._link_base()
+		return (base[0], "iteration") if base else None
+
+
+	def _link_base(self):
+		# Latest saved iteration, its unchanged files are hard linked
+		# instead of copied.
+		if self._last_saved and isdir(self._unique_dir(self._last_saved[0])):
+			return self._last_saved
+		records = self.db.all()
+		if not records: return None
+		latest = max(records, key=lambda record: record["timestamp"])
+		if not isdir(self._unique_dir(latest["id"])): return None
+		return (latest["id"], self._manifest(latest["id"]))
+
+
+	def _archive_code(self, code_path, manifest, base=None, parent=None,
+		policy=None):
+		base_id, base_manifest = base or (None, Manifest())
+		base_code_path = self._code_archival_path(base_id) if base_id \
+			else None
+		policy = policy or DeltaPolicy()
+		parent_manifest = self._manifest(*parent) \
+			if parent and policy.enabled() else Manifest()
+		create_dir_if_not_exist(code_path)
+		with tracer.span("save.archive_code") as span:
+			try:
+				for rel_path, entry in manifest.entries.items():
+					target = _path_join(code_path, rel_path)
+					create_dir_if_not_exist(_path_dirname(target))
+					if base_manifest.entries.get(rel_path) == entry:
+						# Archived files are never written in place.
+						try:
+							_link(_path_join(base_code_path, rel_path), target)
+							span.add(linked=1)
+							continue
+						except OSError: pass
+					# Big files of the parent, changed or stored as deltas.
+					if entry[0] > policy.min_size and \
+						rel_path in parent_manifest.entries:
+						stored = self._write_delta(_path_join(
+							self.project_path, rel_path), target, "%s/%s" % \
+							(self.CODE_DIR_NAME, rel_path), parent, policy,
+							parent_manifest.digest(rel_path))
+						if stored is not None:
+							span.add(deltas=1, bytes=stored)
+							continue
+					_file_copy(_path_join(self.project_path, rel_path), target)
+					span.add(copied=1, bytes=entry[0])
+			except (IOError, OSError):
+				log_message("Code archival failed on save.")
 
 
-	def _archive_code(self, code_path):
-		_project_path = self.project_path
-		ignores = self._code_ignores()
+	def _write_delta(self, source_path, target, rel_path, parent, policy,
+		digest=None):
+		"""Stores the file at source_path as target, a delta against the
+		artifact at rel_path of the parent iteration. Returns the size
+		written, None when it is better stored whole.
+		"""
+		if not parent or not policy.enabled(): return None
 		try:
-			_dir_copy(_project_path, code_path, 
-				ignore=ignore_patterns(*ignores))
-		except OSError as e:
-			if e.errno == errno.ENOTDIR:
-				_file_copy(_project_path, code_path)
-			else:
-				log_message("Code archival failed on save.")
+			parent_source = ArtifactResolver(self.project_path).source(
+				_path_join(self._artifact_dir(self.project_path, *parent),
+				rel_path), digest)
+		except (DeltaException, IOError, OSError, ValueError):
+			return None
+		try:
+			return write_delta(source_path, target + DeltaSource.SUFFIX,
+				rel_path, parent[0], parent_source, policy)
+		except (DeltaException, IOError, OSError, ValueError):
+			return None
+		finally:
+			parent_source.close()
+
 
+	def _materialize(self, unique_id, selected="iteration"):
+		# Stores the delta artifacts of an iteration whole, it no longer
+		# depends on its parent. Returns the count.
+		count = 0
+		for root, _, names in walk(self._artifact_dir(self.project_path,
+			unique_id, selected)):
+			for name in names:
+				if not name.endswith(DeltaSource.SUFFIX): continue
+				materialize(_path_join(root, name))
+				count += 1
+		return count
 
-	def _iteration_or_commit(self, unique_id):
-		# Figuring out iteration or commit.
-		_iteration = self._find_by_id(unique_id)
-		if _iteration: return "iteration"
-		_commit = self._find_by_id(unique_id, selected="commits")
-		if not _commit: return None
-		return "commit"
 
+	def _resolve(self, unique_id):
+		# Resolves an id or a unique id prefix to (id, kind).
+		unique_id = unique_id.strip()
+		try: found = self.index.resolve(unique_id)
+		except AmbiguousIdException as e: exit_with_message(str(e))
+		if found: return found
 
-	def save(self, params={}, metrics={}, remarks="", model=None):
-		unique_id = generate_unique_id()
-		unique_dir = create_dir_if_not_exist(
-			self._unique_dir(unique_id))
+		# Full ids missing on the index, i.e saved by an older version.
+		if len(unique_id) == IdIndex.ID_LENGTH:
+			for selected in ("iterations", "commits"):
+				if self._find_by_id(unique_id, selected):
+					kind = selected.rstrip("s")
+					self.index.add(unique_id, kind)
+					return (unique_id, kind)
+		return (None, None)
 
-		model_path = self._model_path(unique_id)
-		code_path = self._code_archival_path(unique_id)
+
+	@classmethod
+	def stage_model(cls, project_path, unique_id, model):
+		"""Pickles the model in the staging directory of a new iteration.
+		Returns the (sha1, size) of the pickle.
+		"""
+		staging_dir = create_dir_if_not_exist(cls._artifact_dir(
+			project_path, unique_id) + cls.PARTIAL_SUFFIX)
 
 		if not model:
 			log_message("No model given for saving. Try command"+ \
 				" 'gitml save -h'.")
 
-		if not _path_exists(model_path):
-			# Saving the model object as pickle file.
-			model_dump(model, open(model_path, "wb"))
-
-		if not _path_exists(code_path):
-			self._archive_code(code_path)
+		# Saving the model object as pickle file.
+		with tracer.span("save.pickle_model") as span:
+			with HashedWriter(open(_path_join(staging_dir, 
+				cls.MODEL_FILE_NAME), "wb")) as model_file:
+				model_dump(model, model_file)
+			span.add(bytes=model_file.size)
+		return (model_file.hexdigest(), model_file.size)
+
+
+	def save(self, params={}, metrics={}, remarks="", model=None,
+		unique_id=None, staged_model=None):
+		with tracer.span("save"):
+			return self._save(params, metrics, remarks, model, unique_id,
+				staged_model)
+
+
+	def _save(self, params, metrics, remarks, model, unique_id,
+		staged_model):
+		unique_id = unique_id or generate_unique_id()
+		unique_dir = self._unique_dir(unique_id)
+		# The iteration saved or reused last, artifacts are stored as
+		# deltas against its own.
+		parent = self._head()
+		config = Project.read_config(self.project_path)
+		policy = DeltaPolicy.from_project_config(config)
+
+		# Artifacts are staged and moved in place once complete, so a
+		# crash never leaves a half written iteration under an id.
+		staging_dir = unique_dir + self.PARTIAL_SUFFIX
+		if not staged_model:
+			staged_model = self.stage_model(self.project_path, unique_id,
+				model)
+		model_digest, model_size = staged_model
+
+		# Data paths are usually ignored, only their fingerprints are kept.
+		with tracer.span("save.fingerprint_data"):
+			data = DataFingerprint.from_project_config(self.project_path,
+				config).fingerprints()
+
+		model_path = _path_join(staging_dir, self.MODEL_FILE_NAME)
+		with tracer.span("save.delta_model") as span:
+			stored = self._write_delta(model_path, model_path,
+				self.MODEL_FILE_NAME, parent, policy)
+			if stored is not None:
+				remove(model_path)
+				model_size = stored
+				span.add(bytes=stored)
+
+		manifest = self._workspace_manifest()
+		self._archive_code(_path_join(staging_dir, self.CODE_DIR_NAME),
+			manifest, self._link_base(), parent, policy)
+		with tracer.span("save.write_manifest"):
+			manifest_path = manifest.save(_path_join(staging_dir, 
+				Manifest.FILE_NAME))
+
+		# Code files are verified through the manifest digests.
+		checksums = {
+			self.MODEL_FILE_NAME: model_digest,
+			Manifest.FILE_NAME: file_digest(manifest_path)
+		}
+		checkpoints = sorted(CheckpointWriter.index(staging_dir))
+		checkpoints_size = dir_size(_path_join(staging_dir,
+			CheckpointWriter.DIR_NAME)) if checkpoints else 0
+		_rename(staging_dir, unique_dir)
+		self._last_saved = (unique_id, manifest)
+		self._set_head(unique_id)
 
 		# Adding state to db. 
-		self._create_record(unique_id=unique_id, 
-			remarks=remarks, params=params, metrics=metrics)
+		with tracer.span("save.write_record"):
+			self._create_record(unique_id=unique_id, 
+				remarks=remarks, params=params, metrics=metrics,
+				checksums=checksums, size=model_size + \
+				manifest.total_size() + checkpoints_size, data=data,
+				checkpoints=checkpoints, parent=parent and parent[0])
 
 		log_message("Iteration saved : %s" % unique_id, tag=True)
 
-
-	def commit(self, unique_id):
-		iteration_dir = self._unique_dir(unique_id)
-		if not _path_exists(iteration_dir):
-			raise InvalidIterationException(
-				"No such iteration %s" % unique_id)
-
-		_commit_dir = self._unique_commit_dir(unique_id)
-		if _path_exists(_commit_dir):
+		with tracer.span("save.retention"): self._enforce_retention()
+		return unique_id
+
+
+	def _record_size(self, record, selected="iteration"):
+		# Stored size, measured for records saved without one.
+		if record.get("size"): return record["size"]
+		return dir_size(self._artifact_dir(self.project_path,
+			record["id"], selected))
+
+
+	def _retention_plan(self):
+		policy = RetentionPolicy.from_project_config(
+			Project.read_config(self.project_path))
+		if not policy.enabled(): return None
+
+		records = self.db.all()
+		sizes = dict((r["id"], self._record_size(r)) for r in records)
+		fixed_size = sum(self._record_size(r, "commit")
+			for r in self.commit_db.all()) if policy.max_size else 0
+		return policy.plan(records, sizes, fixed_size)
+
+
+	def _enforce_retention(self):
+		evict = self._retention_plan()
+		if not evict: return []
+		self._delete_iterations([record["id"] for record, _, _ in evict])
+		log_message("Retention evicted %d iterations (%s)." % (len(evict),
+			human_size(sum(size for _, size, _ in evict))), tag=True)
+		return evict
+
+
+	def prune(self, dry_run=False):
+		evict = self._retention_plan()
+		if evict is None:
+			exit_with_message("No retention rules in %s." % \
+				Project.VML_FILE_NAME)
+
+		if not dry_run:
+			self._delete_iterations([record["id"] for record, _, _ in evict])
+
+		lines = ["evict  %s  %s (%s)" % (record["id"], human_size(size),
+			reason) for record, size, reason in evict]
+		lines.append("%s %d iterations, freeing %s." % (
+			"Would evict" if dry_run else "Evicted", len(evict),
+			human_size(sum(size for _, size, _ in evict))))
+		exit_with_message("\n".join(lines))
+
+
+	def select(self, unique_ids=None, selector=None, selected="iterations"):
+		"""Returns the records of the given ids or unique id prefixes,
+		then of the ones matching the selector, without duplicates.
+		Unknown ids or ids of the other kind raise 
+		InvalidIterationException.
+		"""
+		kind = selected.rstrip("s")
+		_db = self.db if kind == "iteration" else self.commit_db
+		records = dict((r["id"], r) for r in _db.all())
+
+		ids, invalid = [], []
+		for uid in unique_ids or []:
+			try: found = self.index.resolve(uid.strip())
+			except AmbiguousIdException as e:
+				raise InvalidIterationException(str(e))
+			resolved = found[0] if found and found[1] == kind else uid.strip()
+			if resolved in records: ids.append(resolved)
+			else: invalid.append(uid)
+		if invalid:
+			raise InvalidIterationException("[GitML] Invalid %s id %s." % \
+				(kind, ", ".join(invalid)))
+
+		if selector:
+			matched = Selector(selector).filter(records.values())
+			ids += [r["id"] for r in self._sort_by_timestamp(matched)]
+
+		seen = set()
+		return [records[i] for i in ids if not (i in seen or seen.add(i))]
+
+
+	def commit_many(self, unique_ids=None, selector=None):
+		"""Commits iterations in one pass with a single git commit.
+		Returns the committed ids.
+		"""
+		records = self.select(unique_ids, selector)
+		if not records: return []
+		unique_ids = [record["id"] for record in records]
+		for unique_id in unique_ids:
+			if not _path_exists(self._unique_dir(unique_id)):
+				raise InvalidIterationException(
+					"[GitML] No such iteration %s" % unique_id)
+			if _path_exists(self._unique_commit_dir(unique_id)):
+				raise InvalidIterationException(
+					"[GitML] Iteration is committed already %s" % unique_id)
+
+		with tracer.span("commit", iterations=len(unique_ids)):
+			# Commits go to git whole, git never tracks a delta.
+			with tracer.span("commit.materialize_deltas"):
+				for unique_id in unique_ids: self._materialize(unique_id)
+
+			# Records go first, a directory is never left without one.
+			with tracer.span("commit.write_records"):
+				self.commit_db.insert_multiple(records)
+			with tracer.span("commit.move_artifacts"):
+				create_dir_if_not_exist(self.commit_dir)
+				for unique_id in unique_ids:
+					_rename(self._unique_dir(unique_id),
+						self._unique_commit_dir(unique_id))
+			with tracer.span("commit.remove_records"):
+				self.db.remove(where("id").one_of(unique_ids))
+				self.index.add_many(unique_ids, "commit")
+				search_index = self._search_index()
+				for unique_id in unique_ids:
+					search_index.set_kind(unique_id, "commit")
+				search_index.flush()
+				Catalog.update("set_kind", unique_ids, "commit")
+				head = self._head()
+				if head and head[0] in unique_ids:
+					self._set_head(head[0], "commit")
+
+			self.git.commit_all("Iteration %s" % unique_ids[0]
+				if len(unique_ids) == 1 else "Iterations %s" % \
+				", ".join(unique_ids))
+		return unique_ids
+
+
+	def delete_many(self, unique_ids=None, selector=None):
+		# Deletes iterations, commits stay with the git history.
+		unique_ids = [r["id"] for r in self.select(unique_ids, selector)]
+		self._delete_iterations(unique_ids)
+		return unique_ids
+
+
+	def commit(self, unique_ids, selector=None):
+		if not isinstance(unique_ids, list): unique_ids = [unique_ids]
+		try:
+			committed = [uid for uid in unique_ids
+				if (self.index.resolve(uid.strip()) or (None, None))[1] \
+				== "commit"]
+		except AmbiguousIdException as e:
+			exit_with_message(str(e))
+		if committed: 
 			exit_with_message("Iteration is committed already.")
+		try: committed = self.commit_many(unique_ids, selector)
+		except (InvalidIterationException, SelectorException) as e:
+			exit_with_message(str(e))
+		if not committed: exit_with_message("No iterations found.")
+		exit_with_message("\n".join("Iteration committed : %s" % unique_id
+			for unique_id in committed))
 
-		# Moving iteration to commit.
-		_dir_copy(iteration_dir, _commit_dir)
-
-		# Moving iteration record to commit db.
-		_iteration_record = self._find_by_id(unique_id)
-		self._create_commit_record(_iteration_record)
-
-		# Clearing iteration.
-		_rmdir(iteration_dir)
-		self._delete_record_by_id(unique_id)
 
-		self.git.commit_all("Iteration %s" % unique_id)
+	def remove(self, unique_ids, selector=None):
+		try: removed = self.delete_many(unique_ids, selector)
+		except (InvalidIterationException, SelectorException) as e:
+			exit_with_message(str(e))
+		if not removed: exit_with_message("No iterations found.")
+		exit_with_message("\n".join("Iteration deleted : %s" % unique_id
+			for unique_id in removed))
 
-		exit_with_message("Iteration committed : %s" % unique_id)
 
-
-	def reuse(self, unique_id):
+	def reuse(self, unique_id, sync=False, workers=1):
 
 		# Code path of iteration by unique id.
-		_object = self._iteration_or_commit(unique_id)
+		unique_id, _object = self._resolve(unique_id)
 
 		if not _object: exit_with_message("No iterations found.")
 		
 		# Returns code path of object which can be an iteration
 		# or a commit.
 		code_path = self._code_archival_path(unique_id, _object)
+		manifest_path = _path_join(self._artifact_dir(self.project_path,
+			unique_id, _object), Manifest.FILE_NAME)
 
-		if not _path_exists(code_path):
+		if not (_path_exists(code_path) or _path_exists(manifest_path)):
 			exit_with_message("Not able restore code for iteration.")
 
+		if sync:
+			with tracer.span("reuse.sync") as span:
+				written, deleted, kept = self._sync_code(unique_id, _object,
+					workers)
+				span.add(written=len(written), deleted=len(deleted))
+			message = "Workspace synced with %s. %d files written, %d " \
+				"deleted." % (unique_id, len(written), len(deleted))
+			if kept:
+				message += " Local changes kept, stash them to replace:\n%s" \
+					% "\n".join(kept)
+			exit_with_message(message)
+
 		if not self.workspace.is_empty():
 			exit_with_message("Workspace is not empty. Please stash your " + \
 				"changes using 'gitml stash'")
 
 		# Copies code contents to workspace.
-		_dir_copy_contents(code_path, self.project_path)
+		with tracer.span("reuse.restore") as span:
+			manifest = self._restore_code(unique_id, _object,
+				self.project_path)
+			span.add(files=len(manifest), bytes=manifest.total_size())
+		self._set_head(unique_id, _object)
+
+
+	def search(self, query, limit=10, rebuild=False):
+		if rebuild:
+			SearchIndex(self.project_path).rebuild(self.db.all(),
+				self.commit_db.all())
+		results = self._search_index().search(query, limit)
+		if not results: exit_with_message("No iterations found.")
+
+		headers = ["score", "id", "kind", "remarks", "params"]
+		tabulate([dict(zip(headers, ("%.2f" % score, unique_id,
+			doc.get("kind", ""), doc.get("remarks", ""), doc.get("params", ""))))
+			for score, unique_id, doc in results], headers)
+
+
+	def stash(self, name=None):
+		# The manifest lets restore skip files left unchanged.
+		self.workspace.stash(name, self._workspace_manifest())
 
 
 	def list(self, selected="iterations"):
@@ -251,37 +772,374 @@ class Iteration(object):
 		
 		if len(_records) > 0:
 			_records = self._sort_by_timestamp(_records)
-			return log_dicts_as_tables(_records, 
+			return log_dicts_as_tables(self._display_data(_records), 
 				display_title, self.DISPLAY_COLS)
 
-		exit_with_message("No %s found." % selected)	
+		exit_with_message("No %s found." % selected)
+
+
+	def _lineage(self, unique_id=None):
+		"""Returns [(kind, record)] of iterations and commits, children
+		before their parents, newest first. With an id only its ancestors
+		and descendants.
+		"""
+		records = dict((record["id"], (kind, record)) for kind, _db in
+			(("iteration", self.db), ("commit", self.commit_db))
+			for record in _db.all())
+		parents = dict((unique_id, record.get("parent")) for unique_id,
+			(kind, record) in records.items() if record.get("parent") in records)
+
+		# Generations order records saved within the same second.
+		generations = {}
+		for record_id in records:
+			chain = []
+			while record_id not in generations:
+				chain.append(record_id)
+				if record_id not in parents: break
+				record_id = parents[record_id]
+			generation = generations.get(record_id, -1)
+			for record_id in reversed(chain):
+				generation += 1
+				generations[record_id] = generation
+
+		selected = set(records)
+		if unique_id:
+			descendants = set([unique_id])
+			for record_id in sorted(records, key=generations.get):
+				if parents.get(record_id) in descendants:
+					descendants.add(record_id)
+			ancestor, selected = unique_id, descendants
+			while ancestor in parents:
+				ancestor = parents[ancestor]
+				selected.add(ancestor)
+
+		ordered = sorted(selected, key=lambda record_id: (
+			records[record_id][1]["timestamp"], generations[record_id]),
+			reverse=True)
+		return [records[record_id] for record_id in ordered], parents
+
+
+	def log(self, unique_id=None):
+		"""Prints the lineage graph of iterations and commits, newest
+		first. Each record is drawn under its children with the storage
+		of its model, whole or a delta down a chain.
+		"""
+		if unique_id:
+			unique_id, _ = self._resolve(unique_id)
+			if not unique_id: exit_with_message("Invalid iteration id.")
+		lineage, parents = self._lineage(unique_id)
+		if not lineage: exit_with_message("No iterations found.")
+
+		# Columns hold the id each open line of the graph waits for.
+		columns, lines = [], []
+		for kind, record in lineage:
+			record_id = record["id"]
+			waiting = [c for c, expected in enumerate(columns)
+				if expected == record_id]
+			if waiting: column = waiting[0]
+			elif None in columns: column = columns.index(None)
+			else:
+				column = len(columns)
+				columns.append(None)
+
+			graph = ["*" if c == column else ("|" if expected else " ")
+				for c, expected in enumerate(columns)]
+			try:
+				model_depth = delta_depth(_path_join(self._artifact_dir(
+					self.project_path, record_id, kind), self.MODEL_FILE_NAME))
+				storage = "delta %d" % model_depth if model_depth else "full"
+			except (DeltaException, IOError, OSError, ValueError):
+				storage = "broken"
+			lines.append("%s  %s %-9s %s %-8s %s" % (" ".join(graph).rstrip(),
+				record_id[:self.SHORT_ID_LENGTH], kind, record["timestamp"],
+				storage,
+				record.get("remarks") or ""))
+
+			# Children lines merge into the line of their parent.
+			for c in waiting[1:]: columns[c] = None
+			columns[column] = parents.get(record_id)
+			if waiting[1:]:
+				lines.append(" ".join("/" if c in waiting[1:] else ("|"
+					if expected else " ") for c, expected in
+					enumerate(columns)).rstrip())
+			while columns and columns[-1] is None: columns.pop()
+
+		log_message("\n".join(lines))
+
+
+	def _display_data(self, records, mark_changes=True):
+		# Short data fingerprints, marked when changed since the previous
+		# (older) record. Records are newest first.
+		displayed = []
+		for position, record in enumerate(records):
+			record = dict(record)
+			data = record.get("data") or {}
+			previous = records[position + 1].get("data") or {} \
+				if mark_changes and position + 1 < len(records) else data
+			record["data"] = OrderedDict((path, short_fingerprint(
+				fingerprint) + (" (changed)" if previous.get(path) != \
+				fingerprint else "")) for path, fingerprint in sorted(
+				data.items()))
+			displayed.append(record)
+		return displayed
+
+
+	def show(self, uids, selected="iterations", selector=None):
+		if not isinstance(uids, list): uids = [uids]
+		try: _records = self.select(uids, selector, selected)
+		except (InvalidIterationException, SelectorException) as e:
+			return exit_with_message(str(e))
+		if not _records:
+			return exit_with_message("No %s found." % selected)
+
+		for _record in self._display_data(_records, mark_changes=False):
+			log_dict_as_table(_record, self.DISPLAY_COLS)
+
+
+	def _read_code_file(self, unique_id, selected, rel_path, digest=None):
+		# Archived file content, from the code directory or from a pack.
+		path = stored_path(_path_join(self._code_archival_path(unique_id,
+			selected), rel_path))
+		if not _path_exists(path) and digest and self.packs.has(digest):
+			return self.packs.read(digest)
+		with open_artifact(path) as code_file:
+			return code_file.read()
+
+
+	def _write_code_file(self, code_path, manifest, rel_path, target):
+		# Archived file written in place through a rename, from the code
+		# directory or from a pack.
+		source = _path_join(code_path, rel_path)
+		destination = _path_join(target, rel_path)
+		create_dir_if_not_exist(_path_dirname(destination))
+		temp_path = "%s.gitml.tmp" % destination
+		if _path_exists(source):
+			_file_copy(source, temp_path)
+		elif _path_exists(source + DeltaSource.SUFFIX):
+			with open_artifact(source + DeltaSource.SUFFIX) as code_file:
+				with open(temp_path, "wb") as written:
+					copyfileobj(code_file, written)
+		else:
+			with open(temp_path, "wb") as code_file:
+				code_file.write(self.packs.read(manifest.digest(rel_path)))
+		_rename(temp_path, destination)
+		return rel_path
+
+
+	def _restore_code(self, unique_id, selected, target):
+		code_path = self._code_archival_path(unique_id, selected)
+		manifest = self._manifest(unique_id, selected)
+		for rel_path in manifest.entries:
+			self._write_code_file(code_path, manifest, rel_path, target)
+		return manifest
+
+
+	def _sync_code(self, unique_id, selected, workers=1):
+		"""Makes the workspace code equal to the archived one. Only the
+		files whose size or digest differ are written or deleted, files
+		are copied since the archive must never change through the
+		workspace. Files changed since the head iteration are local
+		changes, they are kept. Returns (written, deleted, kept) paths.
+		"""
+		code_path = self._code_archival_path(unique_id, selected)
+		manifest = self._manifest(unique_id, selected)
+		workspace = self._workspace_manifest()
+		head = self._head()
+		head_manifest = self._manifest(*head) if head else Manifest()
+
+		added, deleted, modified = workspace.diff(manifest)
+		local = lambda rel_path: workspace.entries[rel_path] != \
+			head_manifest.entries.get(rel_path)
+		kept = [p for p in deleted + modified if local(p)]
+		deleted = [p for p in deleted if not local(p)]
+		modified = [p for p in modified if not local(p)]
+
+		for rel_path in deleted:
+			remove(_path_join(self.project_path, rel_path))
+			parent = _path_dirname(_path_join(self.project_path, rel_path))
+			# Prunes directories left empty, up to the project.
+			if parent != self.project_path:
+				try: removedirs(parent)
+				except OSError: pass
+
+		write = lambda rel_path: self._write_code_file(code_path, manifest,
+			rel_path, self.project_path)
+		written = added + modified
+		if workers > 1 and len(written) > 1:
+			# Directories first, threads would race on creating them.
+			for directory in set(_path_dirname(_path_join(self.project_path,
+				rel_path)) for rel_path in written):
+				create_dir_if_not_exist(directory)
+			pool = ThreadPool(workers)
+			try: pool.map(write, written)
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			for rel_path in written: write(rel_path)
+
+		# Written files are known, the next scan does not hash them.
+		for rel_path in written:
+			st = stat(_path_join(self.project_path, rel_path))
+			self.stat_cache.update(rel_path, st.st_size, st.st_mtime,
+				manifest.digest(rel_path))
+		if self.persist_stat_cache: self.stat_cache.save()
+		self._set_head(unique_id, selected)
+		return written, deleted, sorted(kept)
+
+
+	def _log_file_diff(self, a, b, rel_path, digests=(None, None)):
+		# Content diff of a file changed between two iterations.
+		a_content = self._read_code_file(a[0], a[1], rel_path, digests[0])
+		b_content = self._read_code_file(b[0], b[1], rel_path, digests[1])
+		if b"\0" in a_content[:8000] or b"\0" in b_content[:8000]:
+			return log_message("Binary file %s differs." % rel_path)
+
+		lines = unified_diff(
+			a_content.decode("utf-8", "replace").splitlines(True),
+			b_content.decode("utf-8", "replace").splitlines(True),
+			"a/%s" % rel_path, "b/%s" % rel_path)
+		return log_message("".join(lines).rstrip("\n"))
+
+
+	def diff(self, uid, other_uid):
+		_resolved = []
+		for _uid in (uid, other_uid):
+			resolved, kind = self._resolve(_uid)
+			if not resolved:
+				exit_with_message("Invalid iteration id %s." % _uid)
+			_resolved.append((resolved, kind))
+		a, b = _resolved
+
+		if a[0] == b[0]: exit_with_message("Nothing to compare.")
+
+		a_record = self._find_by_id(a[0], a[1] + "s")
+		b_record = self._find_by_id(b[0], b[1] + "s")
+		headers = ["key", a[0][:8], b[0][:8]]
+
+		for attribute in ("params", "metrics"):
+			changes = dict_changes(a_record.get(attribute) or {},
+				b_record.get(attribute) or {})
+			if not changes: continue
+			log_message("--- %s ---" % attribute)
+			tabulate([dict(zip(headers, change)) for change in changes], 
+				headers)
+
+		data_changes = dict_changes(a_record.get("data") or {},
+			b_record.get("data") or {})
+		if data_changes:
+			log_message("--- data ---")
+			tabulate([dict(zip(headers, (path, short_fingerprint(a_value),
+				short_fingerprint(b_value))))
+				for path, a_value, b_value in data_changes], headers)
+
+		# Only manifests are compared, file contents are read for the
+		# modified files alone.
+		a_manifest, b_manifest = self._manifest(*a), self._manifest(*b)
+		added, removed, modified = a_manifest.diff(b_manifest)
+		if not (added or removed or modified):
+			return log_message("No code changes.")
+
+		log_message("--- code ---\n%s" % "\n".join(
+			["A  %s" % p for p in added] + ["D  %s" % p for p in removed]
+			+ ["M  %s" % p for p in modified]))
+		for rel_path in modified:
+			self._log_file_diff(a, b, rel_path, (a_manifest.digest(rel_path),
+				b_manifest.digest(rel_path)))
+
+
+	def fsck(self, workers=None):
+		_fsck = Fsck(self, workers).run()
+		problems = _fsck.problems()
+		if not problems:
+			exit_with_message("%d files verified. No problems found." % \
+				_fsck.verified)
+		exit_with_message("\n".join(problems + ["", "%d problems found." % \
+			len(problems)]))
+
+
+	def gc(self, pack=False, cold_days=None, dry_run=False, 
+		prune_stash=False):
+		collector = GarbageCollector(self, dry_run).mark().sweep()
+		if pack: collector.pack(cold_days)
+		report = collector.report()
+		if prune_stash:
+			report += "\n%s" % self.workspace.prune_stash(dry_run)
+		exit_with_message(report)
+
+
+	def _sync(self, remote_name, workers):
+		try:
+			remote = Remote.from_project_config(
+				Project.read_config(self.project_path), remote_name)
+		except RemoteException as e: exit_with_message(str(e))
+		return Sync(self, remote, workers)
 
 
-	def show(self, uid, selected="iterations"):
-		_record = self._find_by_id(uid, selected)
-		if not _record:
-			return exit_with_message("Invalid %s id %s." % (selected.strip("s"), uid))
+	def push(self, remote_name=None, unique_ids=None, workers=4):
+		sync = self._sync(remote_name, workers)
+		try: pushed = sync.push(unique_ids)
+		except RemoteException as e: exit_with_message(str(e))
+		exit_with_message("Pushed %d iterations. %d objects sent, " % (
+			len(pushed), sync.transferred) + "%d already on remote." % \
+			sync.skipped)
 
-		return log_dict_as_table(_record, self.DISPLAY_COLS)	
 
+	def pull(self, remote_name=None, unique_ids=None, workers=4):
+		sync = self._sync(remote_name, workers)
+		try: pulled = sync.pull(unique_ids)
+		except RemoteException as e: exit_with_message(str(e))
+		exit_with_message("Pulled %d iterations. %d objects fetched, " % (
+			len(pulled), sync.transferred) + "%d found locally." % \
+			sync.skipped)
 
-	def load_model(self, unique_id):
-		unique_id = unique_id.strip()
 
-		if not unique_id:
-			raise ValueError("[GitML] Invalid id.")
+	def export(self, unique_ids, path, compress=False):
+		# Objects go one at a time, a bundle is written sequentially.
+		writer = BundleWriter(path, compress)
+		try:
+			exported = Sync(self, writer, workers=1).push(unique_ids)
+			writer.close()
+		except RemoteException as e:
+			writer.abort()
+			exit_with_message(str(e))
+		except BaseException:
+			writer.abort()
+			raise
+		exit_with_message("Exported %d iterations to %s. %d objects, %s." % (
+			len(exported), path, len(writer.objects), human_size(writer.size)))
+
+
+	def import_bundle(self, path, unique_ids=None, workers=4):
+		try:
+			with BundleReader(path) as reader:
+				sync = Sync(self, reader, workers)
+				imported = sync.pull(unique_ids)
+		except (RemoteException, IOError) as e: exit_with_message(str(e))
+		exit_with_message("Imported %d iterations. %d objects read, " % (
+			len(imported), sync.transferred) + "%d found locally." % \
+			sync.skipped)
+
 
-		model_path = self._model_path(unique_id)
-		if not _path_exists(model_path):
-			error_msg = "[GitML] Failed loading model." + \
-				" Invalid iteration id %s." % str(unique_id) 
-			raise ValueError(error_msg)
+	def load_model(self, unique_id):
+		model_path = self.locate_model(unique_id, self.project_path)
 
 		# Return model by reading the pickle.
-		return model_load(open(model_path, "rb"))
+		with open_artifact(model_path) as model_file:
+			return model_load(model_file)
 
 
 class Workspace(object):
+	"""Top level entries of the project, except gitml's own files. Each
+	stash is a directory .gitml/.stash/<name> holding the manifest of the
+	stashed code and the entries moved under tree/. Entries are moved
+	with renames, so stashing costs the same whatever their size.
+	"""
+
+	STASH_TREE_NAME = "tree"
+
+	# Stash of older versions, entries straight under .stash.
+	LEGACY_STASH_NAME = "legacy"
 
 	def __init__(self, path, ignore=[]):
 		self.path = path
@@ -300,33 +1158,149 @@ class Workspace(object):
 		return (len(self.list()) == 0)
 
 
-	def stash(self):
+	def _stash_dir(self, name):
+		return _path_join(self.stash_path, name)
+
+
+	def _is_stash(self, name):
+		return isdir(_path_join(self._stash_dir(name), self.STASH_TREE_NAME))
+
+
+	def _migrate_legacy(self):
+		loose = [n for n in listdir(self.stash_path) if not self._is_stash(n)]
+		if not loose: return
+		tree = _path_join(self._stash_dir(self.LEGACY_STASH_NAME),
+			self.STASH_TREE_NAME)
+		create_dir_if_not_exist(tree)
+		for name in loose:
+			_move_path(_path_join(self.stash_path, name), _path_join(tree, name))
+
+
+	def stashes(self):
+		"""Returns [(name, manifest, created)] of the stashes, oldest first.
+		"""
+		self._migrate_legacy()
+		stashes = []
+		for name in listdir(self.stash_path):
+			manifest_path = _path_join(self._stash_dir(name), Manifest.FILE_NAME)
+			if _path_exists(manifest_path):
+				stashes.append((name, Manifest.load(manifest_path),
+					getmtime(manifest_path)))
+			else:
+				stashes.append((name, Manifest(),
+					getmtime(self._stash_dir(name))))
+		return sorted(stashes, key=lambda stash: (stash[2], stash[0]))
+
+
+	def list_stashes(self):
+		stashes = self.stashes()
+		if not stashes: exit_with_message("No stash found.")
+		headers = ["name", "created", "entries", "code files", "code size"]
+		tabulate([dict(zip(headers, (name, datetime.fromtimestamp(created)
+			.strftime("%Y-%m-%d %H:%M:%S"), len(listdir(_path_join(
+			self._stash_dir(name), self.STASH_TREE_NAME))), len(manifest),
+			human_size(manifest.total_size()))))
+			for name, manifest, created in stashes], headers)
+
+
+	def stash(self, name=None, manifest=None):
 		if self.is_empty():
 			exit_with_message("Empty workspace. Nothing to stash.")
 
-		_list = self.list()
+		if not name:
+			name = "stash-%s" % timestamp()
+			while _path_exists(self._stash_dir(name)): name += "-1"
+		if name.startswith(".") or basename(name) != name:
+			exit_with_message("Invalid stash name %s." % name)
+		if _path_exists(self._stash_dir(name)):
+			exit_with_message("Stash %s exists already." % name)
+
+		tree = _path_join(self._stash_dir(name), self.STASH_TREE_NAME)
+		create_dir_if_not_exist(tree)
+		(manifest or Manifest()).save(_path_join(self._stash_dir(name),
+			Manifest.FILE_NAME))
+		for entry in self.list():
+			_move_path(_path_join(self.path, entry), _path_join(tree, entry))
+
+		exit_with_message("Stashed as %s." % name)
+
+
+	def _same_file(self, source, target, entry):
+		# Stashed file equal to the workspace one, the digest of the
+		# stashed side comes from the manifest when recorded.
+		if not (isfile(source) and isfile(target)): return False
+		size = getsize(source)
+		if size != getsize(target): return False
+		digest = entry[1] if entry and entry[0] == size \
+			else file_digest(source)
+		return digest == file_digest(target)
+
+
+	def _merge(self, source_dir, target_dir, rel_dir, manifest, force, 
+		result):
+		# Moves stashed entries missing in the workspace as a whole and
+		# only descends into directories present on both sides.
+		for name in sorted(listdir(source_dir)):
+			source = _path_join(source_dir, name)
+			target = _path_join(target_dir, name)
+			rel_path = _path_join(rel_dir, name) if rel_dir else name
+
+			if not _path_exists(target) and not islink(target):
+				_move_path(source, target)
+				result["moved"] += 1
+			elif (isdir(source) and not islink(source) and isdir(target)
+				and not islink(target)):
+				self._merge(source, target, rel_path, manifest, force, result)
+			elif self._same_file(source, target, 
+				manifest.entries.get(rel_path)):
+				remove(source)
+				result["unchanged"] += 1
+			elif force:
+				if isdir(target) and not islink(target): _rmdir(target)
+				else: remove(target)
+				_move_path(source, target)
+				result["moved"] += 1
+			else:
+				result["conflicts"].append(rel_path)
+		return result
 
-		for l in _list:
-			move(_path_join(self.path, l), 
-				_path_join(self.stash_path, l))
 
-		exit_with_message("Stashed successfully.")
+	def restore(self, name=None, force=False):
+		stashes = self.stashes()
+		if not stashes: exit_with_message("No stash found.")
 
+		name = name or stashes[-1][0]
+		stash = [s for s in stashes if s[0] == name]
+		if not stash: exit_with_message("No stash named %s." % name)
 
-	def restore(self):
-		if not _path_exists(self.stash_path):
-			exit_with_message("No stash found.")
+		stash_dir = self._stash_dir(name)
+		tree = _path_join(stash_dir, self.STASH_TREE_NAME)
+		result = self._merge(tree, self.path, "", stash[0][1], force,
+			{"moved": 0, "unchanged": 0, "conflicts": []})
 
-		contents = listdir(self.stash_path)
+		if not result["conflicts"]:
+			_rmdir(stash_dir)
+			exit_with_message("Stash %s restored." % name)
 
-		if len(contents) == 0:
-			exit_with_message("Nothing to restore. Stash is empty.")
+		remove_empty_dirs(tree)
+		create_dir_if_not_exist(tree)
+		exit_with_message("Stash %s partly restored, %d paths differ " \
+			"from the workspace and are kept in the stash. Use --force " \
+			"to overwrite them.\n%s" % (name, len(result["conflicts"]),
+			"\n".join(result["conflicts"])))
 
-		for content in contents:
-			move(_path_join(self.stash_path, content), 
-				self.path)
 
-		exit_with_message("Stash restored.")
+	def prune_stash(self, dry_run=False):
+		# Drops everything left in the stash.
+		contents = listdir(self.stash_path)
+		size = dir_size(self.stash_path)
+		if not dry_run:
+			for content in contents:
+				path = _path_join(self.stash_path, content)
+				if isdir(path): _rmdir(path)
+				else: remove(path)
+		return "%s stash: %d entries (%s)." % ("Would prune" if dry_run
+			else "Pruned", len(contents), human_size(size))
 
 
 class State(object):
@@ -336,6 +1310,10 @@ class State(object):
 		self.params = {}
 		self.metrics = {}
 		self.remarks = ""
+		# Checkpoints are written only when the state is saved.
+		self.saving = False
+		self.unique_id = None
+		self._checkpoints = None
 
 
 	@classmethod
@@ -352,6 +1330,29 @@ class State(object):
 		return self
 
 
+	def checkpoint(self, model, step, metrics={}):
+		"""Writes an intermediate model into the iteration being saved, in
+		the background. Retained checkpoints follow the "checkpoints"
+		section of gitml.json and load with gitml.load(id, step=step).
+		"""
+		if not self.saving: return None
+		if not self._checkpoints:
+			project_path = Project.closest()
+			self.unique_id = self.unique_id or generate_unique_id()
+			self._checkpoints = CheckpointWriter(Iteration._artifact_dir(
+				project_path, self.unique_id) + Iteration.PARTIAL_SUFFIX,
+				CheckpointPolicy.from_project_config(
+				Project.read_config(project_path)))
+		self._checkpoints.checkpoint(model, step, metrics)
+		return step
+
+
+	def close_checkpoints(self):
+		# Waits for the checkpoints still being written.
+		if self._checkpoints: return self._checkpoints.close()
+		return []
+
+
 class Action(object):
 
 	SUPPORT = [
@@ -372,6 +1373,7 @@ class Action(object):
 		self.name = name
 		# Creates an instance of empty state.
 		self.state = State()
+		self.state.saving = (name == "save")
 
 
 	def __enter__(self):
@@ -386,20 +1388,103 @@ class Action(object):
 
 		elif self.name == "save":
 			# Saving the state on iteration.
-			Iteration().save(
-				params=self.state.params,
-				metrics=self.state.metrics,
-				model=self.state.model,
-				remarks=self.state.remarks)
+			save_state(self.state)
 
 
 	def __exit__(self, type, value, traceback):
 		self.run()
 
 
-def load(iteration_id):
-	# Load model by iteration.
-	model = Iteration().load_model(iteration_id)
-	return model
+def _move_path(source, target):
+	# Renames on the same filesystem, copies across filesystems.
+	try: _rename(source, target)
+	except OSError: move(source, target)
+
+
+def save_state(state):
+	# Saves through the daemon of the project when one is running, the
+	# model is pickled here and the daemon archives and records it.
+	project_path = Project.closest()
+	state.close_checkpoints()
+	client = DaemonClient(project_path)
+	if not client.available():
+		return Iteration(project_path).save(params=state.params,
+			metrics=state.metrics, model=state.model, remarks=state.remarks,
+			unique_id=state.unique_id)
+
+	unique_id = state.unique_id or generate_unique_id()
+	staged_model = Iteration.stage_model(project_path, unique_id,
+		state.model)
+	response = client.request("save", id=unique_id, model=staged_model,
+		params=state.params, metrics=state.metrics, remarks=state.remarks)
+	log_message("Iteration saved : %s" % response["id"], tag=True)
+	return response["id"]
+
+
+def select(iteration_ids=None, where=None, committed=False,
+	project_path=None):
+	# Records of iterations, or commits, by ids and/or a selector.
+	return Iteration(project_path).select(iteration_ids, where,
+		"commits" if committed else "iterations")
+
+
+def commit(iteration_ids=None, where=None, project_path=None):
+	# Commits iterations by ids and/or a selector in a single git commit.
+	return Iteration(project_path).commit_many(iteration_ids, where)
+
+
+def delete(iteration_ids=None, where=None, project_path=None):
+	# Deletes iterations by ids and/or a selector.
+	return Iteration(project_path).delete_many(iteration_ids, where)
+
+
+def load(iteration_id, step=None):
+	# Load model by iteration or commit, served from the process wide
+	# cache. Changed artifacts are reloaded on the next call. A step
+	# loads a retained checkpoint instead, "last" the latest one.
+	with tracer.span("load.locate"):
+		model_path = Iteration.locate_model(iteration_id)
+	if step is None:
+		# Sized only when tracing, a stat less on every load.
+		span_args = {"bytes": getsize(model_path)} if tracer.enabled else {}
+		with tracer.span("load", **span_args):
+			return model_cache.get(model_path)
+
+	artifact_dir = _path_dirname(model_path)
+	steps = sorted(CheckpointWriter.index(artifact_dir))
+	if step == "last" and steps: step = steps[-1]
+	if step not in steps:
+		raise ValueError("[GitML] No checkpoint at step %s of iteration" \
+			" %s." % (step, iteration_id))
+	with tracer.span("load", step=step):
+		return model_cache.get(CheckpointWriter.path(artifact_dir, step))
+
+
+def load_many(iteration_ids, workers=4):
+	# Loads models of many iterations in parallel. Paths are resolved
+	# once and models are unpickled on a thread pool through the cache.
+	iteration_ids = [i.strip() for i in iteration_ids]
+	if not iteration_ids: return []
+
+	paths = Iteration.locate_models(iteration_ids)
+	pool = ThreadPool(max(1, min(workers, len(paths))))
+	try:
+		models = pool.map(model_cache.get, paths.values())
+	finally:
+		pool.close()
+		pool.join()
+
+	models = dict(zip(paths.keys(), models))
+	return [models[i] for i in iteration_ids]
+
+
+def prefetch(iteration_ids):
+	# Warms the OS page cache for the models of the given iterations on
+	# a background thread. Returns the thread.
+	paths = list(Iteration.locate_models(iteration_ids).values())
+	thread = Thread(target=warm_file_cache, args=(paths,))
+	thread.daemon = True
+	thread.start()
+	return thread
 
 
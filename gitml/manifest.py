@@ -0,0 +1,198 @@
+from os import walk as _walk, stat as _stat, rename as _rename
+from os.path import (
+	join as _path_join,
+	exists as _path_exists,
+	relpath as _relpath,
+	isdir,
+	isfile,
+	sep
+)
+from shutil import ignore_patterns
+from codecs import open
+from json import load as _json_load, dump as _json_dump
+
+from .util import file_digest
+
+
+class StatCache(object):
+	"""Digests of files keyed by their path and stat signature. A file
+	whose size and mtime are unchanged is never read again.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.entries = {}
+		self.dirty = False
+		if _path_exists(path):
+			try:
+				with open(path, "r", "utf-8") as cache_file:
+					self.entries = _json_load(cache_file)
+			except ValueError:
+				# Corrupt cache, starts over.
+				self.entries = {}
+
+
+	def lookup(self, key, size, mtime):
+		# Cached digest, if the file is unchanged since it was hashed.
+		cached = self.entries.get(key)
+		if cached and cached[0] == size and cached[1] == mtime:
+			return cached[2]
+		return None
+
+
+	def update(self, key, size, mtime, digest):
+		self.entries[key] = [size, mtime, digest]
+		self.dirty = True
+
+
+	def digest(self, abs_path, key=None):
+		"""Returns (size, digest) of the file, hashing only on a miss.
+		"""
+		key = key or abs_path
+		st = _stat(abs_path)
+		digest = self.lookup(key, st.st_size, st.st_mtime)
+		if digest: return (st.st_size, digest)
+
+		digest = file_digest(abs_path)
+		self.update(key, st.st_size, st.st_mtime, digest)
+		return (st.st_size, digest)
+
+
+	def retain(self, keys):
+		# Drops entries of files that are gone.
+		stale = set(self.entries) - set(keys)
+		for key in stale: del self.entries[key]
+		if stale: self.dirty = True
+
+
+	def save(self):
+		if not self.dirty: return self.path
+		temp_path = "%s.tmp" % self.path
+		with open(temp_path, "w", "utf-8") as cache_file:
+			_json_dump(self.entries, cache_file)
+		_rename(temp_path, self.path)
+		self.dirty = False
+		return self.path
+
+
+class Manifest(object):
+	"""List of files (relative path, size, sha1) of a code tree.
+	"""
+
+	FILE_NAME = "manifest.json"
+
+	def __init__(self, entries=None):
+		# i.e {"src/model.py": [1024, "<sha1>"]}
+		self.entries = entries or {}
+
+
+	def __len__(self):
+		return len(self.entries)
+
+
+	def __contains__(self, path):
+		return path in self.entries
+
+
+	@classmethod
+	def scan(cls, root, ignores=[], stat_cache=None):
+		"""Builds the manifest of a directory. Ignores are matched on
+		file and directory names, same as shutil.ignore_patterns.
+		"""
+		ignore = ignore_patterns(*ignores)
+		entries = {}
+		for dir_path, dir_names, file_names in _walk(root, followlinks=True):
+			ignored = ignore(dir_path, dir_names + file_names)
+			# Pruning ignored directories in place.
+			dir_names[:] = sorted(d for d in dir_names if d not in ignored)
+			for file_name in file_names:
+				if file_name in ignored: continue
+				abs_path = _path_join(dir_path, file_name)
+				rel_path = _relpath(abs_path, root)
+				if stat_cache:
+					entries[rel_path] = list(
+						stat_cache.digest(abs_path, rel_path))
+				else:
+					entries[rel_path] = [_stat(abs_path).st_size,
+						file_digest(abs_path)]
+		return cls(entries)
+
+
+	def updated(self, root, paths, ignores=[], stat_cache=None):
+		"""Returns a copy of the manifest with only the given paths,
+		files or directories relative to root, scanned again.
+		"""
+		ignore = ignore_patterns(*ignores)
+		entries = dict(self.entries)
+		for rel_path in paths:
+			parts = rel_path.split(sep)
+			if any(ignore(root, [part]) for part in parts): continue
+
+			abs_path = _path_join(root, rel_path)
+			if rel_path in entries: del entries[rel_path]
+			elif not isfile(abs_path):
+				# A directory, gone or new. Drops what was under it.
+				prefix = rel_path + sep
+				for key in [k for k in entries if k.startswith(prefix)]:
+					del entries[key]
+
+			if isfile(abs_path):
+				entries[rel_path] = list(stat_cache.digest(abs_path, rel_path)
+					if stat_cache else (_stat(abs_path).st_size,
+					file_digest(abs_path)))
+			elif isdir(abs_path):
+				sub_cache = _PrefixedCache(stat_cache, rel_path) \
+					if stat_cache else None
+				for sub_path, entry in Manifest.scan(abs_path, ignores,
+					sub_cache).entries.items():
+					entries[_path_join(rel_path, sub_path)] = entry
+		return Manifest(entries)
+
+
+	@classmethod
+	def load(cls, path):
+		with open(path, "r", "utf-8") as manifest_file:
+			return cls(_json_load(manifest_file))
+
+
+	def save(self, path):
+		with open(path, "w", "utf-8") as manifest_file:
+			_json_dump(self.entries, manifest_file, indent=1,
+				sort_keys=True)
+		return path
+
+
+	def size(self, path):
+		return self.entries[path][0]
+
+
+	def digest(self, path):
+		return self.entries[path][1]
+
+
+	def total_size(self):
+		return sum(entry[0] for entry in self.entries.values())
+
+
+	def diff(self, other):
+		"""Returns (added, removed, modified) paths going from this
+		manifest to other. Only sizes and digests are compared.
+		"""
+		mine, theirs = set(self.entries), set(other.entries)
+		added = sorted(theirs - mine)
+		removed = sorted(mine - theirs)
+		modified = sorted(p for p in mine & theirs
+			if self.entries[p] != other.entries[p])
+		return added, removed, modified
+
+
+class _PrefixedCache(object):
+	# Stat cache view for a sub directory, keys stay relative to root.
+
+	def __init__(self, stat_cache, prefix):
+		self.stat_cache = stat_cache
+		self.prefix = prefix
+
+
+	def digest(self, abs_path, key=None):
+		return self.stat_cache.digest(abs_path, _path_join(self.prefix, key))
@@ -8,10 +8,11 @@ from os import getcwd, remove as _rmfile
 from shutil import rmtree as _rmdir
 from codecs import open
 from sys import exit
-from json import dumps as _json_dump
+from json import dumps as _json_dump, load as _json_load
 
 from .db import DataModel
 from .scm import Git
+from .catalog import Catalog
 from .util import *
 
 
@@ -38,7 +39,12 @@ class Project(object):
 	GIT_IGNORES = [
 		".gitml/.data/*",
 		"!.gitml/.data/commits.json",
-		".gitml/.iterations"
+		".gitml/.iterations",
+		".gitml/.packs",
+		".gitml/.stash",
+		".gitml/.remote",
+		".gitml/daemon.*",
+		".gitml/serve.*"
 	]
 
 	def __init__(self, base_path=None):
@@ -78,6 +84,16 @@ class Project(object):
 		return dir_path
 
 
+	@classmethod
+	def read_config(cls, path):
+		# Contents of gitml.json of the project at path.
+		file_path = _path_join(path, cls.VML_FILE_NAME)
+		if not _path_exists(file_path): return {}
+		with open(file_path, "r", "utf-8") as project_file:
+			try: return _json_load(project_file)
+			except ValueError: return {}
+
+
 	@classmethod
 	def exists_file_dir(cls, path):
 		file_path = _path_join(path, cls.VML_FILE_NAME)
@@ -126,6 +142,8 @@ class Project(object):
 		DataModel.setup(self._base_path)
 		# Create git repository with ignores, if not exist.
 		Git.init(self._base_path, self.GIT_IGNORES)
+		# Registers with the machine wide catalog, if enabled.
+		Catalog.update("register", self._base_path, config.get("name"))
 
 
 	def remove(self):
@@ -133,6 +151,7 @@ class Project(object):
 			_rmfile(self._file_path)
 		if _path_exists(self._dir_path):
 			_rmdir(self._dir_path)
+		Catalog.update("unregister", self._base_path)
 
 
 	def replace(self):
@@ -0,0 +1,464 @@
+from os import listdir, remove, rename as _rename
+from os.path import (
+	join as _path_join,
+	exists as _path_exists,
+	getsize,
+	dirname as _path_dirname,
+	isdir
+)
+from io import BytesIO
+from codecs import open as _codecs_open
+from json import load as _json_load, dump as _json_dump, loads, dumps
+from multiprocessing.pool import ThreadPool
+from shutil import copyfileobj, rmtree as _rmdir
+
+from .exceptions import GitMLException
+from .catalog import Catalog
+from .manifest import Manifest
+from .delta import (DeltaSource, DeltaException, open_artifact,
+	stored_path, digest as artifact_digest)
+from .project import Project
+from .util import *
+
+try:
+	import boto3
+except ImportError:
+	boto3 = None
+
+
+class RemoteException(GitMLException):
+	pass
+
+
+class Remote(object):
+	"""Shared store of iterations. Objects (models, manifests and code
+	files) are stored once by their sha1 digest under "objects/" and
+	records under "records/<id>.json".
+	"""
+
+	SECTION = "remotes"
+
+	DEFAULT_NAME = "origin"
+
+	CHUNK_SIZE = 8 * 1024 * 1024
+
+	# Objects of a readable remote are opened in place on pull, not
+	# downloaded first.
+	readable = False
+
+	@classmethod
+	def from_project_config(cls, config, name=None):
+		name = name or cls.DEFAULT_NAME
+		remotes = config.get(cls.SECTION) or {}
+		if name not in remotes:
+			raise RemoteException("[GitML] No remote '%s' in %s." % (name,
+				Project.VML_FILE_NAME))
+		remote = remotes[name]
+		if not isinstance(remote, dict): remote = {"url": remote}
+		if remote["url"].startswith("s3://"): return S3Remote(**remote)
+		return FileRemote(**remote)
+
+
+	def _object_key(self, digest):
+		return "objects/%s/%s" % (digest[:2], digest)
+
+
+	def _record_key(self, unique_id):
+		return "records/%s.json" % unique_id
+
+
+class FileRemote(Remote):
+	"""Remote on a local or network (NFS) filesystem path. Copies go to
+	a ".part" file that is resumed from its size, then renamed in place.
+	"""
+
+	def __init__(self, url):
+		if url.startswith("file://"): url = url[len("file://"):]
+		self.path = url
+
+
+	def _path(self, key):
+		return _path_join(self.path, *key.split("/"))
+
+
+	def has_objects(self, digests):
+		return set(d for d in digests
+			if _path_exists(self._path(self._object_key(d))))
+
+
+	def _copy(self, source, target):
+		create_dir_if_not_exist(_path_dirname(target))
+		part_path = "%s.part" % target
+		offset = getsize(part_path) if _path_exists(part_path) else 0
+		source.seek(offset)
+		with open(part_path, "ab") as part:
+			copyfileobj(source, part, self.CHUNK_SIZE)
+		_rename(part_path, target)
+
+
+	def put_object(self, digest, source):
+		self._copy(source, self._path(self._object_key(digest)))
+
+
+	def get_object(self, digest, target):
+		with open(self._path(self._object_key(digest)), "rb") as source:
+			self._copy(source, target)
+
+
+	def record_ids(self):
+		records_dir = self._path("records")
+		if not isdir(records_dir): return []
+		return [n[:-len(".json")] for n in listdir(records_dir)
+			if n.endswith(".json")]
+
+
+	def get_record(self, unique_id):
+		with _codecs_open(self._path(self._record_key(unique_id)), "r",
+			"utf-8") as record_file:
+			return _json_load(record_file)
+
+
+	def put_record(self, unique_id, record):
+		path = self._path(self._record_key(unique_id))
+		create_dir_if_not_exist(_path_dirname(path))
+		with _codecs_open("%s.tmp" % path, "w", "utf-8") as record_file:
+			_json_dump(record, record_file)
+		_rename("%s.tmp" % path, path)
+
+
+class S3Remote(Remote):
+	"""Remote on an S3 compatible object store, i.e "s3://bucket/prefix"
+	with an optional "endpoint_url" for minio or a local stand-in server.
+	Big objects are sent as multipart uploads resumed from the parts
+	already uploaded, and fetched with ranged reads resumed from the
+	".part" file.
+	"""
+
+	def __init__(self, url, endpoint_url=None, region=None):
+		if not boto3:
+			raise RemoteException("[GitML] S3 remotes need boto3. " + \
+				"Try 'pip install boto3'.")
+		bucket_prefix = url[len("s3://"):].split("/", 1)
+		self.bucket = bucket_prefix[0]
+		self.prefix = bucket_prefix[1].strip("/") + "/" \
+			if len(bucket_prefix) > 1 and bucket_prefix[1].strip("/") else ""
+		self.client = boto3.client("s3", endpoint_url=endpoint_url,
+			region_name=region)
+
+
+	def _keys(self, prefix):
+		paginator = self.client.get_paginator("list_objects_v2")
+		for page in paginator.paginate(Bucket=self.bucket,
+			Prefix=self.prefix + prefix):
+			for item in page.get("Contents", []):
+				yield item["Key"][len(self.prefix):]
+
+
+	def has_objects(self, digests):
+		# One listing instead of a request per object.
+		present = set(k.rsplit("/", 1)[-1] for k in self._keys("objects/"))
+		return set(digests) & present
+
+
+	def _resume_upload(self, key):
+		uploads = self.client.list_multipart_uploads(Bucket=self.bucket,
+			Prefix=key).get("Uploads", [])
+		for upload in uploads:
+			if upload["Key"] != key: continue
+			parts = self.client.list_parts(Bucket=self.bucket, Key=key,
+				UploadId=upload["UploadId"]).get("Parts", [])
+			return upload["UploadId"], dict((p["PartNumber"], p["ETag"])
+				for p in parts)
+		return self.client.create_multipart_upload(Bucket=self.bucket,
+			Key=key)["UploadId"], {}
+
+
+	def put_object(self, digest, source):
+		key = self.prefix + self._object_key(digest)
+		source.seek(0, 2)
+		size = source.tell()
+		source.seek(0)
+		if size <= self.CHUNK_SIZE:
+			self.client.put_object(Bucket=self.bucket, Key=key,
+				Body=source.read())
+			return
+
+		upload_id, done = self._resume_upload(key)
+		parts, number = [], 1
+		while number * self.CHUNK_SIZE - self.CHUNK_SIZE < size:
+			if number not in done:
+				source.seek((number - 1) * self.CHUNK_SIZE)
+				done[number] = self.client.upload_part(Bucket=self.bucket,
+					Key=key, UploadId=upload_id, PartNumber=number,
+					Body=source.read(self.CHUNK_SIZE))["ETag"]
+			parts.append({"PartNumber": number, "ETag": done[number]})
+			number += 1
+		self.client.complete_multipart_upload(Bucket=self.bucket, Key=key,
+			UploadId=upload_id, MultipartUpload={"Parts": parts})
+
+
+	def get_object(self, digest, target):
+		create_dir_if_not_exist(_path_dirname(target))
+		part_path = "%s.part" % target
+		offset = getsize(part_path) if _path_exists(part_path) else 0
+		request = {"Bucket": self.bucket,
+			"Key": self.prefix + self._object_key(digest)}
+		# Ranged only when resuming, empty objects have no byte 0.
+		if offset: request["Range"] = "bytes=%d-" % offset
+		response = self.client.get_object(**request)
+		with open(part_path, "ab") as part:
+			for chunk in iter(lambda: response["Body"].read(
+				self.CHUNK_SIZE), b""):
+				part.write(chunk)
+		_rename(part_path, target)
+
+
+	def record_ids(self):
+		return [k[len("records/"):-len(".json")]
+			for k in self._keys("records/") if k.endswith(".json")]
+
+
+	def get_record(self, unique_id):
+		body = self.client.get_object(Bucket=self.bucket,
+			Key=self.prefix + self._record_key(unique_id))["Body"].read()
+		return loads(body.decode("utf-8"))
+
+
+	def put_record(self, unique_id, record):
+		self.client.put_object(Bucket=self.bucket,
+			Key=self.prefix + self._record_key(unique_id),
+			Body=dumps(record).encode("utf-8"))
+
+
+class Sync(object):
+	"""Pushes and pulls iterations between the project and a remote.
+	Only objects missing on the other side are transferred, on a thread
+	pool. Records are sent after their objects, so a record on either
+	side never refers to a missing object.
+	"""
+
+	# Downloads in progress, resumed on the next pull.
+	DOWNLOAD_DIR = ".remote"
+
+	def __init__(self, iteration, remote, workers=4):
+		self.iteration = iteration
+		self.remote = remote
+		self.workers = workers
+		self.download_dir = _path_join(iteration.project_path,
+			Project.VML_DIR_NAME, self.DOWNLOAD_DIR)
+		self.transferred = 0
+		self.skipped = 0
+
+
+	def _parallel(self, func, items):
+		if not items: return []
+		pool = ThreadPool(max(1, min(self.workers, len(items))))
+		try: return pool.map(func, items)
+		finally:
+			pool.close()
+			pool.join()
+
+
+	def _local_records(self, unique_ids=None):
+		it = self.iteration
+		records = []
+		for kind, _db in (("iteration", it.db), ("commit", it.commit_db)):
+			for record in _db.all():
+				records.append((kind, record))
+		if not unique_ids: return records
+
+		selected = set()
+		for unique_id in unique_ids:
+			resolved, _ = it._resolve(unique_id)
+			if not resolved:
+				raise RemoteException("[GitML] Invalid iteration id %s." % \
+					unique_id)
+			selected.add(resolved)
+		return [(k, r) for k, r in records if r["id"] in selected]
+
+
+	def _artifacts(self, kind, record):
+		# Returns the {relative path: digest} of an iteration and the
+		# sources {digest: opener} to read them from.
+		it = self.iteration
+		artifact_dir = it._artifact_dir(it.project_path, record["id"], kind)
+		checksums = record.get("checksums") or {}
+		manifest = it._manifest(record["id"], kind)
+		manifest_path = _path_join(artifact_dir, Manifest.FILE_NAME)
+		model_path = stored_path(_path_join(artifact_dir, it.MODEL_FILE_NAME))
+		for path in (model_path, manifest_path):
+			if not _path_exists(path):
+				raise RemoteException("[GitML] Missing %s of %s." % (path,
+					record["id"]))
+
+		# Deltas are pushed whole, objects never depend on each other.
+		files = {
+			it.MODEL_FILE_NAME: checksums.get(it.MODEL_FILE_NAME) or \
+				artifact_digest(model_path),
+			Manifest.FILE_NAME: checksums.get(Manifest.FILE_NAME) or \
+				file_digest(manifest_path)
+		}
+		sources = {
+			files[it.MODEL_FILE_NAME]: _artifact_opener(model_path),
+			files[Manifest.FILE_NAME]: _file_opener(manifest_path)
+		}
+		code_path = _path_join(artifact_dir, it.CODE_DIR_NAME)
+		for rel_path, (size, digest) in manifest.entries.items():
+			path = _path_join(code_path, rel_path)
+			if _path_exists(path): sources[digest] = _file_opener(path)
+			elif _path_exists(path + DeltaSource.SUFFIX):
+				sources[digest] = _artifact_opener(path + DeltaSource.SUFFIX)
+			elif it.packs.has(digest):
+				sources[digest] = _pack_opener(it.packs, digest)
+			else:
+				raise RemoteException("[GitML] Missing %s of %s." % (path,
+					record["id"]))
+		return files, sources
+
+
+	def push(self, unique_ids=None):
+		records = self._local_records(unique_ids)
+		remote_ids = set(self.remote.record_ids())
+
+		sources, pushed = {}, []
+		for kind, record in records:
+			# Broken iterations are left out, as fsck reports them.
+			try: files, _sources = self._artifacts(kind, record)
+			except (RemoteException, DeltaException, IOError, OSError) as e:
+				log_message("%s Skipped, run gitml fsck." % e)
+				continue
+			sources.update(_sources)
+			pushed.append((record["id"], {"kind": kind, "record": record,
+				"files": files}))
+
+		missing = set(sources) - self.remote.has_objects(sources.keys())
+		self.skipped = len(sources) - len(missing)
+
+		def _put(digest):
+			with sources[digest]() as source:
+				self.remote.put_object(digest, source)
+		self._parallel(_put, sorted(missing))
+		self.transferred = len(missing)
+
+		for unique_id, remote_record in pushed:
+			if unique_id in remote_ids and self.remote.get_record(
+				unique_id)["kind"] == remote_record["kind"]:
+				continue
+			self.remote.put_record(unique_id, remote_record)
+		return [unique_id for unique_id, _ in pushed]
+
+
+	def _local_objects(self):
+		# {digest: opener} of everything the project has already.
+		local = {}
+		for kind, record in self._local_records():
+			try: local.update(self._artifacts(kind, record)[1])
+			except (RemoteException, DeltaException, IOError, OSError):
+				continue
+		return local
+
+
+	def _object_path(self, digest):
+		return _path_join(self.download_dir, digest)
+
+
+	def pull(self, unique_ids=None):
+		it = self.iteration
+		remote_ids = self.remote.record_ids()
+		if unique_ids:
+			remote_ids = [r for r in remote_ids
+				if any(r.startswith(u) for u in unique_ids)]
+
+		# Ids are unique across machines, known ones are kept as is.
+		remote_ids = [r for r in remote_ids if not it.index.matches(r)]
+		remote_records = [self.remote.get_record(r) for r in remote_ids]
+		if not remote_records: return []
+
+		local = self._local_objects()
+		create_dir_if_not_exist(self.download_dir)
+		fetch = self._fetch if not self.remote.readable else lambda d: None
+
+		# Manifests first, they list the code files to fetch.
+		manifests = [r["files"][Manifest.FILE_NAME] for r in remote_records]
+		self._parallel(fetch, [d for d in set(manifests) if d not in local
+			and not _path_exists(self._object_path(d))])
+
+		needed = set()
+		for remote_record in remote_records:
+			files = remote_record["files"]
+			needed.add(files[it.MODEL_FILE_NAME])
+			manifest = self._load_manifest(files[Manifest.FILE_NAME], local)
+			needed.update(e[1] for e in manifest.entries.values())
+		missing = sorted(d for d in needed if d not in local)
+		self.skipped = len(needed) - len(missing)
+		self._parallel(fetch, [d for d in missing
+			if not _path_exists(self._object_path(d))])
+		self.transferred = len(missing)
+
+		for remote_record in remote_records:
+			self._assemble(remote_record, local)
+		_rmdir(self.download_dir)
+		return [r["record"]["id"] for r in remote_records]
+
+
+	def _fetch(self, digest):
+		path = self._object_path(digest)
+		self.remote.get_object(digest, path)
+		if file_digest(path) != digest:
+			remove(path)
+			raise RemoteException("[GitML] Corrupt object %s on remote." % \
+				digest)
+
+
+	def _open_object(self, digest, local):
+		if digest in local: return local[digest]()
+		if self.remote.readable: return self.remote.open_object(digest)
+		return open(self._object_path(digest), "rb")
+
+
+	def _load_manifest(self, digest, local):
+		with self._open_object(digest, local) as manifest_file:
+			return Manifest(loads(manifest_file.read().decode("utf-8")))
+
+
+	def _write_object(self, digest, local, target):
+		create_dir_if_not_exist(_path_dirname(target))
+		with self._open_object(digest, local) as source:
+			with open(target, "wb") as destination:
+				copyfileobj(source, destination)
+
+
+	def _assemble(self, remote_record, local):
+		# Writes the iteration in a staging directory, then adds it.
+		it = self.iteration
+		kind, record = remote_record["kind"], remote_record["record"]
+		files = remote_record["files"]
+		artifact_dir = it._artifact_dir(it.project_path, record["id"], kind)
+		staging_dir = artifact_dir + it.PARTIAL_SUFFIX
+		if isdir(staging_dir): _rmdir(staging_dir)
+
+		for rel_path, digest in files.items():
+			self._write_object(digest, local, _path_join(staging_dir, rel_path))
+		manifest = self._load_manifest(files[Manifest.FILE_NAME], local)
+		code_path = _path_join(staging_dir, it.CODE_DIR_NAME)
+		create_dir_if_not_exist(code_path)
+		for rel_path, (size, digest) in manifest.entries.items():
+			self._write_object(digest, local, _path_join(code_path, rel_path))
+
+		_rename(staging_dir, artifact_dir)
+		(it.commit_db if kind == "commit" else it.db).insert(record)
+		it.index.add(record["id"], kind)
+		it._search_index().add(record, kind).flush()
+		Catalog.update("add", it.project_path, [record], kind)
+
+
+def _file_opener(path):
+	return lambda: open(path, "rb")
+
+
+def _artifact_opener(path):
+	return lambda: open_artifact(path)
+
+
+def _pack_opener(packs, digest):
+	return lambda: BytesIO(packs.read(digest))
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+from numbers import Number
+
+from .util import *
+
+
+class RetentionPolicy(object):
+	"""Retention rules of the "retention" section in gitml.json. i.e
+
+	"retention": {
+		"keep_top": {"metric": "auc", "count": 20, "order": "desc"},
+		"keep_days": 7,
+		"max_size": "200GB"
+	}
+
+	Iterations in the top by metric or newer than keep_days are kept,
+	every other iteration is evicted. If the store is still above
+	max_size, kept iterations outside the top are evicted oldest first.
+	The latest iteration and commits are never evicted.
+	"""
+
+	SECTION = "retention"
+
+	def __init__(self, config=None):
+		config = config or {}
+		keep_top = config.get("keep_top") or []
+		if isinstance(keep_top, dict): keep_top = [keep_top]
+		self.keep_top = keep_top
+		self.keep_days = config.get("keep_days")
+		self.max_size = parse_size(config.get("max_size"))
+
+
+	@classmethod
+	def from_project_config(cls, config):
+		return cls(config.get(cls.SECTION))
+
+
+	def enabled(self):
+		return bool(self.keep_top or self.keep_days is not None
+			or self.max_size is not None)
+
+
+	def _top(self, records, rule):
+		metric = rule["metric"]
+		reverse = rule.get("order", "desc") != "asc"
+		scored = [r for r in records
+			if isinstance((r.get("metrics") or {}).get(metric), Number)]
+		scored.sort(key=lambda r: r["metrics"][metric], reverse=reverse)
+		return set(r["id"] for r in scored[:int(rule.get("count", 1))])
+
+
+	def plan(self, records, sizes, fixed_size=0):
+		"""Returns [(record, size, reason)] of iterations to evict.
+		sizes maps iteration ids to bytes, fixed_size is the size of what
+		can never be evicted, i.e commits.
+		"""
+		if not self.enabled() or not records: return []
+
+		records = sorted(records, key=lambda r: r["timestamp"],
+			reverse=True)
+		top = set()
+		for rule in self.keep_top: top |= self._top(records, rule)
+
+		recent = set([records[0]["id"]])
+		if self.keep_days is not None:
+			cutoff = (datetime.now() - timedelta(days=self.keep_days)
+				).strftime("%Y%m%d%H%M%S")
+			recent |= set(r["id"] for r in records
+				if r["timestamp"] >= cutoff)
+
+		evict, kept = [], []
+		for record in records:
+			if record["id"] in top or record["id"] in recent:
+				kept.append(record)
+			elif self.keep_top or self.keep_days is not None:
+				evict.append((record, sizes.get(record["id"], 0), "policy"))
+			else:
+				kept.append(record)
+
+		if self.max_size is None: return evict
+
+		total = fixed_size + sum(sizes.get(r["id"], 0) for r in kept)
+		# Oldest first, never the top or the latest iteration.
+		for record in reversed(kept):
+			if total <= self.max_size: break
+			if record["id"] in top or record["id"] == records[0]["id"]:
+				continue
+			size = sizes.get(record["id"], 0)
+			evict.append((record, size, "quota"))
+			total -= size
+		return evict
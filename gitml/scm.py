@@ -4,6 +4,7 @@ from codecs import open
 
 from .exceptions import GitMLException
 from .util import log_message, touch
+from .trace import tracer
 
 class InvalidGitRepositoryError(GitMLException):
     pass
@@ -30,6 +31,11 @@ class Git(object):
 
 
     def __init__(self, root_dir=os.curdir):
+        with tracer.span("git.open"):
+            self._open(root_dir)
+
+
+    def _open(self, root_dir):
         self.root_dir = os.path.abspath(os.path.realpath(root_dir))
         self.ignore_file = os.path.join(self.root_dir, 
             self.IGNORE_FILE)
@@ -79,16 +85,19 @@ class Git(object):
 
 
     def add(self, paths):
-        self.repo.index.add(paths)
+        with tracer.span("git.add", files=len(paths)):
+            self.repo.index.add(paths)
 
 
     def add_all(self):
-        self.repo.git.add("-A")
+        with tracer.span("git.add_all"):
+            self.repo.git.add("-A")
 
 
     def commit(self, msg):
         # Returns commit id.
-        return str(self.repo.index.commit(msg))
+        with tracer.span("git.commit"):
+            return str(self.repo.index.commit(msg))
 
 
     def commit_all(self, msg):
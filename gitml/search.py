@@ -0,0 +1,265 @@
+from os import listdir, rename as _rename
+from os.path import join as _path_join, exists as _path_exists
+from json import loads as _json_loads, dumps as _json_dumps
+from re import compile as _re_compile
+from zlib import crc32
+from math import log
+
+from .db import DataModel
+from .util import *
+
+
+class SearchIndex(object):
+	"""Inverted index of iteration and commit records kept in the data
+	directory. Terms are the words of remarks, the keys and values of
+	params ("lr", "0.1" and "lr=0.1") and the keys of metrics.
+
+	Postings {term: "id:frequency:length ..."} are strings, which JSON
+	decodes and encodes at memory speed for the terms of most records,
+	i.e "run" or "lr". They are sharded
+	into BUCKETS files by a hash of the term, and the records into
+	DOC_BUCKETS files by a hash of their id. A save or a commit
+	rewrites only the few files of its terms and id, and a lookup reads
+	the buckets of the query terms plus the records it shows. Results
+	are ranked with BM25.
+	"""
+
+	DIR_NAME = "search"
+
+	STATS_FILE_NAME = "stats.json"
+
+	BUCKETS = 256
+
+	# Ids of a session share their leading characters, records are
+	# sharded by a hash of the id too.
+	DOC_BUCKETS = 256
+
+	K1 = 1.2
+
+	B = 0.75
+
+	# Records matched by rarer terms looked up in the postings string of
+	# a common term, more are scored by splitting it.
+	LOOKUPS = 256
+
+	TOKEN = _re_compile(r"[\w.\-]+")
+
+	def __init__(self, project_path):
+		self.dir = _path_join(project_path, DataModel.DATA_DIR, self.DIR_NAME)
+		self._files = {}
+		self._dirty = set()
+
+
+	def exists(self):
+		return _path_exists(_path_join(self.dir, self.STATS_FILE_NAME))
+
+
+	@classmethod
+	def tokens(cls, text):
+		return [t.strip(".-") for t in cls.TOKEN.findall(
+			("%s" % text).lower()) if t.strip(".-")]
+
+
+	@classmethod
+	def terms(cls, record):
+		terms = cls.tokens(record.get("remarks") or "")
+		for key, value in (record.get("params") or {}).items():
+			terms += cls.tokens(key) + cls.tokens(value)
+			terms.append(("%s=%s" % (key, value)).lower())
+		for key in (record.get("metrics") or {}):
+			terms += cls.tokens(key)
+		return terms
+
+
+	@classmethod
+	def _hash(cls, text, buckets):
+		return (crc32(text.encode("utf-8")) & 0xffffffff) % buckets
+
+
+	def _bucket_name(self, term):
+		return "terms-%02x.json" % self._hash(term, self.BUCKETS)
+
+
+	def _doc_name(self, unique_id):
+		return "docs-%02x.json" % self._hash(unique_id, self.DOC_BUCKETS)
+
+
+	def _read(self, name, default):
+		if name not in self._files:
+			path = _path_join(self.dir, name)
+			self._files[name] = default
+			if _path_exists(path):
+				try:
+					with open(path, "rb") as shard_file:
+						self._files[name] = _json_loads(
+							shard_file.read().decode("utf-8"))
+				except ValueError:
+					pass
+		return self._files[name]
+
+
+	def _write(self, name):
+		self._dirty.add(name)
+		return self._files[name]
+
+
+	def flush(self):
+		# Shards are replaced atomically. dumps encodes in C, dump does not.
+		create_dir_if_not_exist(self.dir)
+		for name in self._dirty:
+			path = _path_join(self.dir, name)
+			with open("%s.tmp" % path, "wb") as shard_file:
+				shard_file.write(_json_dumps(self._files[name]).encode("utf-8"))
+			_rename("%s.tmp" % path, path)
+		self._dirty = set()
+		return self
+
+
+	def _stats(self):
+		return self._read(self.STATS_FILE_NAME, {"docs": 0, "length": 0})
+
+
+	def _document(self, record, kind):
+		# Returns the postings and the shown fields of a record.
+		terms = self.terms(record)
+		frequencies = {}
+		for term in terms: frequencies[term] = frequencies.get(term, 0) + 1
+		postings = dict((term, "%s:%d:%d" % (record["id"], frequency,
+			len(terms))) for term, frequency in frequencies.items())
+
+		return postings, {"kind": kind, "terms": sorted(frequencies),
+			"length": len(terms), "remarks": record.get("remarks") or "",
+			"params": printable_dict(record.get("params") or {}),
+			"timestamp": record.get("timestamp")}
+
+
+	def add(self, record, kind="iteration"):
+		unique_id = record["id"]
+		self.remove(unique_id)
+		postings, doc = self._document(record, kind)
+		for term, posting in postings.items():
+			bucket = self._read(self._bucket_name(term), {})
+			bucket[term] = ("%s %s" % (bucket.get(term, ""), posting)).lstrip()
+			self._write(self._bucket_name(term))
+
+		self._read(self._doc_name(unique_id), {})[unique_id] = doc
+		self._write(self._doc_name(unique_id))
+
+		stats = self._stats()
+		stats["docs"] += 1
+		stats["length"] += doc["length"]
+		self._write(self.STATS_FILE_NAME)
+		return self
+
+
+	def remove(self, unique_id):
+		docs = self._read(self._doc_name(unique_id), {})
+		doc = docs.pop(unique_id, None)
+		if not doc: return self
+		self._write(self._doc_name(unique_id))
+
+		for term in doc["terms"]:
+			bucket = self._read(self._bucket_name(term), {})
+			prefix = "%s:" % unique_id
+			postings = " ".join(p for p in bucket.get(term, "").split()
+				if not p.startswith(prefix))
+			if postings: bucket[term] = postings
+			else: bucket.pop(term, None)
+			self._write(self._bucket_name(term))
+
+		stats = self._stats()
+		stats["docs"] = max(0, stats["docs"] - 1)
+		stats["length"] = max(0, stats["length"] - doc["length"])
+		self._write(self.STATS_FILE_NAME)
+		return self
+
+
+	def set_kind(self, unique_id, kind):
+		doc = self._read(self._doc_name(unique_id), {}).get(unique_id)
+		if doc:
+			doc["kind"] = kind
+			self._write(self._doc_name(unique_id))
+		return self
+
+
+	def rebuild(self, iteration_records, commit_records):
+		self._files = {}
+		self._dirty = set()
+		if _path_exists(self.dir):
+			for name in listdir(self.dir):
+				if name.endswith(".json"): self._files[name] = {}
+		stats = self._files[self.STATS_FILE_NAME] = {"docs": 0, "length": 0}
+
+		# Postings are joined once, not appended per record.
+		all_postings = {}
+		for kind, records in (("iteration", iteration_records),
+			("commit", commit_records)):
+			for record in records:
+				postings, doc = self._document(record, kind)
+				for term, posting in postings.items():
+					all_postings.setdefault(term, []).append(posting)
+				self._files.setdefault(self._doc_name(record["id"]),
+					{})[record["id"]] = doc
+				stats["docs"] += 1
+				stats["length"] += doc["length"]
+
+		for term, postings in all_postings.items():
+			self._files.setdefault(self._bucket_name(term),
+				{})[term] = " ".join(postings)
+		self._dirty = set(self._files)
+		return self.flush()
+
+
+	def _score(self, idf, frequency, length, average):
+		frequency = int(frequency)
+		return idf * frequency * (self.K1 + 1) / (frequency + self.K1 * \
+			(1 - self.B + self.B * int(length) / average))
+
+
+	def _scores(self, idf, postings, average, only=None):
+		# Yields (id, score) of space separated postings, scores of the
+		# same frequency and length computed once.
+		cache = {}
+		for posting in postings.split():
+			unique_id, pair = posting.split(":", 1)
+			if only is not None and unique_id not in only: continue
+			if pair not in cache:
+				cache[pair] = self._score(idf, *pair.split(":") + [average])
+			yield unique_id, cache[pair]
+
+
+	def search(self, query, limit=10):
+		"""Returns [(score, id, doc)] of the best matching records. Terms
+		are scored rarest first, a term of most records only adds to the
+		records matched by rarer terms.
+		"""
+		stats = self._stats()
+		if not stats["docs"]: return []
+		average = float(stats["length"]) / stats["docs"] or 1.0
+
+		matches = []
+		for term in set(self.tokens(query) + [t.lower() for t in
+			query.split() if "=" in t]):
+			postings = self._read(self._bucket_name(term), {}).get(term)
+			if postings: matches.append((postings.count(" ") + 1, postings))
+
+		scores = {}
+		for count, postings in sorted(matches, key=lambda m: m[0]):
+			idf = log(1 + (stats["docs"] - count + 0.5) / (count + 0.5))
+			common = scores and count > stats["docs"] // 2
+			if common and len(scores) <= self.LOOKUPS:
+				postings = " %s " % postings
+				for unique_id in scores:
+					start = postings.find(" %s:" % unique_id)
+					if start < 0: continue
+					posting = postings[start + 1:postings.index(" ", start + 1)]
+					scores[unique_id] += self._score(idf,
+						*posting.split(":")[1:] + [average])
+				continue
+			for unique_id, score in self._scores(idf, postings, average,
+				scores if common else None):
+				scores[unique_id] = scores.get(unique_id, 0) + score
+
+		best = sorted(scores.items(), key=lambda s: (-s[1], s[0]))[:limit]
+		return [(score, unique_id, self._read(self._doc_name(unique_id),
+			{}).get(unique_id, {})) for unique_id, score in best]
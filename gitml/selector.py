@@ -0,0 +1,73 @@
+from json import loads as _json_loads
+from re import compile as _re_compile
+from numbers import Number
+
+from .exceptions import GitMLException
+
+
+class SelectorException(GitMLException):
+	pass
+
+
+class Selector(object):
+	"""Filter of records by comma separated conditions, all of which
+	must hold. i.e
+
+	metrics.auc>=0.93,params.loss=focal,remarks~baseline
+
+	Fields are id, remarks, timestamp or params, metrics and data keys.
+	Operators are = != > >= < <= and ~ (contains). Values are read as
+	JSON when possible, so numbers compare as numbers.
+	"""
+
+	CONDITION = _re_compile(r"^\s*([\w.\-/]+)\s*(!=|>=|<=|=|>|<|~)\s*(.*?)\s*$")
+
+	OPERATORS = {
+		"=": lambda a, b: a == b,
+		"!=": lambda a, b: a != b,
+		">": lambda a, b: a > b,
+		">=": lambda a, b: a >= b,
+		"<": lambda a, b: a < b,
+		"<=": lambda a, b: a <= b,
+		"~": lambda a, b: str(b) in str(a)
+	}
+
+	def __init__(self, expression):
+		self.expression = expression
+		self.conditions = [self._parse(c) for c in expression.split(",")
+			if c.strip()]
+		if not self.conditions:
+			raise SelectorException("[GitML] Empty selector.")
+
+
+	def _parse(self, condition):
+		match = self.CONDITION.match(condition)
+		if not match:
+			raise SelectorException("[GitML] Invalid condition %s." % \
+				condition.strip())
+		field, operator, value = match.groups()
+		try: value = _json_loads(value)
+		except ValueError: pass
+		return (field.split(".", 1), operator, value)
+
+
+	def _value(self, record, field):
+		value = record.get(field[0])
+		if len(field) > 1: value = (value or {}).get(field[1])
+		return value
+
+
+	def matches(self, record):
+		for field, operator, expected in self.conditions:
+			value = self._value(record, field)
+			if value is None: return False
+			# Numbers and strings are never ordered against each other.
+			if (operator in (">", ">=", "<", "<=")
+				and isinstance(value, Number) != isinstance(expected, Number)):
+				return False
+			if not self.OPERATORS[operator](value, expected): return False
+		return True
+
+
+	def filter(self, records):
+		return [record for record in records if self.matches(record)]
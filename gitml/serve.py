@@ -0,0 +1,420 @@
+import os
+import gc
+import signal
+from os.path import (
+	join as _path_join,
+	exists as _path_exists,
+	basename as _path_basename,
+	dirname as _path_dirname
+)
+from json import loads, dumps
+from socket import error as socket_error
+from multiprocessing.sharedctypes import RawArray
+from pickle import load as model_load
+from threading import Lock, Event, Thread
+from time import time
+from errno import EINTR, ECHILD
+
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn, UnixStreamServer
+	from Queue import Queue, Empty
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import ThreadingMixIn, UnixStreamServer
+	from queue import Queue, Empty
+
+from .exceptions import GitMLException
+from .project import Project
+from .iteration import Iteration
+from .delta import open_artifact
+from .util import *
+
+
+class ServeException(GitMLException):
+	pass
+
+
+class ServerMetrics(object):
+	"""Request, batch and latency counters of the workers, in memory
+	shared by the forked workers. Each worker writes its own slot, so
+	workers never wait for each other; any worker reads all slots to
+	answer /metrics.
+	"""
+
+	FIELDS = ["requests", "errors", "instances", "batches", "latency_ms"]
+
+	# Upper bounds in ms of the latency histogram, the last is unbounded.
+	BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+	def __init__(self, workers):
+		self.workers = workers
+		self.width = len(self.FIELDS) + len(self.BUCKETS) + 1
+		self.values = RawArray("d", workers * self.width)
+		self.started = time()
+		self.slot = 0
+		self._lock = Lock()
+
+
+	def _add(self, field, value):
+		self.values[self.slot * self.width + field] += value
+
+
+	def request(self, latency, instances, error=False):
+		latency_ms = latency * 1000
+		bucket = len(self.BUCKETS)
+		for position, bound in enumerate(self.BUCKETS):
+			if latency_ms <= bound:
+				bucket = position
+				break
+		with self._lock:
+			self._add(0, 1)
+			if error: self._add(1, 1)
+			self._add(2, instances)
+			self._add(4, latency_ms)
+			self._add(len(self.FIELDS) + bucket, 1)
+
+
+	def batch(self):
+		with self._lock: self._add(3, 1)
+
+
+	def _percentile(self, histogram, share):
+		total = sum(histogram)
+		if not total: return None
+		seen = 0
+		for position, count in enumerate(histogram):
+			seen += count
+			if seen >= share * total:
+				return self.BUCKETS[position] \
+					if position < len(self.BUCKETS) else None
+		return None
+
+
+	def snapshot(self):
+		totals = [0.0] * self.width
+		workers = []
+		for slot in range(self.workers):
+			values = self.values[slot * self.width:(slot + 1) * self.width]
+			totals = [a + b for a, b in zip(totals, values)]
+			workers.append(dict(zip(self.FIELDS[:4], [int(v) for v in
+				values[:4]])))
+
+		requests, errors, instances, batches, latency_ms = totals[:5]
+		histogram = totals[len(self.FIELDS):]
+		uptime = time() - self.started
+		return {"uptime_seconds": round(uptime, 3),
+			"requests": int(requests), "errors": int(errors),
+			"instances": int(instances), "batches": int(batches),
+			"requests_per_second": round(requests / uptime, 3) if uptime else 0,
+			"instances_per_second": round(instances / uptime, 3) \
+				if uptime else 0,
+			"mean_batch_size": round(instances / batches, 3) if batches else 0,
+			"mean_latency_ms": round(latency_ms / requests, 3) \
+				if requests else 0,
+			# Upper bounds of the histogram buckets, None is beyond the last.
+			"p50_latency_ms": self._percentile(histogram, 0.5),
+			"p95_latency_ms": self._percentile(histogram, 0.95),
+			"p99_latency_ms": self._percentile(histogram, 0.99),
+			"latency_histogram_ms": dict(zip([str(b) for b in self.BUCKETS] + \
+				["inf"], [int(c) for c in histogram])),
+			"workers": workers}
+
+
+class Batcher(object):
+	"""Runs predict requests of a model in batches. Concurrent requests
+	are queued and joined into one call of predict, until max_size
+	instances or max_wait seconds after the first one.
+	"""
+
+	def __init__(self, predict, max_size=32, max_wait=0.005, metrics=None):
+		self.predict = predict
+		self.max_size = max_size
+		self.max_wait = max_wait
+		self.metrics = metrics
+		self.queue = Queue()
+		self.thread = Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+
+	def submit(self, instances):
+		item = {"instances": instances, "done": Event()}
+		self.queue.put(item)
+		item["done"].wait()
+		if "error" in item: raise ServeException(item["error"])
+		return item["predictions"]
+
+
+	def _collect(self):
+		batch = [self.queue.get()]
+		size = len(batch[0]["instances"])
+		deadline = time() + self.max_wait
+		while size < self.max_size:
+			remaining = deadline - time()
+			if remaining <= 0: break
+			try: item = self.queue.get(timeout=remaining)
+			except Empty: break
+			batch.append(item)
+			size += len(item["instances"])
+		return batch
+
+
+	def _run(self):
+		while True:
+			batch = self._collect()
+			instances = [i for item in batch for i in item["instances"]]
+			try:
+				predictions = _jsonable(self.predict(instances))
+				if len(predictions) != len(instances):
+					raise ServeException("[GitML] predict returned %d " \
+						"predictions for %d instances." % (len(predictions),
+						len(instances)))
+			except Exception as e:
+				for item in batch:
+					item["error"] = "%s" % e
+					item["done"].set()
+				continue
+
+			if self.metrics: self.metrics.batch()
+			start = 0
+			for item in batch:
+				end = start + len(item["instances"])
+				item["predictions"] = predictions[start:end]
+				start = end
+				item["done"].set()
+
+
+def _jsonable(value):
+	# numpy arrays and scalars, as lists and numbers.
+	if hasattr(value, "tolist"): return value.tolist()
+	if isinstance(value, (list, tuple)): return [_jsonable(v) for v in value]
+	return value
+
+
+def _predictor(model):
+	# predict over a list of instances, i.e scikit-learn models, else the
+	# model called with the list.
+	if hasattr(model, "predict"): return model.predict
+	if callable(model): return model
+	raise ServeException("[GitML] Model of type %s has no predict." % \
+		type(model).__name__)
+
+
+class _Handler(BaseHTTPRequestHandler):
+	"""GET /models, GET /metrics and POST /models/<ID>/predict with
+	{"instances": [...]}, answered by {"predictions": [...]}.
+	"""
+
+	protocol_version = "HTTP/1.1"
+
+	def address_string(self):
+		# Unix socket clients have no address.
+		return self.client_address[0] if self.client_address else "unix"
+
+
+	def log_message(self, format, *args):
+		pass
+
+
+	def _reply(self, status, body):
+		data = dumps(body).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+
+	def do_GET(self):
+		worker = self.server.worker
+		if self.path == "/metrics":
+			return self._reply(200, worker.metrics.snapshot())
+		if self.path == "/models":
+			return self._reply(200, {"models": sorted(worker.models)})
+		self._reply(404, {"error": "[GitML] Not found %s." % self.path})
+
+
+	def do_POST(self):
+		worker = self.server.worker
+		started = time()
+		parts = self.path.strip("/").split("/")
+		length = int(self.headers.get("Content-Length") or 0)
+		body = self.rfile.read(length) if length else b""
+		if len(parts) != 3 or parts[0] != "models" or parts[2] != "predict":
+			return self._reply(404, {"error": "[GitML] Not found %s." % \
+				self.path})
+
+		instances = []
+		try:
+			batcher = worker.batcher(parts[1])
+			instances = loads(body.decode("utf-8"))["instances"]
+			if not isinstance(instances, list):
+				raise ValueError("instances is not a list")
+		except ServeException as e:
+			return self._reply(404, {"error": str(e)})
+		except (ValueError, KeyError, TypeError) as e:
+			worker.metrics.request(time() - started, 0, error=True)
+			return self._reply(400, {"error": "[GitML] Invalid request, " \
+				"%s." % e})
+
+		try: predictions = batcher.submit(instances)
+		except ServeException as e:
+			worker.metrics.request(time() - started, len(instances), error=True)
+			return self._reply(500, {"error": str(e)})
+		worker.metrics.request(time() - started, len(instances))
+		self._reply(200, {"predictions": predictions})
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 128
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+	daemon_threads = True
+	request_queue_size = 128
+
+
+class ModelServer(object):
+	"""Serves models of iterations and commits over HTTP and a Unix
+	socket. The parent process loads the models and binds the sockets,
+	then forks the workers, which share the loaded models copy-on-write
+	and accept from the same sockets. Workers that die are forked again.
+
+	Predict requests of a worker are batched per model by a Batcher, and
+	every worker counts into the shared ServerMetrics.
+	"""
+
+	SOCKET_FILE_NAME = "serve.sock"
+
+	def __init__(self, project_path, unique_ids, workers=2,
+		host="127.0.0.1", port=8000, socket_path=None, batch_size=32,
+		batch_wait=0.005):
+		self.project_path = project_path
+		self.unique_ids = unique_ids
+		self.workers = max(1, workers)
+		self.host = host
+		self.port = port
+		self.socket_path = socket_path or _path_join(project_path,
+			Project.VML_DIR_NAME, self.SOCKET_FILE_NAME)
+		self.batch_size = batch_size
+		self.batch_wait = batch_wait
+		self.models = {}
+		self.servers = []
+		self.children = {}
+		self.running = False
+		self.metrics = ServerMetrics(self.workers)
+		self._batchers = {}
+		self._batchers_lock = Lock()
+
+
+	def load(self):
+		# Models are keyed by their full id, given ids resolve by prefix.
+		paths = Iteration.locate_models(self.unique_ids, self.project_path)
+		for model_path in paths.values():
+			with open_artifact(model_path) as model_file:
+				model = model_load(model_file)
+			_predictor(model)
+			self.models[_path_basename(_path_dirname(model_path))] = model
+		return self
+
+
+	def _resolve(self, unique_id):
+		if unique_id in self.models: return unique_id
+		found = [i for i in self.models if i.startswith(unique_id)]
+		if len(found) != 1:
+			raise ServeException("[GitML] No model %s served." % unique_id)
+		return found[0]
+
+
+	def batcher(self, unique_id):
+		unique_id = self._resolve(unique_id)
+		with self._batchers_lock:
+			if unique_id not in self._batchers:
+				self._batchers[unique_id] = Batcher(_predictor(
+					self.models[unique_id]), self.batch_size, self.batch_wait,
+					self.metrics)
+			return self._batchers[unique_id]
+
+
+	def bind(self):
+		if self.port is None and not self.socket_path:
+			raise ServeException("[GitML] No port or socket to serve on.")
+		if self.port is not None:
+			self.servers.append(_HTTPServer((self.host, self.port), _Handler))
+		if self.socket_path:
+			# Left by a server that did not stop cleanly.
+			if _path_exists(self.socket_path): os.remove(self.socket_path)
+			self.servers.append(_UnixHTTPServer(self.socket_path, _Handler))
+			os.chmod(self.socket_path, 0o600)
+		for server in self.servers: server.worker = self
+		return self
+
+
+	def _fork(self, slot):
+		pid = os.fork()
+		if pid:
+			self.children[pid] = slot
+			return pid
+
+		# Worker, batcher threads start with its first requests.
+		signal.signal(signal.SIGTERM, signal.SIG_DFL)
+		signal.signal(signal.SIGINT, signal.SIG_DFL)
+		self.metrics.slot = slot
+		try:
+			for server in self.servers[1:]:
+				thread = Thread(target=server.serve_forever)
+				thread.daemon = True
+				thread.start()
+			self.servers[0].serve_forever()
+		finally:
+			os._exit(1)
+
+
+	def _stop(self, signum, frame):
+		self.running = False
+		for pid in list(self.children):
+			try: os.kill(pid, signal.SIGTERM)
+			except OSError: pass
+
+
+	def run(self):
+		self.load().bind()
+		# Objects loaded so far are left alone by the collector, which
+		# would otherwise copy their pages into every worker (python 3.7+).
+		if hasattr(gc, "freeze"): gc.freeze()
+
+		self.running = True
+		signal.signal(signal.SIGTERM, self._stop)
+		signal.signal(signal.SIGINT, self._stop)
+		for slot in range(self.workers): self._fork(slot)
+		log_message("Serving %s with %d workers on %s" % (", ".join(
+			sorted(self.models)), self.workers, ", ".join(
+			["http://%s:%s" % (self.host, self.port)] * (self.port is not None) + \
+			["unix:%s" % self.socket_path] * bool(self.socket_path))), tag=True)
+
+		try:
+			while self.children:
+				try: pid, status = os.wait()
+				except OSError as e:
+					if e.errno == EINTR: continue
+					if e.errno == ECHILD: break
+					raise
+				slot = self.children.pop(pid, None)
+				if self.running and slot is not None:
+					log_message("Worker %d exited, forking again." % pid,
+						tag=True)
+					self._fork(slot)
+		finally:
+			self._stop(None, None)
+			for server in self.servers: server.server_close()
+			if self.socket_path and _path_exists(self.socket_path):
+				os.remove(self.socket_path)
+
+
+def serve(project_path, unique_ids, **options):
+	try: ModelServer(project_path, unique_ids, **options).run()
+	except (ServeException, ValueError, socket_error) as e:
+		exit_with_message(str(e))
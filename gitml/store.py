@@ -0,0 +1,158 @@
+from os import listdir, remove, rename as _rename, fsync
+from os.path import join as _path_join, exists as _path_exists, getsize
+from codecs import open as _codecs_open
+from json import load as _json_load, dump as _json_dump
+from hashlib import sha1
+
+from .project import Project
+from .util import *
+
+
+class PackStore(object):
+	"""Pack files holding many small archived files, addressed by their
+	sha1 digest. Every "pack-<id>.pack" has an index "pack-<id>.idx" with
+	the offset and size of each object, so an object is read back with a
+	single seek, without unpacking.
+	"""
+
+	DIR_NAME = ".packs"
+
+	PACK_EXT = ".pack"
+
+	INDEX_EXT = ".idx"
+
+	def __init__(self, project_path):
+		self.dir = _path_join(project_path, Project.VML_DIR_NAME,
+			self.DIR_NAME)
+		self._objects = None
+
+
+	def packs(self):
+		# Pack paths having an index. A pack without one is garbage of
+		# an interrupted write.
+		if not _path_exists(self.dir): return []
+		names = set(listdir(self.dir))
+		return sorted(_path_join(self.dir, n) for n in names
+			if n.endswith(self.PACK_EXT)
+			and n[:-len(self.PACK_EXT)] + self.INDEX_EXT in names)
+
+
+	def _index_path(self, pack_path):
+		return pack_path[:-len(self.PACK_EXT)] + self.INDEX_EXT
+
+
+	def _read_index(self, pack_path):
+		with _codecs_open(self._index_path(pack_path), "r", "utf-8") as idx:
+			return _json_load(idx)
+
+
+	@property
+	def objects(self):
+		# {digest: (pack path, offset, size)}, loaded once.
+		if self._objects is None:
+			self._objects = {}
+			for pack_path in self.packs():
+				for digest, (offset, size) in self._read_index(
+					pack_path).items():
+					self._objects[digest] = (pack_path, offset, size)
+		return self._objects
+
+
+	def has(self, digest):
+		return digest in self.objects
+
+
+	def read(self, digest):
+		pack_path, offset, size = self.objects[digest]
+		with open(pack_path, "rb") as pack:
+			pack.seek(offset)
+			return pack.read(size)
+
+
+	def write_pack(self, objects):
+		"""Packs (digest, path) pairs not packed already. Files whose
+		content does not match their digest are skipped. Returns the
+		packed digests.
+		"""
+		objects = [(d, p) for d, p in objects if not self.has(d)]
+		if not objects: return []
+
+		create_dir_if_not_exist(self.dir)
+		pack_path = _path_join(self.dir, "pack-%s%s" % (
+			generate_unique_id(), self.PACK_EXT))
+
+		index, offset = {}, 0
+		with open(pack_path, "wb") as pack:
+			for digest, path in objects:
+				if digest in index: continue
+				with open(path, "rb") as _file: content = _file.read()
+				if sha1(content).hexdigest() != digest: continue
+				pack.write(content)
+				index[digest] = [offset, len(content)]
+				offset += len(content)
+			pack.flush()
+			fsync(pack.fileno())
+
+		# The index is written last, it marks the pack as complete.
+		self._write_index(pack_path, index)
+		for digest, (offset, size) in index.items():
+			self.objects[digest] = (pack_path, offset, size)
+		return list(index)
+
+
+	def _write_index(self, pack_path, index):
+		temp_path = "%s.tmp" % self._index_path(pack_path)
+		with _codecs_open(temp_path, "w", "utf-8") as idx:
+			_json_dump(index, idx)
+		_rename(temp_path, self._index_path(pack_path))
+
+
+	def dead(self, live):
+		"""Returns {pack path: (dead objects, dead bytes, pack bytes)} for
+		packs holding objects not in live.
+		"""
+		dead = {}
+		for pack_path in self.packs():
+			index = self._read_index(pack_path)
+			_dead = [d for d in index if d not in live]
+			if _dead:
+				dead[pack_path] = (len(_dead),
+					sum(index[d][1] for d in _dead), getsize(pack_path))
+		return dead
+
+
+	def repack(self, pack_path, live):
+		# Rewrites a pack with its live objects only. The new pack is
+		# complete before the old one goes away.
+		index = self._read_index(pack_path)
+		keep = [d for d in index if d in live]
+
+		new_index, offset = {}, 0
+		if keep:
+			new_path = _path_join(self.dir, "pack-%s%s" % (
+				generate_unique_id(), self.PACK_EXT))
+			with open(pack_path, "rb") as old, open(new_path, "wb") as new:
+				for digest in keep:
+					old.seek(index[digest][0])
+					new.write(old.read(index[digest][1]))
+					new_index[digest] = [offset, index[digest][1]]
+					offset += index[digest][1]
+				new.flush()
+				fsync(new.fileno())
+			self._write_index(new_path, new_index)
+
+		remove(self._index_path(pack_path))
+		remove(pack_path)
+		for digest in index: self.objects.pop(digest, None)
+		for digest, (offset, size) in new_index.items():
+			self.objects[digest] = (new_path, offset, size)
+		return len(keep)
+
+
+	def garbage(self):
+		# Packs left without an index and temporary index files.
+		if not _path_exists(self.dir): return []
+		packs = set(self.packs())
+		return [_path_join(self.dir, n) for n in sorted(listdir(self.dir))
+			if n.endswith(".tmp") or (n.endswith(self.PACK_EXT)
+			and _path_join(self.dir, n) not in packs)]
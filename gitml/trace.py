@@ -0,0 +1,161 @@
+import os
+import atexit
+from json import dumps as _json_dumps, loads as _json_loads, \
+	dump as _json_dump
+from threading import Lock, local, current_thread
+from time import time
+
+
+class _NullSpan(object):
+	# Span of a disabled tracer, shared and doing nothing.
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		return False
+
+
+	def add(self, **counters):
+		return self
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+	"""Timed phase of an operation with counters, i.e bytes and files.
+	Emitted to the tracer when it ends.
+	"""
+
+	def __init__(self, tracer, name, counters):
+		self.tracer = tracer
+		self.name = name
+		self.counters = counters
+		self.start = None
+		self.parent = None
+
+
+	def __enter__(self):
+		stack = self.tracer._stack()
+		self.parent = stack[-1].name if stack else None
+		stack.append(self)
+		self.start = time()
+		return self
+
+
+	def add(self, **counters):
+		for key, value in counters.items():
+			self.counters[key] = self.counters.get(key, 0) + value
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		duration = time() - self.start
+		self.tracer._stack().pop()
+		event = {"name": self.name, "start": self.start,
+			"duration": duration, "pid": os.getpid(),
+			"tid": current_thread().ident, "parent": self.parent}
+		if self.counters: event["counters"] = self.counters
+		if type and not issubclass(type, SystemExit):
+			event["error"] = type.__name__
+		self.tracer._emit(event)
+		return False
+
+
+class Tracer(object):
+	"""Timed spans of gitml operations, written as JSON lines events to
+	a file. Off by default, enabled by the --profile option of the CLI or
+	the GITML_PROFILE environment variable (a file path, or 1 for
+	gitml-profile.jsonl). A disabled tracer hands out a shared null span,
+	so instrumented code costs a method call. Spans are also exported as
+	a Chrome trace (chrome://tracing) with --chrome-trace or
+	GITML_CHROME_TRACE.
+	"""
+
+	ENV = "GITML_PROFILE"
+
+	CHROME_ENV = "GITML_CHROME_TRACE"
+
+	DEFAULT_FILE_NAME = "gitml-profile.jsonl"
+
+	def __init__(self):
+		self.enabled = False
+		self.path = None
+		self.chrome_path = None
+		self.events = []
+		self._file = None
+		self._lock = Lock()
+		self._local = local()
+
+
+	@classmethod
+	def from_env(cls):
+		tracer = cls()
+		path, chrome_path = os.environ.get(cls.ENV), os.environ.get(
+			cls.CHROME_ENV)
+		if path or chrome_path:
+			tracer.enable(None if path in (None, "1") else path, chrome_path)
+		return tracer
+
+
+	def enable(self, path=None, chrome_path=None):
+		if self.enabled: self.close()
+		self.path = os.path.abspath(path or self.DEFAULT_FILE_NAME)
+		self.chrome_path = chrome_path and os.path.abspath(chrome_path)
+		self._file = open(self.path, "a")
+		self.enabled = True
+		atexit.register(self.close)
+		return self
+
+
+	def span(self, name, **counters):
+		if not self.enabled: return NULL_SPAN
+		return Span(self, name, counters)
+
+
+	def _stack(self):
+		if not hasattr(self._local, "stack"): self._local.stack = []
+		return self._local.stack
+
+
+	def _emit(self, event):
+		with self._lock:
+			if not self._file: return
+			self._file.write(_json_dumps(event) + "\n")
+			self._file.flush()
+			if self.chrome_path: self.events.append(event)
+
+
+	@classmethod
+	def chrome_trace(cls, events):
+		# Complete events of the Chrome trace format, times in us.
+		return {"traceEvents": [{"name": e["name"], "ph": "X",
+			"ts": int(e["start"] * 1e6), "dur": int(e["duration"] * 1e6),
+			"pid": e["pid"], "tid": e["tid"], "args": e.get("counters", {})}
+			for e in events], "displayTimeUnit": "ms"}
+
+
+	@classmethod
+	def export_chrome(cls, path, chrome_path):
+		# Converts a JSON lines profile into a Chrome trace.
+		with open(path) as profile_file:
+			events = [_json_loads(line) for line in profile_file if line.strip()]
+		with open(chrome_path, "w") as chrome_file:
+			_json_dump(cls.chrome_trace(events), chrome_file)
+		return chrome_path
+
+
+	def close(self):
+		with self._lock:
+			if not self._file: return
+			self._file.close()
+			self._file = None
+			self.enabled = False
+			if self.chrome_path:
+				with open(self.chrome_path, "w") as chrome_file:
+					_json_dump(self.chrome_trace(self.events), chrome_file)
+
+
+tracer = Tracer.from_env()
@@ -1,11 +1,14 @@
 from sys import exit
 from os.path import dirname, abspath, exists as _path_exists
 from os import makedirs
+import os
 from uuid import uuid1
 from terminaltables import AsciiTable, SingleTable
 from datetime import datetime
 from fnmatch import translate as _fn_translate
 from re import compile as _re_compile
+from hashlib import sha1
+from numbers import Number
 
 
 def log_message(message, tag=False):
@@ -125,3 +128,109 @@ def touch(path):
 	return path
 
 
+
+
+def dict_changes(a, b):
+	# Returns (key, a value, b value) for keys that differ.
+	changes = []
+	for key in sorted(set(a) | set(b)):
+		if a.get(key) != b.get(key):
+			changes.append((key, a.get(key, ""), b.get(key, "")))
+	return changes
+
+
+def file_digest(path, block_size=1024 * 1024):
+	# Sha1 hex digest of the file content, read block by block.
+	_hash = sha1()
+	with open(path, "rb") as _file:
+		for block in iter(lambda: _file.read(block_size), b""):
+			_hash.update(block)
+	return _hash.hexdigest()
+
+
+class HashedWriter(object):
+	"""File wrapper keeping the sha1 and the size of all writes. The file
+	is synced to disk on close.
+	"""
+
+	def __init__(self, _file):
+		self.file = _file
+		self.hash = sha1()
+		self.size = 0
+
+
+	def write(self, data):
+		self.hash.update(data)
+		self.size += len(data)
+		return self.file.write(data)
+
+
+	def hexdigest(self):
+		return self.hash.hexdigest()
+
+
+	def close(self):
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.file.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+
+def warm_file_cache(paths, block_size=4 * 1024 * 1024):
+	# Pulls the files into the OS page cache. Uses fadvise when the 
+	# platform has it, otherwise reads the files through.
+	for path in paths:
+		try:
+			with open(path, "rb") as _file:
+				if hasattr(os, "posix_fadvise"):
+					os.posix_fadvise(_file.fileno(), 0, 0,
+						os.POSIX_FADV_WILLNEED)
+					continue
+				while _file.read(block_size): pass
+		except (IOError, OSError):
+			# Missing files are reported on load, not on warm up.
+			continue
+
+
+def dir_size(path):
+	# Bytes used by the files under path, hard links counted once.
+	seen, size = set(), 0
+	for dir_path, _, file_names in os.walk(path):
+		for file_name in file_names:
+			try: st = os.lstat(os.path.join(dir_path, file_name))
+			except OSError: continue
+			if (st.st_dev, st.st_ino) in seen: continue
+			seen.add((st.st_dev, st.st_ino))
+			size += st.st_size
+	return size
+
+
+def remove_empty_dirs(path):
+	# Removes empty directories under path, bottom up, path included.
+	for dir_path, _, _ in os.walk(path, topdown=False):
+		try: os.rmdir(dir_path)
+		except OSError: pass
+
+
+def parse_size(size):
+	# i.e "200GB" -> bytes. Plain numbers are bytes.
+	if size is None or isinstance(size, Number): return size
+	size = size.strip().upper().rstrip("B")
+	units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+	if size and size[-1] in units:
+		return int(float(size[:-1]) * units[size[-1]])
+	return int(float(size))
+
+
+def human_size(size):
+	for unit in ["B", "KB", "MB", "GB"]:
+		if abs(size) < 1024.0: return "%.1f %s" % (size, unit)
+		size /= 1024.0
+	return "%.1f TB" % size
@@ -0,0 +1,185 @@
+import os
+import ctypes
+import ctypes.util
+from errno import EINTR
+from select import select
+from struct import calcsize, unpack_from
+from threading import Thread, Lock
+from os.path import join as _path_join, isdir, relpath as _relpath
+from shutil import ignore_patterns
+
+from .exceptions import GitMLException
+
+
+class WatchException(GitMLException):
+	pass
+
+
+class Inotify(object):
+	"""Minimal ctypes binding of Linux inotify."""
+
+	IN_MODIFY = 0x00000002
+	IN_ATTRIB = 0x00000004
+	IN_CLOSE_WRITE = 0x00000008
+	IN_MOVED_FROM = 0x00000040
+	IN_MOVED_TO = 0x00000080
+	IN_CREATE = 0x00000100
+	IN_DELETE = 0x00000200
+	IN_DELETE_SELF = 0x00000400
+	IN_MOVE_SELF = 0x00000800
+	IN_Q_OVERFLOW = 0x00004000
+	IN_IGNORED = 0x00008000
+	IN_ISDIR = 0x40000000
+
+	IN_CLOEXEC = 0o2000000
+
+	MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+		| IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+		| IN_MOVE_SELF)
+
+	EVENT_FORMAT = "iIII"
+
+	def __init__(self):
+		library = ctypes.util.find_library("c") or "libc.so.6"
+		try:
+			self.libc = ctypes.CDLL(library, use_errno=True)
+			self.libc.inotify_init1
+		except (OSError, AttributeError):
+			raise WatchException("[GitML] inotify is not available.")
+		self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+		if self.fd < 0: self._raise("inotify_init1")
+
+
+	def _raise(self, call):
+		errno = ctypes.get_errno()
+		raise WatchException("[GitML] %s failed: %s" % (call,
+			os.strerror(errno)))
+
+
+	def add_watch(self, path):
+		if not isinstance(path, bytes): path = path.encode("utf-8")
+		wd = self.libc.inotify_add_watch(self.fd, path, self.MASK)
+		if wd < 0: self._raise("inotify_add_watch")
+		return wd
+
+
+	def read(self, timeout=1.0):
+		"""Returns [(wd, mask, name)] of the pending events, waiting at
+		most timeout seconds.
+		"""
+		try:
+			if not select([self.fd], [], [], timeout)[0]: return []
+		except (OSError, IOError) as e:
+			if e.args[0] == EINTR: return []
+			raise
+		data = os.read(self.fd, 64 * 1024)
+
+		events, offset = [], 0
+		header = calcsize(self.EVENT_FORMAT)
+		while offset < len(data):
+			wd, mask, _, length = unpack_from(self.EVENT_FORMAT, data, offset)
+			name = data[offset + header:offset + header + length]
+			events.append((wd, mask, name.rstrip(b"\0").decode("utf-8",
+				"replace")))
+			offset += header + length
+		return events
+
+
+	def close(self):
+		os.close(self.fd)
+
+
+class Watcher(object):
+	"""Watches the workspace recursively and collects the paths changed
+	since the last drain. Ignored directories are not watched. When
+	events are lost (queue overflow, watch limits, .gitignore edits) the
+	next drain asks for a full scan. Ignores is a list of patterns or a
+	function returning them, called again when .gitignore changes.
+	"""
+
+	IGNORE_FILE_NAME = ".gitignore"
+
+	def __init__(self, root, ignores=[]):
+		self.root = root
+		self.ignores = ignores
+		self._load_ignores()
+		self.inotify = Inotify()
+		self.watches = {}
+		self.dirty = set()
+		self.full_scan = True
+		self.lock = Lock()
+		self.running = False
+		self.thread = None
+
+
+	def _load_ignores(self):
+		ignores = self.ignores() if callable(self.ignores) else self.ignores
+		self.ignore = ignore_patterns(*ignores)
+
+
+	def _watch_tree(self, path):
+		for dir_path, dir_names, _ in os.walk(path):
+			ignored = self.ignore(dir_path, dir_names)
+			dir_names[:] = [d for d in dir_names if d not in ignored]
+			try: self.watches[self.inotify.add_watch(dir_path)] = dir_path
+			except WatchException:
+				# i.e fs.inotify.max_user_watches reached.
+				self.full_scan = True
+
+
+	def start(self):
+		self._watch_tree(self.root)
+		self.running = True
+		self.thread = Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+
+	def _run(self):
+		while self.running:
+			for wd, mask, name in self.inotify.read():
+				self._handle(wd, mask, name)
+
+
+	def _handle(self, wd, mask, name):
+		if mask & Inotify.IN_Q_OVERFLOW:
+			with self.lock: self.full_scan = True
+			return
+		if mask & Inotify.IN_IGNORED:
+			self.watches.pop(wd, None)
+			return
+		if wd not in self.watches: return
+
+		path = _path_join(self.watches[wd], name) if name \
+			else self.watches[wd]
+		# Checked before the ignores, .gitignore is ignored itself.
+		if path == _path_join(self.root, self.IGNORE_FILE_NAME):
+			self._load_ignores()
+			# Directories it no longer ignores get watched.
+			self._watch_tree(self.root)
+			with self.lock: self.full_scan = True
+			return
+		if name and self.ignore(self.watches[wd], [name]): return
+		if (mask & Inotify.IN_ISDIR and mask & (Inotify.IN_CREATE
+			| Inotify.IN_MOVED_TO) and isdir(path)):
+			self._watch_tree(path)
+
+		rel_path = _relpath(path, self.root)
+		with self.lock:
+			if rel_path != ".": self.dirty.add(rel_path)
+
+
+	def drain(self):
+		"""Returns (changed paths, full scan needed) and starts over.
+		"""
+		with self.lock:
+			dirty, full_scan = self.dirty, self.full_scan
+			self.dirty, self.full_scan = set(), False
+		return dirty, full_scan
+
+
+	def stop(self):
+		self.running = False
+		if self.thread: self.thread.join()
+		self.inotify.close()
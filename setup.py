@@ -29,7 +29,7 @@ setup(
     ],
     keywords="version control release management data science \
     machine learning development",
-    packages=find_packages(exclude=["contrib", "docs", "tests"]),
+    packages=find_packages(exclude=["contrib", "docs", "tests", "benchmarks"]),
     install_requires=["tinydb", "docopt", "gitpython", "uuid", "terminaltables"],
     entry_points={
         "console_scripts": [
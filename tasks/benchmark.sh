@@ -0,0 +1,9 @@
+#!/bin/bash
+
+# Runs the benchmarks, comparing with a baseline results file if given.
+# i.e tasks/benchmark.sh benchmark-baseline.json
+if [ -n "$1" ]; then
+	python -m benchmarks.run --baseline="$1" "${@:2}"
+else
+	python -m benchmarks.run
+fi
\ No newline at end of file
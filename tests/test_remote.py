@@ -0,0 +1,73 @@
+import unittest
+from io import BytesIO
+from os.path import join as _path_join, exists as _path_exists
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from gitml.remote import S3Remote
+
+
+class InvalidRange(Exception):
+	pass
+
+
+class StandInS3(object):
+	"""In memory stand-in of the boto3 S3 client calls of S3Remote. Like
+	S3, a range starting at or past the end of an object is refused.
+	"""
+
+	def __init__(self):
+		self.objects = {}
+		self.requests = []
+
+
+	def put_object(self, Bucket, Key, Body):
+		self.objects[(Bucket, Key)] = Body
+
+
+	def get_object(self, Bucket, Key, Range=None):
+		self.requests.append(Range)
+		body = self.objects[(Bucket, Key)]
+		if Range is not None:
+			offset = int(Range[len("bytes="):].rstrip("-"))
+			if offset >= len(body): raise InvalidRange(Range)
+			body = body[offset:]
+		return {"Body": BytesIO(body)}
+
+
+class S3RemoteTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = mkdtemp()
+		# boto3 is optional, the client is replaced by the stand-in.
+		self.remote = S3Remote.__new__(S3Remote)
+		self.remote.bucket, self.remote.prefix = "bucket", "project/"
+		self.remote.client = StandInS3()
+
+
+	def tearDown(self):
+		rmtree(self.dir)
+
+
+	def test_get_empty_object(self):
+		self.remote.put_object("e" * 40, BytesIO(b""))
+		target = _path_join(self.dir, "objects", "empty")
+		self.remote.get_object("e" * 40, target)
+		with open(target, "rb") as target_file:
+			self.assertEqual(target_file.read(), b"")
+		self.assertEqual(self.remote.client.requests, [None])
+
+
+	def test_get_resumes_from_part(self):
+		self.remote.put_object("a" * 40, BytesIO(b"0123456789"))
+		target = _path_join(self.dir, "object")
+		with open("%s.part" % target, "wb") as part: part.write(b"0123")
+		self.remote.get_object("a" * 40, target)
+		with open(target, "rb") as target_file:
+			self.assertEqual(target_file.read(), b"0123456789")
+		self.assertEqual(self.remote.client.requests, ["bytes=4-"])
+		self.assertFalse(_path_exists("%s.part" % target))
+
+
+if __name__ == "__main__":
+	unittest.main()